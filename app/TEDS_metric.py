@@ -9,24 +9,104 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # Apache 2.0 License for more details.
 
+# Only what scoring tables needs is imported here: this module is loaded by the
+# server and by every scoring worker. lxml is imported on the first table that
+# misses the fast HTML parser, the other metrics live in app.other_metrics.
+
 import re
-import ast
-import json
-import ipdb
-import distance
+import threading
+from contextlib import contextmanager
 from apted import APTED, Config
-from itertools import product
 from apted.helpers import Tree
-from lxml import etree, html
-from collections import deque
-from app.parallel import parallel_process
-from tqdm import tqdm
-from zss import simple_distance, Node
-import string
-from typing import Any, Callable, Optional, Sequence
-import numpy as np
+from collections import Counter, deque
 import Levenshtein
-import editdistance
+
+
+# Global cell token vocabulary. Every token of a cell (a character or an inline
+# `<tag>` / `</tag>`) is interned to a small integer id, and a cell content is
+# stored as the str whose code points are those ids: a compact integer array
+# (1-4 bytes per token) that Levenshtein compares in C. Ids are assigned in
+# first-seen order and are only meaningful inside the process that made them.
+#
+# Submissions are untrusted, so the vocabulary must not grow for the life of a
+# worker: tables are scored inside cell_token_scope(), and once the vocabulary
+# holds more than _MAX_CELL_TOKENS tokens it is cleared as soon as no scope is
+# open. Interned contents (and trees holding them) are only valid within the
+# generation they were made in, see cell_token_generation().
+_TOKEN_CODES = {}
+_TOKEN_STRINGS = {}
+_TOKEN_LOCK = threading.Lock()
+_SURROGATES = range(0xD800, 0xE000)
+_MAX_CELL_TOKENS = 1 << 18
+_token_scopes = 0
+_token_generation = 0
+
+
+def _add_cell_token(token):
+    with _TOKEN_LOCK:
+        code = _TOKEN_CODES.get(token)
+        if code is None:
+            token_id = len(_TOKEN_CODES)
+            if token_id >= _SURROGATES.start:
+                token_id += len(_SURROGATES)
+            if token_id > 0x10FFFF:
+                raise ValueError('cell token vocabulary is full')
+            code = chr(token_id)
+            _TOKEN_STRINGS[code] = token
+            _TOKEN_CODES[token] = code
+        return code
+
+
+class _CharCodes(dict):
+    """ord(char) -> interned code, filled on demand by str.translate"""
+    def __missing__(self, char_ord):
+        code = self[char_ord] = _add_cell_token(chr(char_ord))
+        return code
+
+
+_CHAR_CODES = _CharCodes()
+
+
+def cell_token_generation():
+    """Changes whenever the vocabulary is cleared; contents interned before are invalid after."""
+    return _token_generation
+
+
+@contextmanager
+def cell_token_scope():
+    ''' Scoring that interns cells and compares them: the vocabulary is not
+        cleared while any scope is open, and is cleared when the last one
+        closes with more than _MAX_CELL_TOKENS tokens.
+    '''
+    global _token_scopes, _token_generation
+    with _TOKEN_LOCK:
+        _token_scopes += 1
+    try:
+        yield
+    finally:
+        with _TOKEN_LOCK:
+            _token_scopes -= 1
+            if not _token_scopes and len(_TOKEN_CODES) > _MAX_CELL_TOKENS:
+                _TOKEN_CODES.clear()
+                _TOKEN_STRINGS.clear()
+                _CHAR_CODES.clear()
+                _token_generation += 1
+
+
+def intern_cell_tokens(tokens):
+    """Interned content of a cell given as a list of token strings."""
+    codes = _TOKEN_CODES
+    return ''.join([codes.get(token) or _add_cell_token(token) for token in tokens])
+
+
+def intern_cell_text(text):
+    """Interned content of a plain text cell (one token per character)."""
+    return text.translate(_CHAR_CODES)
+
+
+def cell_tokens(content):
+    """Token strings of an interned cell content."""
+    return [_TOKEN_STRINGS[code] for code in content]
 
 
 class TableTree(Tree):
@@ -41,7 +121,7 @@ class TableTree(Tree):
         """Show tree using brackets notation"""
         if self.tag == 'td':
             result = '"tag": %s, "colspan": %d, "rowspan": %d, "text": %s' % \
-                     (self.tag, self.colspan, self.rowspan, self.content)
+                     (self.tag, self.colspan, self.rowspan, cell_tokens(self.content))
         else:
             result = '"tag": %s' % self.tag
         for child in self.children:
@@ -59,7 +139,7 @@ class CustomConfig(Config):
     def normalized_distance(self, *sequences):
         """Get distance from 0 to 1
         """
-        return float(distance.levenshtein(*sequences)) / self.maximum(*sequences)
+        return float(Levenshtein.distance(*sequences)) / self.maximum(*sequences)
 
     def rename(self, node1, node2):
         """Compares attributes of trees"""
@@ -100,11 +180,11 @@ class TEDS(object):
         global __tokens__
         if node.tag == 'td':
             if self.structure_only:
-                cell = []
+                cell = ''
             else:
                 self.__tokens__ = []
                 self.tokenize(node)
-                cell = self.__tokens__[1:-1].copy()
+                cell = intern_cell_tokens(self.__tokens__[1:-1])
             new_node = TableTree(node.tag,
                                  int(node.attrib.get('colspan', '1')),
                                  int(node.attrib.get('rowspan', '1')),
@@ -119,47 +199,65 @@ class TEDS(object):
         if parent is None:
             return new_node
 
+    def load_table(self, source, parser=None):
+        ''' Returns (tree, n_nodes) for an HTML string or a pre-built TableTree,
+            None if the HTML has no body/table
+        '''
+        if isinstance(source, TableTree):
+            # pre-built trees (see table_rows_to_tree) only hold table/tr/td nodes
+            return source, _tree_size(source) - 1
+        from lxml import etree, html
+        if parser is None:
+            parser = html.HTMLParser(remove_comments=True, encoding='utf-8')
+        tables = html.fromstring(source, parser=parser).xpath('body/table')
+        if not tables:
+            return None
+        table = tables[0]
+        if self.ignore_nodes:
+            etree.strip_tags(table, *self.ignore_nodes)
+        return self.load_html_tree(table), len(table.xpath(".//*"))
+
     def evaluate(self, pred, true):
         ''' Computes TEDS score between the prediction and the ground truth of a
-            given sample
+            given sample. Each side is either an HTML string or a TableTree.
         '''
         if (not pred) or (not true):
             return 0.0
+        from lxml import html
         parser = html.HTMLParser(remove_comments=True, encoding='utf-8')
-        pred = html.fromstring(pred, parser=parser)
-        true = html.fromstring(true, parser=parser)
-        #print("pred:",pred)
-        #print("true:",true)
-        if pred.xpath('body/table') and true.xpath('body/table'):
-            pred = pred.xpath('body/table')[0]
-            true = true.xpath('body/table')[0]
-            if self.ignore_nodes:
-                etree.strip_tags(pred, *self.ignore_nodes)
-                etree.strip_tags(true, *self.ignore_nodes)
-            n_nodes_pred = len(pred.xpath(".//*"))
-            n_nodes_true = len(true.xpath(".//*"))
-            n_nodes = max(n_nodes_pred, n_nodes_true)
-            tree_pred = self.load_html_tree(pred)
-            tree_true = self.load_html_tree(true)
-            distance = APTED(tree_pred, tree_true, CustomConfig()).compute_edit_distance()
-            return 1.0 - (float(distance) / n_nodes)
-        else:
+        return self.evaluate_tables(self.load_table(pred, parser), self.load_table(true, parser))
+
+    def evaluate_tables(self, pred, true):
+        ''' Computes TEDS score between two load_table results
+        '''
+        if pred is None or true is None:
             return 0.0
+        tree_pred, n_nodes_pred = pred
+        tree_true, n_nodes_true = true
+        n_nodes = max(n_nodes_pred, n_nodes_true)
+        distance = APTED(tree_pred, tree_true, CustomConfig()).compute_edit_distance()
+        return 1.0 - (float(distance) / n_nodes)
 
-    def batch_evaluate(self, pred_json, true_json):
+    def batch_evaluate(self, pred_json, true_json, progress_callback=None):
         ''' Computes TEDS score between the prediction and the ground truth of
             a batch of samples
             @params pred_json: {'FILENAME': 'HTML CODE', ...}
-            @params true_json: {'FILENAME': {'html': 'HTML CODE'}, ...}
-            @output: {'FILENAME': 'TEDS SCORE', ...}
+            @params true_json: {'FILENAME': 'HTML CODE', ...} or {'FILENAME': {'html': 'HTML CODE'}, ...}
+            @params progress_callback: called with (done, total) as samples are scored
+            @output: {'FILENAME': 'TEDS SCORE', ...}; with n_jobs > 1 a sample whose
+                scoring raised gets the exception object
         '''
-        samples = true_json.keys()
-        if self.n_jobs == 1:
-            scores = [self.evaluate(pred_json.get(filename, ''), true_json[filename]['html']) for filename in tqdm(samples)]
-        else:
-            #inputs = [{'pred': pred_json.get(filename, ''), 'true': true_json[filename]['html']} for filename in samples]
-            inputs = [{'pred': pred_json.get(filename, ''), 'true': true_json[filename]} for filename in samples]
-            scores = parallel_process(inputs, self.evaluate, use_kwargs=True, n_jobs=self.n_jobs, front_num=1)
+        from app.parallel import parallel_process
+        samples = list(true_json.keys())
+        inputs = []
+        for filename in samples:
+            true = true_json[filename]
+            if isinstance(true, dict):
+                true = true['html']
+            inputs.append({'pred': pred_json.get(filename, ''), 'true': true})
+        # samples go to the shared worker pool in chunks, self is pickled once per chunk
+        scores = parallel_process(inputs, self.evaluate, use_kwargs=True, n_jobs=self.n_jobs, front_num=1,
+                                  progress_callback=progress_callback)
         scores = dict(zip(samples, scores))
         return scores
 
@@ -182,9 +280,36 @@ def convert_table_to_html_str(table_row_list=[]):
     return html_table_str
 
 
-def convert_markdown_table_to_html(markdown_table):
+_CELL_SPACES = re.compile(r'\s+')
+# characters the lxml HTML parser does not keep verbatim in a cell text
+_UNSAFE_CELL_TEXT = re.compile('[<&\x00\ud800-\udfff]')
+
+
+def table_rows_to_tree(table_rows, structure_only=False):
     """
-    Converts a markdown table to the corresponding html string for TEDS computation.
+    Builds the TEDS tree of a plain table (table -> tr -> td) directly from its
+    rows, without going through an HTML string.
+    The tree is identical to the one TEDS builds from the html string of
+    convert_table_to_html_str after clean_latex. Returns None when a cell would
+    be altered by the HTML parser (markup, entities, ...); callers then fall
+    back to the html string.
+    """
+    table = TableTree('table', None, None, None)
+    for data_row in table_rows:
+        row = TableTree('tr', None, None, None)
+        for cell_str in data_row:
+            # same whitespace folding as clean_latex
+            cell_str = _CELL_SPACES.sub(' ', cell_str.replace('\n', ''))
+            if _UNSAFE_CELL_TEXT.search(cell_str):
+                return None
+            row.children.append(TableTree('td', 1, 1, '' if structure_only else intern_cell_text(cell_str)))
+        table.children.append(row)
+    return table
+
+
+def markdown_table_rows(markdown_table):
+    """
+    Splits a markdown table into its rows of cell strings (the separator row is dropped).
     """
     # remove extra code block tokens like '```markdown' and '```
     markdown_table = markdown_table.strip('```markdown').strip('```').strip() 
@@ -200,306 +325,28 @@ def convert_markdown_table_to_html(markdown_table):
             else:
                 one_row.append(' ')
         table_rows.append(one_row)
-    # build html string based on table rows
-    html_str = convert_table_to_html_str(table_rows)
-    return html_str
-
-
-def dict_to_html(data):
-    html = "<html><body><table>\n"
-    for key, value in data.items():
-        if not isinstance(value, str):
-            value = str(value)
-        value_str = ' '.join(value)
-        
-        html += f"  <tr><td>{key}</td><td>{value_str}</td></tr>\n"
-    html += "</table></body></html>"
-    return html
-
-
-def convert_str_to_dict(predict_str: str):
-    """
-    Parses the 'predict' string and returns a dictionary.
-    Missing or unparseable content is handled gracefully.
-
-    Parameters:
-    - predict_str (str): The prediction string containing the output dict.
+    return table_rows
 
-    Returns:
-    - dict: A dictionary extracted from the predict string.
-    """
-    # Remove code fences like ```python\n...\n```
-    code_fence_pattern = r'```(?:python|json)?\n(.*?)\n```'
-    match = re.search(code_fence_pattern, predict_str, re.DOTALL | re.IGNORECASE)
-    if match:
-        content = match.group(1)
-    else:
-        content = predict_str.strip()
 
-    data = {}
-    success = False
-
-    # try parsing with JSON
-    try:
-        data = json.loads(content)
-        success = True
-    except json.JSONDecodeError:
-        pass
-
-    # try parsing with ast.literal_eval
-    if not success:
-        try:
-            data = ast.literal_eval(content)
-            if isinstance(data, dict):
-                success = True
-        except (ValueError, SyntaxError):
-            pass
-
-    # try parsing with regex
-    if not success:
-        key_value_pattern = r'["\']?([\w\s]+)["\']?\s*[:=]\s*["\']?([^\n,"\'{}]+)["\']?'
-        matches = re.findall(key_value_pattern, content)
-        try:
-            for key, value in matches:
-                data[key.strip()] = value.strip()
-        except:
-            return {}
-
-    if not data:
-        return {}
-
-    try:
-        result = {k.strip(): str(v).strip() for k, v in data.items()}
-    except:
-        return {}
-    return result
-
-
-def convert_str_to_multi_dict(predict_str: str):
+def convert_markdown_table_to_html(markdown_table):
     """
-    Parses the 'predict' string and returns a dictionary.
-    Handles nested dictionaries and missing or unparseable content gracefully.
-
-    Parameters:
-    - predict_str (str): The prediction string containing the output dict.
-
-    Returns:
-    - dict: A dictionary extracted from the predict string.
+    Converts a markdown table to the corresponding html string for TEDS computation.
     """
-    # Remove code fences like ```python\n...\n```
-    code_fence_pattern = r'```(?:python|json)?\n(.*?)\n```'
-    matches = re.findall(code_fence_pattern, predict_str, re.DOTALL | re.IGNORECASE)
-    if matches:
-        content = max(matches, key=len)
-    else:
-        content = predict_str.strip()
-    
-    def strip_variable_assignment(s):
-        variable_assignment_pattern = r'^\s*\w+\s*=\s*'
-        return re.sub(variable_assignment_pattern, '', s.strip(), count=1)
-
-    content = strip_variable_assignment(content)
-
-    def remove_comments(s):
-        return re.sub(r'#.*', '', s)
-
-    content = remove_comments(content)
-
-    last_brace_pos = content.rfind('}')
-    if last_brace_pos != -1:
-        content = content[:last_brace_pos+1]
-
-    data = {}
-    success = False
-
-    # try parsing with ast.literal_eval
-    try:
-        data = ast.literal_eval(content)
-        if isinstance(data, dict):
-            success = True
-    except (ValueError, SyntaxError, TypeError):
-        pass
-
-    if not success:
-        return {}
-
-    def process_data(obj):
-        if isinstance(obj, dict):
-            return {k: process_data(v) for k, v in obj.items()}
-        elif isinstance(obj, list):
-            return [process_data(elem) for elem in obj]
-        else:
-            return obj
-
-    data = process_data(data)
-
-    return data
+    # build html string based on table rows
+    html_str = convert_table_to_html_str(markdown_table_rows(markdown_table))
+    return html_str
 
 
-def generate_combinations(input_dict):
-    """
-    Function to generate all possible combinations of values from a dictionary.
+def convert_markdown_table_to_tree(markdown_table, structure_only=False):
     """
-    kie_answer = input_dict
-    if not isinstance(kie_answer, dict):
-        kie_answer = kie_answer.strip('"')
-        try:
-            kie_answer = json.loads(kie_answer)
-        except json.JSONDecodeError:
-            try:
-                kie_answer = ast.literal_eval(kie_answer)
-                if not isinstance(kie_answer, dict):
-                    kie_answer = ast.literal_eval(kie_answer)
-            except (ValueError, SyntaxError):
-                print(f"Unable to parse 'answers' field: {kie_answer}")
-                return {}
-        
-        # Ensure the parsed result is a dictionary.
-        if not isinstance(kie_answer, dict):
-            print("Parsed 'answers' is still not a dictionary.")
-            raise ValueError("Input could not be parsed into a dictionary.")
-    
-        keys = list(kie_answer.keys())
-        
-        value_lists = []
-        for single_key in keys:
-            sinlge_value = kie_answer[single_key]
-            if not isinstance(sinlge_value, list):
-                sinlge_value = [sinlge_value]
-            value_lists.append(sinlge_value)
-    
-        # Compute the Cartesian product of the value lists.
-        combinations = list(product(*value_lists))
-    
-        # Create a dictionary for each combination of values.
-        result = [dict(zip(keys, values)) for values in combinations]
-
-        return result
-    
-    else:
-        keys = list(input_dict.keys())
-        value_lists = [input_dict[key] for key in keys]
-
-        # Compute the Cartesian product of the value lists.
-        combinations = list(product(*value_lists))
-
-        # Create a dictionary for each combination of values.
-        result = [dict(zip(keys, values)) for values in combinations]
-
-        return result
-
-
-def compute_f1_score(preds, gts, ignores=[]):
-    """Compute the F1-score for KIE task between predicted and ground truth dictionaries.
-
-    Args:
-        preds (dict): The predicted key-value pairs.
-        gts (dict): The ground truth key-value pairs.
-        ignores (list): The list of keys to ignore during evaluation.
-
-    Returns:
-        dict: A dictionary where keys are field names and values are their corresponding F1-scores.
+    Converts a markdown table straight to its TEDS tree.
+    Returns None when the html path is required (see table_rows_to_tree).
     """
-    # Optionally remove ignored keys from predictions and ground truths
-    keys = set(preds.keys()).union(set(gts.keys())) - set(ignores)
-    f1_scores = {}
+    return table_rows_to_tree(markdown_table_rows(markdown_table), structure_only)
 
-    for key in keys:
-        pred_value = preds.get(key, None)
-        gt_value = gts.get(key, None)
 
-        if pred_value:
-            pred_value = pred_value.lower().strip().replace("\n"," ").replace(" ", "")
-        if gt_value:
-            gt_value = gt_value.lower().strip().replace("\n"," ").replace(" ", "")
-
-        if pred_value is None and gt_value is None:
-            continue
-        elif pred_value is None:
-            precision = 0.0
-            recall = 0.0
-        elif gt_value is None:
-            # false positive
-            precision = 0.0
-            recall = 0.0
-        else:
-            if pred_value == gt_value:
-                # True positive
-                precision = 1.0
-                recall = 1.0
-            else:
-                precision = 0.0
-                recall = 0.0
-
-        # Compute F1-score
-        f1_score = 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0.0
-        f1_scores[key] = f1_score
-
-    if len(f1_scores) == 0:
-        return 0
-    average_f1 = sum(f1_scores.values()) / len(f1_scores)
-
-    return average_f1
-
-
-def pre_clean(text):
-    text = re.sub(r'<bos>|<eos>|<pad>|<unk>', '', text)
-    text = re.sub(r'\s##(\S)', r'\1', text)
-    text = re.sub(r'\\\s', r'\\', text)
-    text = re.sub(r'\s\*\s\*\s', r'**', text)
-    text = re.sub(r'{\s', r'{', text)
-    text = re.sub(r'\s}', r'}', text)
-    text = re.sub(r'\s}', r'}', text)
-    text = re.sub(r'\\begin\s', r'\\begin', text)
-    text = re.sub(r'\\end\s', r'\\end', text)
-    text = re.sub(r'\\end{table}', r'\\end{table} \n\n', text)
-    text = text.replace('\n', ' ')
-    text = text.replace('*', ' ')
-    text = text.replace('_', ' ')
-    return text
-
-
-def get_tree(input_str):
-    tree = (Node('ROOT').addkid(Node('TITLE')))
-
-    lines = input_str.split("\n")
-    lines = [pre_clean(line) for line in lines]
-    last_title = ''
-    for line in lines:
-        if line.startswith('#'):
-            child = tree.get('ROOT')
-            line = line.replace('#', '')
-            child.addkid(Node(line))
-            last_title = line
-        else:
-            if last_title == '':
-                child = tree.get('TITLE')
-                child.addkid(Node(line))
-            else:
-                child = tree.get(last_title)
-                child.addkid(Node(line))
-    return tree
-
-def STEDS(pred_tree, ref_tree):
-    def my_distance(pred, ref):
-        if len(pred.split()) == 0 or len(ref.split()) == 0:
-            return 1
-        else:
-            return 0
-    total_distance = simple_distance(pred_tree, ref_tree, label_dist=my_distance)
-    num_of_nodes = max(len(list(pred_tree.iter())), len(list(ref_tree.iter())))
-    return 1-total_distance/num_of_nodes
-
-
-def doc_parsing_evaluation(pred, gt):
-    score = 0
-    if not isinstance(pred, str):
-        return 0
-    pred_tree = get_tree(pred)
-    gt_tree = get_tree(gt)
-    score = STEDS(pred_tree, gt_tree)
-
-    return score
+def _tree_size(node):
+    return 1 + sum(_tree_size(child) for child in node.children)
 
 
 def wrap_html_table(html_table):
@@ -523,409 +370,121 @@ def wrap_html_table(html_table):
     if '<html>' not in html_table:
         html_table = '<html>' + html_table + '</html>'
     return html_table
-    
 
-def get_anls(s1, s2):
-    try:
-        s1 = s1.lower()
-        s2 = s2.lower()
-    except:
-        pass
-    if s1 == s2:
-        return 1.0
-    iou = 1 - editdistance.eval(s1, s2) / max(len(s1), len(s2))
-    anls = iou
-    return anls
-
-
-def ocr_eval(references,predictions):
-    socre_=0.0
-    None_num=0
-    for idx,ref_value in enumerate(references):
-        pred_value = predictions[idx]
-        pred_values, ref_values = [], []
-        if isinstance(pred_value, str):
-            pred_values.append(pred_value)
+
+_HTML_TABLE_TAG = re.compile(
+    r'<(/?)([A-Za-z]+)((?:\s+[A-Za-z_:][-\w:.]*\s*=\s*(?:"[^"<>&]*"|\'[^\'<>&]*\'|[\w-]+))*)\s*>')
+_HTML_TABLE_ATTR = re.compile(r'\s+([A-Za-z_:][-\w:.]*)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([\w-]+))')
+_HTML_TABLE_SPAN = re.compile(r'[0-9]+')
+# elements each node of the fast path may contain
+_HTML_TABLE_CHILDREN = {
+    'table': ('thead', 'tbody', 'tr'),
+    'thead': ('tr',),
+    'tbody': ('tr',),
+    'tr': ('td', 'th'),
+    'td': (),
+    'th': (),
+}
+# fast path hits / lxml fallbacks of parse_html_table_tree in this process
+HTML_TABLE_PARSE_STATS = Counter()
+
+
+def _html_table_spans(attrs):
+    """colspan / rowspan of a td, None if they are not plain integers."""
+    spans = {}
+    for match in _HTML_TABLE_ATTR.finditer(attrs):
+        name = match.group(1).lower()
+        if name in spans:
+            return None
+        value = next(v for v in match.groups()[1:] if v is not None)
+        spans[name] = value
+    colspan = spans.get('colspan', '1')
+    rowspan = spans.get('rowspan', '1')
+    if not (_HTML_TABLE_SPAN.fullmatch(colspan) and _HTML_TABLE_SPAN.fullmatch(rowspan)):
+        return None
+    return int(colspan), int(rowspan)
+
+
+def _parse_html_table_tree(html_table, structure_only):
+    html_table = html_table.replace('\n', '').strip()
+    if not (html_table.startswith('<table') and html_table.endswith('</table>')):
+        return None
+    root = None
+    stack = []
+    pos = 0
+    for match in _HTML_TABLE_TAG.finditer(html_table):
+        text = html_table[pos:match.start()]
+        pos = match.end()
+        closing, tag, attrs = match.groups()
+        tag = tag.lower()
+        if stack and stack[-1].tag in ('td', 'th'):
+            node = stack[-1]
+            if not closing or tag != node.tag:
+                return None
+            # same whitespace folding as clean_latex
+            text = _CELL_SPACES.sub(' ', text)
+            if _UNSAFE_CELL_TEXT.search(text):
+                return None
+            if node.tag == 'td' and not structure_only:
+                node.content = intern_cell_text(text)
+            stack.pop()
+            continue
+        if text and not text.isspace():
+            return None
+        if closing:
+            if attrs or not stack or stack[-1].tag != tag:
+                return None
+            stack.pop()
+            if not stack:
+                # the table must be the whole input
+                return root if pos == len(html_table) else None
+            continue
+        if stack:
+            if tag not in _HTML_TABLE_CHILDREN[stack[-1].tag]:
+                return None
+        elif root is None and tag == 'table':
+            pass
         else:
-            pred_values = pred_value
-        if isinstance(ref_value, str):
-            ref_values.append(ref_value)
+            return None
+        if tag == 'td':
+            spans = _html_table_spans(attrs)
+            if spans is None:
+                return None
+            node = TableTree('td', spans[0], spans[1], '')
         else:
-            ref_values = ref_value
-        
-        temp_score = 0.0
-        temp_num = len(ref_values)
-        
-        for tmpidx, tmpref in enumerate(ref_values):
-            tmppred = pred_values[tmpidx] if tmpidx < len(pred_values) else pred_values[0]
-            if len(pred_values) == 1 and tmppred != "None" and "None" not in ref_values:  # pred 1, and not None
-                temp_score = max(temp_score, get_anls(tmppred, tmpref))
-                temp_num = len(ref_values)
-            else:
-                if tmppred=='None' and tmpref!='None':
-                    temp_score += 0.0
-                elif tmpref=='None':
-                    temp_num -= 1
-                else:
-                    temp_score += get_anls(tmppred, tmpref)
-        if temp_num == 0:
-            ocr_score = 0.0
-            None_num += 1
+            node = TableTree(tag, None, None, None)
+        if stack:
+            stack[-1].children.append(node)
         else:
-            ocr_score = temp_score / (temp_num)
-        socre_ += ocr_score
-    if None_num == len(references):
-        return 9999
-    else:
-        return round(socre_ / (len(references)-None_num), 5)
-
-
-def csv_eval(predictions,references,easy, pred_type='json'):
-    predictions = predictions
-    labels = references
-    def is_int(val):
-        try:
-            int(val)
-            return True
-        except ValueError:
-            return False
-
-    def is_float(val):
-        try:
-            float(val)
-            return True
-        except ValueError:
-            return False
-    
-    def convert_dict_to_list(data):
-        """
-        Convert a dictionary to a list of tuples, handling both simple and nested dictionaries.
-        
-        Args:
-        data (dict): The input dictionary, which might be nested or simple.
-        
-        Returns:
-        list: A list of tuples generated from the input dictionary.
-        """
-        # print(data)
-        converted_list = []
-        for key, value in data.items():
-            # Check if the value is a dictionary (indicating a nested structure)
-            if isinstance(value, dict):
-                # Handle nested dictionary
-                for subkey, subvalue in value.items():
-                    # converted_list.append((key, subkey, subvalue))
-                    converted_list.append((key, subkey, re.sub(r'[^\d.-]', '', str(subvalue))))
+            root = node
+        stack.append(node)
+    return None
 
-            else:
-                # Handle simple key-value pair
-                # converted_list.append((key, "value", value))
-                converted_list.append((key, "value", re.sub(r'[^\d.-]', '', str(value))))
-        return converted_list
-
-
-    def csv2triples(csv, separator='\\t', delimiter='\\n'):  
-        lines = csv.strip().split(delimiter)
-        header = lines[0].split(separator) 
-        triples = []
-        for line in lines[1:]:   
-            if not line:
-                continue
-            values = line.split(separator)
-            entity = values[0]
-            for i in range(1, len(values)):
-                if i >= len(header):
-                    break
-                #---------------------------------------------------------
-                temp = [entity.strip(), header[i].strip()]
-                temp = [x if len(x)==0 or x[-1] != ':' else x[:-1] for x in temp]
-                value = values[i].strip()
-                value = re.sub(r'[^\d.-]', '', str(value))
-                # value = value.replace("%","")     
-                # value = value.replace("$","")     
-                triples.append((temp[0], temp[1], value))
-                #---------------------------------------------------------
-        return triples
-    
-    def csv2triples_noheader(csv, separator='\\t', delimiter='\\n'):  
-        lines = csv.strip().split(delimiter)
-        maybe_header = [x.strip() for x in lines[0].split(separator)]
-        not_header = False
-        if len(maybe_header) > 2:
-            for c in maybe_header[1:]:
-                try:
-                    num = float(c)
-                    not_header = True
-                except:
-                    continue
-                if not_header:
-                    break
-        header = None if not_header else maybe_header
-        data_start = 0 if not_header and separator in lines[0] else 1
-        triples = []
-        for line in lines[data_start:]:   
-            if not line:
-                continue
-            values = [x.strip() for x in line.split(separator)]
-            entity = values[0]
-            for i in range(1, len(values)):
-                try:
-                    temp = [entity if entity[-1]!=':' else entity[:-1], ""]
-                except:
-                    temp = [entity, ""]
-                if header is not None:
-                    try:
-                        this_header = header[i]
-                        temp = [entity, this_header]
-                        temp = [x if x[-1] != ':' else x[:-1] for x in temp]
-                    except:
-                        this_header = entity.strip()
-                value = values[i].strip()
-                value = re.sub(r'[^\d.-]', '', str(value))
-                # value = value.replace("%","")     
-                # value = value.replace("$","")     
-                triples.append((temp[0], temp[1], value))
-                #---------------------------------------------------------
-        return triples
-
-    def process_triplets(triplets):
-        new_triplets = []
-        for triplet in triplets:
-            new_triplet = []
-            triplet_temp = []
-            if len(triplet) > 2:
-                if is_int(triplet[2]) or is_float(triplet[2]):
-                    triplet_temp = (triplet[0].lower(), triplet[1].lower(), float(triplet[2]))
-                else:
-                    triplet_temp = (triplet[0].lower(), triplet[1].lower(), triplet[2].lower())
-            else: 
-                triplet_temp = (triplet[0].lower(), triplet[1].lower(), "no meaning")
-            new_triplets.append(triplet_temp)
-        return new_triplets
-
-    def intersection_with_tolerance(a, b, tol_word, tol_num):
-        a = set(a)
-        b = set(b)
-        c = set()
-        for elem1 in a:
-            for elem2 in b:
-                if is_float(elem1[-1]) and is_float(elem2[-1]):
-                    if ((Levenshtein.distance(''.join(elem1[:-1]),''.join(elem2[:-1])) <= tol_word) and (abs(elem1[-1] - elem2[-1]) / (abs(elem2[-1])+0.000001) <= tol_num))or \
-                    ((''.join(elem1[:-1]) in ''.join(elem2[:-1])) and (abs(elem1[-1] - elem2[-1]) / (abs(elem2[-1])+0.000001) <= tol_num)) or \
-                    ((''.join(elem2[:-1]) in ''.join(elem1[:-1])) and (abs(elem1[-1] - elem2[-1]) / (abs(elem2[-1])+0.000001) <= tol_num)):
-                        c.add(elem1)
-                else:
-                    if (Levenshtein.distance(''.join([str(i) for i in elem1]),''.join([str(j) for j in elem2])) <= tol_word):
-                        c.add(elem1)
-        return list(c)
-
-    def union_with_tolerance(a, b, tol_word, tol_num):
-        c = set(a) | set(b)
-        d = set(a) & set(b)
-        e = intersection_with_tolerance(a, b, tol_word, tol_num)
-        f = set(e)
-        g = c-(f-d)
-        return list(g)
-
-    def get_eval_list(pred_csv, label_csv, separator='\\t', delimiter='\\n', tol_word=3, tol_num=0.05, pred_type='json'):
-
-        if pred_type == 'json':
-            pred_triple_list=[]
-            for it in pred_csv:
-                pred_triple_temp = convert_dict_to_list(it)
-                pred_triple_pre = process_triplets(pred_triple_temp)
-                pred_triple_list.append(pred_triple_pre) 
-        else:
-            pred_triple_list=[]
-            for it in pred_csv:
-                pred_triple_temp = csv2triples(it, separator=separator, delimiter=delimiter)
-                # pred_triple_temp = csv2triples_noheader(it, separator=separator, delimiter=delimiter)
-                pred_triple_pre = process_triplets(pred_triple_temp)
-                pred_triple_list.append(pred_triple_pre) 
-
-        label_triple_list=[]
-        for it in label_csv:
-            label_triple_temp = convert_dict_to_list(it)
-            label_triple_pre = process_triplets(label_triple_temp)
-            label_triple_list.append(label_triple_pre) 
-
-            
-        intersection_list=[]
-        union_list=[]
-        sim_list=[]
-        # for each chart image
-        for pred,label in zip(pred_triple_list, label_triple_list):
-            for idx in range(len(pred)):
-                try:
-                    if label[idx][1] == "value" and "value" not in pred[idx][:2]:
-                        pred[idx] = (pred[idx][0], "value", pred[idx][2]) 
-                    temp_pred_head = sorted(pred[idx][:2])
-                    temp_gt_head = sorted(label[idx][:2])
-                    pred[idx] = (temp_pred_head[0], temp_pred_head[1], pred[idx][2])
-                    label[idx] = (temp_gt_head[0], temp_gt_head[1], label[idx][2])
-                except:
-                    continue
-            intersection = intersection_with_tolerance(pred, label, tol_word = tol_word, tol_num=tol_num)
-            union = union_with_tolerance(pred, label, tol_word = tol_word, tol_num=tol_num)
-            sim = len(intersection)/len(union)
-            intersection_list.append(intersection)
-            union_list.append(union)
-            sim_list.append(sim)
-        return intersection_list, union_list, sim_list
-
-    def get_ap(predictions, labels, sim_threhold, tolerance, separator='\\t', delimiter='\\n', easy=1):
-        if tolerance == 'strict':
-            tol_word=0
-            if easy == 1:
-                tol_num=0
-            else:
-                tol_num=0.1
 
-        elif tolerance == 'slight':
-            tol_word=2
-            if easy == 1:
-                tol_num=0.05
-            else:
-                tol_num=0.3
+def parse_html_table_tree(html_table, structure_only=False):
+    """
+    Streaming parser for well-formed tables made only of table / thead / tbody /
+    tr / td / th tags (td colspan / rowspan are read, other attributes ignored)
+    with plain text cells. Builds the same tree as TEDS does from
+    wrap_html_table + clean_latex + lxml for such inputs.
+    Returns None for anything outside that subset, which is left to lxml.
+    """
+    tree = _parse_html_table_tree(html_table, structure_only)
+    HTML_TABLE_PARSE_STATS['fast' if tree is not None else 'lxml'] += 1
+    return tree
 
-        elif tolerance == 'high':
-            tol_word= 5
-            if easy == 1:
-                tol_num=0.1
-            else:
-                tol_num=0.5      
-        intersection_list, union_list, sim_list = get_eval_list(predictions, labels, separator=separator, delimiter=delimiter, tol_word=tol_word, tol_num=tol_num, pred_type=pred_type)
-        ap = len([num for num in sim_list if num >= sim_threhold])/(len(sim_list)+1e-16)
-        return ap   
-
-    map_strict = 0
-    map_slight = 0
-    map_high = 0
-    s="\\t"
-    d="\\n"
-
-    for sim_threhold in np.arange (0.5, 1, 0.05):
-        map_temp_strict = get_ap(predictions, labels, sim_threhold=sim_threhold, tolerance='strict', separator=s, delimiter=d, easy=easy)
-        map_temp_slight = get_ap(predictions, labels, sim_threhold=sim_threhold, tolerance='slight', separator=s, delimiter=d, easy=easy)
-        map_temp_high = get_ap(predictions, labels, sim_threhold=sim_threhold, tolerance='high', separator=s, delimiter=d, easy=easy)
-        map_strict += map_temp_strict/10
-        map_slight += map_temp_slight/10
-        map_high += map_temp_high/10
-
-    em = get_ap(predictions, labels, sim_threhold=1, tolerance='strict', separator=s, delimiter=d, easy=easy)
-    ap_50_strict = get_ap(predictions, labels, sim_threhold=0.5, tolerance='strict', separator=s, delimiter=d, easy=easy)
-    ap_75_strict = get_ap(predictions, labels, sim_threhold=0.75, tolerance='strict', separator=s, delimiter=d, easy=easy)    
-    ap_90_strict = get_ap(predictions, labels, sim_threhold=0.90, tolerance='strict', separator=s, delimiter=d, easy=easy)
-    ap_50_slight = get_ap(predictions, labels, sim_threhold=0.5, tolerance='slight', separator=s, delimiter=d, easy=easy)
-    ap_75_slight = get_ap(predictions, labels, sim_threhold=0.75, tolerance='slight', separator=s, delimiter=d, easy=easy)    
-    ap_90_slight = get_ap(predictions, labels, sim_threhold=0.90, tolerance='slight', separator=s, delimiter=d, easy=easy)
-    ap_50_high = get_ap(predictions, labels, sim_threhold=0.5, tolerance='high', separator=s, delimiter=d, easy=easy)
-    ap_75_high = get_ap(predictions, labels, sim_threhold=0.75, tolerance='high', separator=s, delimiter=d, easy=easy)    
-    ap_90_high = get_ap(predictions, labels, sim_threhold=0.90, tolerance='high', separator=s, delimiter=d, easy=easy)
-
-
-    return em, map_strict, map_slight, map_high, ap_50_strict, ap_75_strict, ap_90_strict, ap_50_slight, ap_75_slight, ap_90_slight, ap_50_high, ap_75_high, ap_90_high
-
-def draw_SCRM_table(em, map_strict, map_slight, map_high, ap_50_strict, ap_75_strict, ap_90_strict, ap_50_slight, ap_75_slight, ap_90_slight, ap_50_high, ap_75_high, ap_90_high,title_ocr_socre,source_ocr_socre,x_title_ocr_socre,y_title_ocr_socre,structure_accuracy):
-
-    result=f'''
-            -----------------------------------------------------------\n
-            |  Metrics   |  Sim_threshold  |  Tolerance  |    Value    |\n
-            -----------------------------------------------------------\n
-            |             |                 |   strict    |    {'%.4f' % map_strict}    |     \n
-            |             |                 ----------------------------\n
-            |  mPrecison  |  0.5:0.05:0.95  |   slight    |    {'%.4f' % map_slight}    |\n
-            |             |                  ---------------------------\n
-            |             |                 |    high     |    {'%.4f' % map_high}    |\n
-            -----------------------------------------------------------\n
-            |             |                 |   strict    |    {'%.4f' % ap_50_strict}    |\n
-            |             |                  ---------------------------\n
-            |  Precison   |       0.5       |   slight    |    {'%.4f' % ap_50_slight }    |\n
-            |             |                  ---------------------------\n
-            |             |                 |    high     |    {'%.4f' % ap_50_high }    |\n
-            -----------------------------------------------------------\n
-            |             |                 |   strict    |    {'%.4f' % ap_75_strict}    |\n
-            |             |                  ---------------------------\n
-            |  Precison   |      0.75       |   slight    |    {'%.4f' % ap_75_slight}    |\n
-            |             |                  ---------------------------\n
-            |             |                 |    high     |    {'%.4f' % ap_75_high}    |\n
-            -----------------------------------------------------------\n
-            |             |                 |   strict    |    {'%.4f' % ap_90_strict}    |\n
-            |             |                  ---------------------------\n
-            |  Precison   |       0.9       |   slight    |    {'%.4f' % ap_90_slight }    |\n
-            |             |                  ---------------------------\n
-            |             |                 |    high     |    {'%.4f' % ap_90_high}    |\n
-            -----------------------------------------------------------\n
-            |Precison(EM) |                                    {'%.4f' % em}    |\n
-            -----------------------------------------------------------\n
-            |Title(EM)    |                                    {'%.4f' % title_ocr_socre}    |\n
-            -----------------------------------------------------------\n
-            |Source(EM)   |                                    {'%.4f' % source_ocr_socre}    |\n
-            -----------------------------------------------------------\n
-            |X_title(EM)  |                                    {'%.4f' % x_title_ocr_socre}    |\n
-            -----------------------------------------------------------\n
-            |Y_title(EM)  |                                    {'%.4f' % y_title_ocr_socre}    |\n
-            -----------------------------------------------------------\n
-            |structure_acc|                                    {'%.4f' % structure_accuracy}    |\n
-            -----------------------------------------------------------\n
-
-
-            '''
-    return result
-
-
-if __name__ == '__main__':
-    import json
-    import pprint
-
-    # markdown structure for Table Parsing task
-    pred_markdown = "| 1 | august 5 , 1972 | detroit lions | l 23 - 31 | 0 - 1 |\n| 2 | august 12 , 1972 | green bay packers | l 13 - 14 | 0 - 2 |\n| 3 | august 19 , 1972 | cincinnati bengals | w 35 - 17 | 1 - 2 |\n| 4 | august 25 , 1972 | atlanta falcons | w 24 - 10 | 2 - 2 |\n| 5 | august 31 , 1972 | washington redskins | l 24 - 27 | 2 - 3 |\n| 6 | september 10 , 1972 | minnesota vikings | w 21 - 19 | 3 - 3 |"
-    true_markdown = "| week | date | opponent | result | record |\n| --- | --- | --- | --- | --- |\n| 1 | august 5 , 1972 | detroit lions | l 23 - 31 | 0 - 1 |\n| 2 | august 12 , 1972 | green bay packers | l 13 - 14 | 0 - 2 |\n| 3 | august 19 , 1972 | cincinnati bengals | w 35 - 17 | 1 - 2 |\n| 4 | august 25 , 1972 | atlanta falcons | w 24 - 10 | 2 - 2 |\n| 5 | august 31 , 1972 | washington redskins | l 24 - 27 | 2 - 3 |\n| 6 | september 10 , 1972 | minnesota vikings | w 21 - 19 | 3 - 3 |"
-    teds = TEDS(n_jobs=4)
-    pred_table_html = convert_markdown_table_to_html(pred_markdown)
-    true_table_html = convert_markdown_table_to_html(true_markdown)
-
-    scores = teds.evaluate(pred_table_html, true_table_html)
-
-    pp = pprint.PrettyPrinter()
-    pp.pprint(scores)
-
-    # dict structure for Key Information Extraction task
-    pred_dict = {
-            "company": [
-                "OLD TOWN "
-            ],
-            "date": [
-                "2024"
-            ],
-            "address": [
-                "SRI RAMPAI"
-            ],
-            "total": [
-                "30"
-            ]
-        }
-    true_dict = {
-            "company": [
-                "OLD TOWN KOPITAM SND BHD"
-            ],
-            "date": [
-                "2024/9/27"
-            ],
-            "address": [
-                "SRI RAMPAI"
-            ],
-            "total": [
-                "30"
-            ]
-        }
-    teds = TEDS(n_jobs=4)
-    pred_dict_html = dict_to_html(pred_dict)
-    true_dict_html = dict_to_html(true_dict)
-    print(pred_dict_html)
-    print(true_dict_html)
-
-    scores = teds.evaluate(pred_dict_html, true_dict_html)
-
-    pp = pprint.PrettyPrinter()
-    pp.pprint(scores)
\ No newline at end of file
+
+# names moved to app.other_metrics, still importable from this module
+_OTHER_METRICS = frozenset((
+    'dict_to_html', 'convert_str_to_dict', 'convert_str_to_multi_dict', 'generate_combinations',
+    'compute_f1_score', 'pre_clean', 'get_tree', 'STEDS', 'doc_parsing_evaluation',
+    'DOC_TREE_EXACT_MAX_NODES', 'get_anls', 'ocr_eval', 'batch_ocr_eval_columns', 'batch_ocr_eval',
+    'csv_eval', 'draw_SCRM_table',
+))
+
+
+def __getattr__(name):
+    if name in _OTHER_METRICS:
+        from app import other_metrics
+        return getattr(other_metrics, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,148 @@
+import os
+import time
+import threading
+
+from app.shared_state import LocalState
+
+
+class AdmissionRejected(Exception):
+    ''' Raised by AdmissionController.admit when a submission cannot be queued now.
+        reason is "busy" (queued cost over budget) or "participant_limit".
+    '''
+    def __init__(self, reason, message, estimated_wait=None, queue_position=None):
+        super().__init__(message)
+        self.reason = reason
+        self.estimated_wait = estimated_wait
+        self.queue_position = queue_position
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class AdmissionController(object):
+    ''' Cost-based admission control in front of the scoring pool.
+
+        A submission is admitted with its estimated scoring cost and holds that
+        cost until it is released. New submissions are rejected while the cost
+        already queued plus their own would exceed the budget (an empty queue
+        always admits, so a single large submission is never locked out) or
+        while the participant already has max_per_participant submissions
+        queued. The scoring rate (cost per second) is measured from released
+        submissions and used to estimate waits.
+
+        The tickets live in state (SharedState), so with several server
+        processes the budget and the participant limit hold for all of them;
+        tickets of processes that died are dropped. The measured rate is kept
+        per process.
+    '''
+    def __init__(self, budget, max_per_participant=1, ticket_ttl=600.0, rate_smoothing=0.3, state=None):
+        self.budget = budget
+        self.max_per_participant = max_per_participant
+        self.ticket_ttl = ticket_ttl
+        self.rate_smoothing = rate_smoothing
+        self.rate = None
+        self.state = state if state is not None else LocalState()
+        self._lock = threading.Lock()
+
+    @property
+    def queued_cost(self):
+        with self.state.lock("admission"):
+            return sum(ticket["cost"] for ticket in self._tickets())
+
+    def admit(self, ticket_id, participant, cost, force=False):
+        ''' Reserves cost for ticket_id.
+            @output: {"queue_position": n submissions ahead, "queued_cost", "estimated_wait"}
+            Raises AdmissionRejected when over budget or over the participant limit,
+            unless force (work that was already admitted, e.g. resumed after a restart).
+        '''
+        with self.state.lock("admission"):
+            tickets = self._tickets()
+            ahead = len(tickets)
+            queued_cost = sum(ticket["cost"] for ticket in tickets)
+            running = sum(1 for ticket in tickets if ticket["participant"] == participant)
+            if not force and running >= self.max_per_participant:
+                raise AdmissionRejected(
+                    "participant_limit",
+                    f"已有 {running} 個評估正在進行中，請等待完成後再上傳。",
+                    self._wait_for(queued_cost), ahead)
+            if not force and tickets and queued_cost + cost > self.budget:
+                # 要等到佇列消化到能容納這次提交的成本
+                wait = self._wait_for(queued_cost + cost - self.budget)
+                raise AdmissionRejected(
+                    "busy",
+                    "評估佇列已滿，請稍後再試。" + (f"預估等待約 {int(wait) + 1} 秒。" if wait is not None else ""),
+                    wait, ahead)
+            self.state.add_ticket({"ticket_id": ticket_id, "participant": participant, "cost": cost,
+                                   "admitted_at": time.time(), "started_at": None, "owner": os.getpid()})
+            return {
+                "queue_position": ahead,
+                "queued_cost": queued_cost + cost,
+                "estimated_wait": self._wait_for(queued_cost),
+            }
+
+    def start(self, ticket_id):
+        """Marks the ticket as being scored by this process; returns False if it is unknown or expired."""
+        with self.state.lock("admission"):
+            self._tickets()
+            return self.state.start_ticket(ticket_id, time.time(), os.getpid())
+
+    def release(self, ticket_id, completed=False):
+        """Frees the ticket's cost; completed runs update the measured scoring rate."""
+        ticket = self.state.remove_ticket(ticket_id)
+        if ticket is None or not completed or ticket["started_at"] is None:
+            return
+        elapsed = time.time() - ticket["started_at"]
+        if elapsed > 0 and ticket["cost"] > 0:
+            rate = ticket["cost"] / elapsed
+            with self._lock:
+                if self.rate is None:
+                    self.rate = rate
+                else:
+                    self.rate += self.rate_smoothing * (rate - self.rate)
+
+    def position(self, ticket_id):
+        """Number of submissions admitted before ticket_id that are still queued, None if unknown."""
+        for position, ticket in enumerate(self.state.tickets()):
+            if ticket["ticket_id"] == ticket_id:
+                return position
+        return None
+
+    def status(self):
+        with self.state.lock("admission"):
+            tickets = self._tickets()
+        queued_cost = sum(ticket["cost"] for ticket in tickets)
+        return {
+            "queued": len(tickets),
+            "running": sum(1 for ticket in tickets if ticket["started_at"] is not None),
+            "queued_cost": queued_cost,
+            "budget": self.budget,
+            "cost_per_second": round(self.rate, 2) if self.rate is not None else None,
+            "estimated_wait": self._wait_for(queued_cost),
+        }
+
+    def _wait_for(self, cost):
+        if self.rate is None:
+            return None
+        return round(cost / self.rate, 1)
+
+    def _tickets(self):
+        ''' The live tickets, called holding lock("admission"). Drops uploads whose
+            evaluation never started (closed tab, lost websocket) and tickets of
+            processes that died.
+        '''
+        now = time.time()
+        tickets = []
+        for ticket in self.state.tickets():
+            if ((ticket["started_at"] is None and now - ticket["admitted_at"] > self.ticket_ttl)
+                    or not _process_alive(ticket["owner"])):
+                self.state.remove_ticket(ticket["ticket_id"])
+            else:
+                tickets.append(ticket)
+        return tickets
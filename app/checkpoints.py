@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import fcntl
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+class CheckpointLocked(RuntimeError):
+    """Raised by EvaluationCheckpoint.open when another process owns the checkpoint."""
+
+
+class EvaluationCheckpoint(object):
+    ''' Append-only log of the items an evaluation has scored.
+
+        The first line is a header identifying the run (run id, participant,
+        prediction file and the hashes of the prediction file and of the
+        ground truth store); every following line is a batch of scored items
+        [index, key, score, status]. Batches are appended and fsync'ed every
+        flush_items items or flush_seconds by the checkpoint's writer thread,
+        in order, so the caller (the event loop) never waits for the disk; a
+        crash loses at most the batches not written yet. A torn last line is
+        ignored on load. close() and remove() wait for the pending writes.
+
+        The process that opens a checkpoint holds an exclusive flock on it
+        until close() or remove(), so with several server processes a run is
+        resumed by exactly one of them; the lock goes away with a dead owner.
+    '''
+    def __init__(self, path, header, done=None, flush_items=64, flush_seconds=1.0, lock_file=None):
+        self.path = path
+        self.header = header
+        self._lock_file = lock_file
+        self.done = done or {}
+        self.flush_items = flush_items
+        self.flush_seconds = flush_seconds
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._writer = None
+
+    @property
+    def run_id(self):
+        return self.header['run_id']
+
+    @staticmethod
+    def file_digest(path):
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @classmethod
+    def open(cls, directory, run_id, name, file_path, gt_fingerprint, create=True):
+        ''' Opens the checkpoint of run_id, keeping the items already scored if it
+            was written for the same prediction file and ground truth, or starts
+            a new one (create=False: returns None instead, e.g. the run finished
+            and removed it meanwhile). Raises CheckpointLocked if another process
+            has it open.
+        '''
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{run_id}.jsonl")
+        lock_file = open(path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise CheckpointLocked(f"checkpoint {path} is owned by another process")
+        try:
+            checkpoint = cls._open_locked(path, run_id, name, file_path, gt_fingerprint, lock_file, create)
+        except BaseException:
+            lock_file.close()
+            raise
+        if checkpoint is None:
+            os.remove(path)
+            lock_file.close()
+        return checkpoint
+
+    @classmethod
+    def _open_locked(cls, path, run_id, name, file_path, gt_fingerprint, lock_file, create):
+        previous, done = cls._read(path)
+        if previous is None and not create:
+            return None
+        header = {
+            'run_id': run_id,
+            'name': name,
+            'file_path': file_path,
+            'pred_sha1': cls.file_digest(file_path),
+            'gt_fingerprint': gt_fingerprint,
+        }
+        if previous is not None and all(previous.get(k) == v for k, v in header.items()):
+            return cls(path, previous, done, lock_file=lock_file)
+        header['created_at'] = time.time()
+        cls._write_lines(path, [header], mode='w')
+        return cls(path, header, lock_file=lock_file)
+
+    @classmethod
+    def pending(cls, directory):
+        """Headers of the checkpoints left in directory, i.e. evaluations that did not finish."""
+        if not os.path.isdir(directory):
+            return []
+        headers = []
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith('.jsonl'):
+                try:
+                    header, _ = cls._read(os.path.join(directory, filename))
+                except FileNotFoundError:
+                    # finished and removed by its owner meanwhile
+                    continue
+                if header is not None:
+                    headers.append(header)
+        return headers
+
+    @staticmethod
+    def _read(path):
+        header, done = None, {}
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # torn write at the end of the log
+                    break
+                if header is None:
+                    header = record
+                    continue
+                for index, key, score, status in record['items']:
+                    done[index] = (key, score, status)
+        return header, done
+
+    @staticmethod
+    def _write_lines(path, records, mode='a'):
+        with open(path, mode, encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add(self, index, key, score, status):
+        self._buffer.append([index, key, score, status])
+        self.done[index] = (key, score, status)
+        if (len(self._buffer) >= self.flush_items
+                or time.monotonic() - self._last_flush >= self.flush_seconds):
+            self.flush()
+
+    def flush(self):
+        """Hands the buffered items to the writer thread."""
+        if self._buffer:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint')
+            self._writer.submit(self._write_lines, self.path, [{'items': self._buffer}]).add_done_callback(
+                self._report_error)
+            self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def _report_error(self, future):
+        if future.exception() is not None:
+            print(f"[ERROR] Writing checkpoint {self.path}: {future.exception()}")
+
+    def _wait_writes(self):
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+
+    def close(self):
+        """Releases the checkpoint, leaving it on disk to be resumed."""
+        self.flush()
+        self._wait_writes()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def remove(self):
+        self._buffer = []
+        # a pending append would create the file again
+        self._wait_writes()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.close()
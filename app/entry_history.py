@@ -0,0 +1,77 @@
+import os
+import json
+import hmac
+import time
+import uuid
+import hashlib
+import secrets
+
+
+class EntryHistory(object):
+    ''' Version history of leaderboard entries: one JSON Lines file per entry
+        (directory/<name>.jsonl) with one record per version, the first one
+        for the scored submission and one more for every patch.
+
+        Also keeps the SHA-256 of each entry's patch token (directory/<name>.token),
+        handed out once when the submission is uploaded.
+        Callers serialize writes to one entry (see the entry lock in main.py).
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, name, suffix):
+        return os.path.join(self.directory, f"{name}{suffix}")
+
+    def versions(self, name):
+        """Every version of name, oldest first; [] for an entry without history."""
+        try:
+            with open(self._path(name, '.jsonl'), 'r', encoding='utf-8') as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def start(self, name, record):
+        """Starts the history of name over with record as version 1."""
+        return self._write(name, record, 1, 'w')
+
+    def append(self, name, record):
+        ''' Adds record as the next version of name.
+            @output: the stored record, with "version" and "created_at"
+        '''
+        versions = self.versions(name)
+        return self._write(name, record, versions[-1]['version'] + 1 if versions else 1, 'a')
+
+    def _write(self, name, record, version, mode):
+        os.makedirs(self.directory, exist_ok=True)
+        record = dict(record, version=version, created_at=time.time())
+        with open(self._path(name, '.jsonl'), mode, encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return record
+
+    def issue_token(self, name):
+        """Returns a new patch token for name, replacing the previous one."""
+        os.makedirs(self.directory, exist_ok=True)
+        token = secrets.token_urlsafe(24)
+        path = self._path(name, '.token')
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(hashlib.sha256(token.encode('utf-8')).hexdigest())
+        os.replace(tmp_path, path)
+        return token
+
+    def check_token(self, name, token):
+        if not token:
+            return False
+        try:
+            with open(self._path(name, '.token'), 'r', encoding='utf-8') as f:
+                expected = f.read().strip()
+        except FileNotFoundError:
+            return False
+        return hmac.compare_digest(expected, hashlib.sha256(token.encode('utf-8')).hexdigest())
+
+    def remove(self, name):
+        for suffix in ('.jsonl', '.token'):
+            try:
+                os.remove(self._path(name, suffix))
+            except FileNotFoundError:
+                pass
@@ -1,8 +1,39 @@
-import json
+import os
 import re
-from app.TEDS_metric import TEDS, convert_markdown_table_to_html, wrap_html_table
+import math
+import sys
+import json
+import gzip
+import zlib
+import hashlib
+import uuid
+import time
+import random
+import asyncio
+import itertools
+import threading
+from collections import Counter, OrderedDict
+from app import TEDS_metric
+from app.gt_store import GroundTruthStore
+from app.scheduler import FairScheduler
+from app.slices import summarize_slices
+from app.result_cache import ResultCache, submission_digest
+from app.TEDS_metric import (TEDS, HTML_TABLE_PARSE_STATS, cell_token_scope, convert_markdown_table_to_html,
+                             convert_markdown_table_to_tree, parse_html_table_tree,
+                             table_rows_to_tree, wrap_html_table)
 
 GROUND_TRUTH = None
+GROUND_TRUTH_STORE = None
+GROUND_TRUTH_STORE_PATH = "data/ground_truth.gtstore"
+DETAILS_DIR = "data/details"
+# 每份提交的分組（slice）分數摘要
+SUMMARIES_DIR = "data/summaries"
+# 評分用的 worker process 數
+EVAL_JOBS = int(os.getenv("EVAL_JOBS", "4"))
+# 完整評估前先評分的分層隨機樣本筆數，用來預估分數（0 表示不預估）
+PREVIEW_SAMPLE_SIZE = int(os.getenv("EVAL_PREVIEW_SAMPLE", "200"))
+# 各評分階段累計的秒數（gt_load / pred_parse / teds），供 --profile 使用
+SCORING_STAGE_TIMES = Counter()
 
 def load_ground_truth(path="data/ground_truth.json"):
     """
@@ -18,6 +49,55 @@ def load_ground_truth(path="data/ground_truth.json"):
     return GROUND_TRUTH
 
 
+def _load_gt_table(text):
+    return TEDS().load_table(normalize_to_tree(text))
+
+
+def _ground_truth_fingerprint(ground_truth):
+    """Ground Truth 內容與前處理程式碼的雜湊，任一改變都要重建 store"""
+    digest = hashlib.sha1(json.dumps(ground_truth, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    for module in (TEDS_metric, sys.modules[GroundTruthStore.__module__], sys.modules[__name__]):
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def load_ground_truth_store(path=GROUND_TRUTH_STORE_PATH):
+    """
+    載入前處理好的 Ground Truth 表格樹（memory-mapped 檔案，同一台主機的所有 process 共用一份）。
+    檔案不存在或與目前的 Ground Truth 不符時重新建立。
+    """
+    global GROUND_TRUTH_STORE
+    if GROUND_TRUTH_STORE is None:
+        ground_truth = load_ground_truth()
+        fingerprint = _ground_truth_fingerprint(ground_truth)
+        store = None
+        if os.path.exists(path):
+            try:
+                store = GroundTruthStore(path)
+            except ValueError:
+                store = None
+            if store is not None and store.fingerprint != fingerprint:
+                store = None
+        if store is None:
+            print("[INFO] Building ground truth store...")
+            store = GroundTruthStore.build(ground_truth, path, _load_gt_table, fingerprint,
+                                           source_format=table_source_format)
+        print(f"[INFO] Ground truth store ready: {path}")
+        GROUND_TRUTH_STORE = store
+    return GROUND_TRUTH_STORE
+
+
+def attach_ground_truth_store(path=GROUND_TRUTH_STORE_PATH):
+    """
+    給 worker process 使用：直接掛載主 process 建好的 store，
+    不讀 JSON、不重新前處理，也不複製資料。
+    """
+    global GROUND_TRUTH_STORE
+    GROUND_TRUTH_STORE = GroundTruthStore(path)
+    return GROUND_TRUTH_STORE
+
+
 def clean_latex(text: str) -> str:
     """移除多餘空白與換行符，避免 TEDS 誤判"""
     text = text.replace("\n", "")
@@ -39,6 +119,116 @@ def normalize_to_html(text: str) -> str:
         html_str = convert_markdown_table_to_html(text)
     return clean_latex(html_str)
 
+def table_source_format(text: str) -> str:
+    """表格文字的來源格式：html / latex / markdown（與 normalize_to_tree 的判斷相同）"""
+    stripped = text.strip()
+    if "<table" in stripped:
+        return "html"
+    if stripped.startswith("\\begin{tabular}") or stripped.startswith("\\begin{table}"):
+        return "latex"
+    return "markdown"
+
+
+def normalize_to_tree(text: str):
+    """
+    與 normalize_to_html 相同的判斷，但 Markdown / LaTeX 表格直接建成 TEDS 樹，
+    省去產生 HTML 字串再由 lxml 解析的來回；
+    HTML 表格若只用到 table/thead/tbody/tr/td/th 也直接建樹，
+    其餘無法直接轉換的內容則回傳 normalize_to_html 的結果。
+    兩種回傳值都可以直接交給 TEDS.evaluate。
+    """
+    stripped = text.strip()
+    source_format = table_source_format(stripped)
+    if source_format == "html":
+        tree = parse_html_table_tree(stripped)
+    elif source_format == "latex":
+        table_rows = latex_table_rows(stripped)
+        tree = table_rows_to_tree(table_rows) if table_rows is not None else None
+    else:
+        tree = convert_markdown_table_to_tree(stripped)
+    return tree if tree is not None else normalize_to_html(text)
+
+
+# splitlines() 會斷行的字元
+_LATEX_LINE_BREAKS = frozenset('\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029')
+# "\textbf{" 的前綴：移除 tabular 宣告後可能和後面的字元接成新的 \textbf{
+_TEXTBF_PREFIX = re.compile(r'\\(?:t(?:e(?:x(?:t(?:bf?)?)?)?)?)?$')
+
+
+def _post_env_tail(latex_str, pos, removed):
+    """移除 tabular 宣告後，pos 之前的最後幾個字元"""
+    tail = []
+    k = len(removed) - 1
+    while pos > 0 and len(tail) < 8:
+        if k >= 0 and removed[k][1] == pos:
+            pos = removed[k][0]
+            k -= 1
+            continue
+        pos -= 1
+        tail.append(latex_str[pos])
+    return ''.join(reversed(tail))
+
+
+def latex_table_rows(latex_str):
+    """
+    單次掃描的 LaTeX tabular 詞法分析，得到與 latex_to_html_table 相同的儲存格：
+    \\\\ 換列、& 分欄、去掉 begin/end{tabular}{...} 與 \\textbf{...}、刪除 $ 與反斜線。
+    若 \\textbf 或欄位格式內還有其他指令（latex_to_html_table 的多次 regex 會互相影響），
+    回傳 None，交由 latex_to_html_table 處理。
+    """
+    latex_str = latex_str.strip()
+    n = len(latex_str)
+    lines = []
+    line = []
+    removed = []  # 已移除的 begin/end{tabular}{...} 範圍
+    textbf_end = -1  # 目前 \textbf{...} 的右大括號位置
+    i = 0
+    while i < n:
+        c = latex_str[i]
+        if i == textbf_end:
+            textbf_end = -1
+            i += 1
+            continue
+        if c == '\\':
+            if latex_str.startswith('\\', i + 1):
+                lines.append(''.join(line))
+                line = []
+                i += 2
+                continue
+            if latex_str.startswith('begin{tabular}{', i + 1) or latex_str.startswith('end{tabular}{', i + 1):
+                open_brace = latex_str.index('}{', i) + 1
+                close_brace = latex_str.find('}', open_brace + 1)
+                spec = latex_str[open_brace + 1:close_brace]
+                if close_brace != -1 and '\\' in spec:
+                    return None
+                if close_brace != -1 and '\n' not in spec:
+                    if _TEXTBF_PREFIX.search(_post_env_tail(latex_str, i, removed)):
+                        return None
+                    removed.append((i, close_brace + 1))
+                    i = close_brace + 1
+                    continue
+            elif latex_str.startswith('textbf{', i + 1):
+                close_brace = latex_str.find('}', i + 8)
+                content = latex_str[i + 8:close_brace]
+                if close_brace != -1 and '\\' in content:
+                    return None
+                if close_brace != -1 and '\n' not in content:
+                    textbf_end = close_brace
+                    i += 8
+                    continue
+            # 其餘反斜線直接刪除
+            i += 1
+            continue
+        if c in _LATEX_LINE_BREAKS:
+            lines.append(''.join(line))
+            line = []
+        elif c != '$':
+            line.append(c)
+        i += 1
+    lines.append(''.join(line))
+    return [[cell.strip() for cell in line.split('&')] for line in lines if '&' in line]
+
+
 def latex_to_html_table(latex_str):
     latex_str = latex_str.strip()
     latex_str = re.sub(r'\\\\', '\n', latex_str)  # 把行尾的 \\ 換成換行
@@ -55,7 +245,637 @@ def latex_to_html_table(latex_str):
     html_table += "</table></body></html>"
     return html_table
 
-def evaluate(pred_path, progress_callback=None):
+def score_item(teds, gt_store, key, pred_text):
+    """單筆評分，回傳 (score, status)；各階段耗時累計到 SCORING_STAGE_TIMES"""
+    try:
+        start = time.perf_counter()
+        gt_table = gt_store.load_table(key)
+        gt_loaded = time.perf_counter()
+        pred_table = teds.load_table(normalize_to_tree(pred_text))
+        pred_parsed = time.perf_counter()
+        score = teds.evaluate_tables(pred_table, gt_table)
+        SCORING_STAGE_TIMES['gt_load'] += gt_loaded - start
+        SCORING_STAGE_TIMES['pred_parse'] += pred_parsed - gt_loaded
+        SCORING_STAGE_TIMES['teds'] += time.perf_counter() - pred_parsed
+        return max(score, 0.0), "valid"
+    except Exception as e:
+        # 處理單筆資料評估錯誤
+        return 0.0, f"error: {str(e)[:50]}"
+
+
+class _LastTable(object):
+    """包裝 gt_store：連續評分同一筆 Ground Truth 時（批次評估依項目分組）重用上一次載入的表格樹"""
+
+    def __init__(self, gt_store):
+        self.gt_store = gt_store
+        self.key = None
+        self.table = None
+
+    def load_table(self, key):
+        if key != self.key:
+            self.table = self.gt_store.load_table(key)
+            self.key = key
+        return self.table
+
+
+def _score_timed(teds, gt_store, items):
+    """
+    評分 [(key, pred_text), ...]，回傳 [(score, status, seconds), ...]。
+    表格樹只在同一個 cell_token_scope 內使用，結束後儲存格的詞彙表可能被清空（見 TEDS_metric）。
+    """
+    results = []
+    with cell_token_scope():
+        gt_store = _LastTable(gt_store)
+        for key, pred_text in items:
+            start = time.perf_counter()
+            score, status = score_item(teds, gt_store, key, pred_text)
+            results.append((score, status, time.perf_counter() - start))
+    return results
+
+
+def estimate_item_cost(gt_nodes, pred_text):
+    """
+    單筆評分成本的估計：Ground Truth 節點數 × 預測表格的節點數估計
+    （APTED 的成本大致與兩棵樹大小的乘積成正比）。
+    """
+    if isinstance(pred_text, str):
+        pred_nodes = (pred_text.count('<t') + pred_text.count('|') + pred_text.count('&')
+                      + pred_text.count('\n') + 1)
+    else:
+        pred_nodes = 1
+    return max(gt_nodes, 1) * pred_nodes
+
+
+def estimate_prediction_cost(gt_store, key, pred_text):
+    """一筆預測的評分成本估計；缺失、空白或不在 Ground Truth 中的預測不計成本"""
+    if pred_text and key in gt_store and gt_store.n_nodes(key):
+        return estimate_item_cost(gt_store.n_nodes(key), pred_text)
+    return 0
+
+
+def estimate_submission_cost(predictions, gt_store=None):
+    """
+    整份提交的評分成本估計（與 score_items 切塊時用的成本相同單位），
+    用於上傳時的流量控制。缺失、空白或非 dict 的預測不計成本。
+    """
+    gt_store = gt_store or load_ground_truth_store()
+    if not isinstance(predictions, dict):
+        return 0
+    return sum(estimate_prediction_cost(gt_store, key, pred_text) for key, pred_text in predictions.items())
+
+
+def reference_submission_cost(gt_store=None):
+    """Ground Truth 本身當作預測時的成本，作為「一份完整提交」的成本單位"""
+    gt_store = gt_store or load_ground_truth_store()
+    return sum(estimate_item_cost(gt_store.n_nodes(key), gt_text)
+               for key, gt_text in load_ground_truth().items()
+               if gt_text and key in gt_store and gt_store.n_nodes(key))
+
+
+# 每塊最多的評分筆數（見 plan_chunks）
+_MAX_CHUNK_ITEMS = 16
+
+
+def plan_chunks(costs, n_workers, chunks_per_worker=4, max_chunk_items=_MAX_CHUNK_ITEMS):
+    """
+    由大到小排序後切塊：每塊的目標成本是剩餘成本 / (n_workers × chunks_per_worker)，
+    大的項目單獨成塊、尾端的小項目合併，讓所有 worker 大約同時結束。
+    目標成本不低於總成本的 1/(n_workers × chunks_per_worker × 16)，避免尾端切得太碎；
+    每塊最多 max_chunk_items 筆，讓同時進行的其他評估能在 chunk 之間插隊。
+    回傳 [[item_index, ...], ...]，依派送順序排列。
+    """
+    order = sorted(range(len(costs)), key=costs.__getitem__, reverse=True)
+    remaining = float(sum(costs))
+    min_target = remaining / (n_workers * chunks_per_worker * 16)
+    chunks = []
+    i = 0
+    while i < len(order):
+        target = max(remaining / (n_workers * chunks_per_worker), min_target)
+        chunk = [order[i]]
+        chunk_cost = costs[order[i]]
+        i += 1
+        while (i < len(order) and len(chunk) < max_chunk_items
+               and chunk_cost + costs[order[i]] <= target):
+            chunk.append(order[i])
+            chunk_cost += costs[order[i]]
+            i += 1
+        remaining -= chunk_cost
+        chunks.append(chunk)
+    return chunks
+
+
+_WORKER_TEDS = None
+
+
+def _init_scoring_worker(store_path):
+    global _WORKER_TEDS
+    attach_ground_truth_store(store_path)
+    _WORKER_TEDS = TEDS()
+
+
+def _score_payload(teds, gt_store, items):
+    """評分一塊 [(key, pred_text), ...]，回傳分數、HTML 解析統計與各階段耗時"""
+    html_stats_before = HTML_TABLE_PARSE_STATS.copy()
+    stage_times_before = SCORING_STAGE_TIMES.copy()
+    results = _score_timed(teds, gt_store, items)
+    return results, HTML_TABLE_PARSE_STATS - html_stats_before, SCORING_STAGE_TIMES - stage_times_before
+
+
+def _score_chunk(items):
+    """在 worker process 中評分一塊 [(key, pred_text), ...]"""
+    return _score_payload(_WORKER_TEDS, GROUND_TRUTH_STORE, items)
+
+
+_SCHEDULERS = {}
+_SCHEDULERS_LOCK = threading.Lock()
+
+
+def get_scheduler(n_jobs, store_path):
+    """共用的評分排程器：同時進行的評估以 chunk 為單位公平地輪流使用同一個 process pool"""
+    with _SCHEDULERS_LOCK:
+        scheduler = _SCHEDULERS.get(n_jobs)
+        if scheduler is None:
+            scheduler = _SCHEDULERS[n_jobs] = FairScheduler(n_jobs, _score_chunk,
+                                                           initializer=_init_scoring_worker,
+                                                           initargs=(store_path,))
+        return scheduler
+
+
+# 各評估工作的預估分數（見 evaluate_async），附在工作狀態中；只保留最近的工作
+_JOB_PREVIEWS = OrderedDict()
+_MAX_JOB_PREVIEWS = 200
+
+
+def _set_job_preview(job_id, preview):
+    with _SCHEDULERS_LOCK:
+        _JOB_PREVIEWS[job_id] = preview
+        while len(_JOB_PREVIEWS) > _MAX_JOB_PREVIEWS:
+            _JOB_PREVIEWS.popitem(last=False)
+
+
+def _with_preview(status):
+    preview = _JOB_PREVIEWS.get(status["job_id"])
+    return dict(status, preview=preview) if preview is not None else status
+
+
+def get_job_status(job_id):
+    """評估工作的進度與吞吐量（已預估分數時附 preview），找不到時回傳 None"""
+    for scheduler in list(_SCHEDULERS.values()):
+        status = scheduler.status(job_id)
+        if status is not None:
+            return _with_preview(status)
+    return None
+
+
+def list_job_statuses():
+    return [_with_preview(job.status())
+            for scheduler in list(_SCHEDULERS.values()) for job in list(scheduler.jobs.values())]
+
+
+def _plan_scoring_chunks(gt_store, items, n_jobs, group_by_key=False):
+    """
+    依估計成本由大到小把 [(index, key, pred_text), ...] 分塊，回傳排程器的 [(payload, cost, context), ...]。
+    group_by_key：同一筆 Ground Truth 的項目（批次評估中各份提交的預測）放在同一塊且相鄰，
+    worker 只需載入一次該筆的表格樹；每組最多 _MAX_CHUNK_ITEMS 筆。
+    """
+    costs = [estimate_item_cost(gt_store.n_nodes(key), pred_text) for _, key, pred_text in items]
+    if group_by_key:
+        groups = {}
+        for i, (_, key, _) in enumerate(items):
+            groups.setdefault(key, []).append(i)
+        units = [group[start:start + _MAX_CHUNK_ITEMS] for group in groups.values()
+                 for start in range(0, len(group), _MAX_CHUNK_ITEMS)]
+    else:
+        units = [[i] for i in range(len(items))]
+    unit_costs = [sum(costs[i] for i in unit) for unit in units]
+    max_unit_items = max((len(unit) for unit in units), default=1)
+    chunks = []
+    for chunk in plan_chunks(unit_costs, n_jobs, max_chunk_items=max(_MAX_CHUNK_ITEMS // max_unit_items, 1)):
+        chunk_items = [items[i] for unit in chunk for i in units[unit]]
+        payload = [(key, pred_text) for _, key, pred_text in chunk_items]
+        chunks.append((payload, sum(unit_costs[unit] for unit in chunk), chunk_items))
+    return chunks
+
+
+def _submit_scoring_job(gt_store, items, n_jobs, job_id, group_by_key=False):
+    """把 [(index, key, pred_text), ...] 分塊（見 _plan_scoring_chunks）交給共用的排程器"""
+    chunks = _plan_scoring_chunks(gt_store, items, n_jobs, group_by_key)
+    return get_scheduler(n_jobs, gt_store.path).submit(chunks, job_id=job_id)
+
+
+def _chunk_results(chunk_items, chunk_result, html_stats, profile):
+    """展開一塊的評分結果為 (index, key, score, status)，並累計統計與耗時"""
+    results, chunk_html_stats, chunk_stage_times = chunk_result
+    if html_stats is not None:
+        html_stats.update(chunk_html_stats)
+    if profile is not None:
+        profile["stages"].update(chunk_stage_times)
+    for (index, key, _), (score, status, seconds) in zip(chunk_items, results):
+        if profile is not None:
+            profile["items"][key] = seconds
+        yield index, key, score, status
+
+
+def score_items(gt_store, items, n_jobs=None, html_stats=None, job_id=None, profile=None):
+    """
+    評分 [(index, key, pred_text), ...]，依完成順序 yield (index, key, score, status)。
+    n_jobs > 1 時依估計成本由大到小分塊，交給共用的排程器派送給 worker process。
+    profile 為 {"stages": Counter, "items": dict} 時，累計各階段耗時與每筆的評分秒數。
+    """
+    n_jobs = EVAL_JOBS if n_jobs is None else n_jobs
+    if n_jobs == 1 or len(items) <= 1:
+        teds = TEDS()
+        for item in items:
+            chunk_result = _score_payload(teds, gt_store, [item[1:]])
+            yield from _chunk_results([item], chunk_result, html_stats, profile)
+        return
+
+    job = _submit_scoring_job(gt_store, items, n_jobs, job_id)
+    for chunk_items, chunk_result in job.iter_results():
+        yield from _chunk_results(chunk_items, chunk_result, html_stats, profile)
+
+
+# n_jobs == 1 時，每次交給 thread 評分的筆數（之間把控制權交還 event loop）
+_INLINE_CHUNK_ITEMS = 16
+
+
+async def score_items_async(gt_store, items, n_jobs=None, html_stats=None, job_id=None, profile=None,
+                            group_by_key=False):
+    """
+    score_items 的 async 版本：等待 worker pool 的結果時不佔用任何 thread，
+    依完成順序 yield (index, key, score, status)。
+    n_jobs == 1 時在 thread 中逐塊評分，避免阻塞 event loop。
+    group_by_key：同一筆 Ground Truth 的項目分在同一塊（見 _submit_scoring_job）。
+    """
+    n_jobs = EVAL_JOBS if n_jobs is None else n_jobs
+    if n_jobs == 1 or len(items) <= 1:
+        teds = TEDS()
+        for start in range(0, len(items), _INLINE_CHUNK_ITEMS):
+            chunk_items = items[start:start + _INLINE_CHUNK_ITEMS]
+            payload = [(key, pred_text) for _, key, pred_text in chunk_items]
+            chunk_result = await asyncio.to_thread(_score_payload, teds, gt_store, payload)
+            for result in _chunk_results(chunk_items, chunk_result, html_stats, profile):
+                yield result
+        return
+
+    job = _submit_scoring_job(gt_store, items, n_jobs, job_id, group_by_key)
+    async for chunk_items, chunk_result in job.aiter_results():
+        for result in _chunk_results(chunk_items, chunk_result, html_stats, profile):
+            yield result
+
+
+# 逐筆讀取的預測檔每次分塊送出的筆數；已讀取但尚未評分完成的項目最多為其 2 倍
+_STREAM_WINDOW_ITEMS = 256
+
+
+def _stream_windows(items, window):
+    """把 iterator 切成每份 window 筆的 list（在 thread 中讀取）"""
+    return lambda: list(itertools.islice(items, window))
+
+
+def score_stream(gt_store, items, n_jobs=None, html_stats=None, job_id=None, profile=None,
+                 window=_STREAM_WINDOW_ITEMS):
+    """
+    score_items 的逐筆讀取版本：items 為 (index, key, pred_text) 的 iterator（例如逐行讀取的 JSON Lines），
+    每讀取 window 筆就分塊加入同一個評分工作，已讀取但尚未評分完成的項目不超過 2 × window 筆，
+    記憶體用量與預測檔大小無關。依完成順序 yield (index, key, score, status)。
+    """
+    n_jobs = EVAL_JOBS if n_jobs is None else n_jobs
+    take = _stream_windows(items, window)
+    if n_jobs == 1:
+        for batch in iter(take, []):
+            yield from score_items(gt_store, batch, 1, html_stats, job_id, profile)
+        return
+
+    scheduler = get_scheduler(n_jobs, gt_store.path)
+    job = scheduler.submit([], job_id=job_id, closed=False)
+    results = job.iter_results()
+    outstanding = 0
+    try:
+        while True:
+            while not job.closed and outstanding < 2 * window:
+                batch = take()
+                if batch:
+                    scheduler.extend(job, _plan_scoring_chunks(gt_store, batch, n_jobs))
+                    outstanding += len(batch)
+                else:
+                    scheduler.close(job)
+            try:
+                chunk_items, chunk_result = next(results)
+            except StopIteration:
+                return
+            outstanding -= len(chunk_items)
+            yield from _chunk_results(chunk_items, chunk_result, html_stats, profile)
+    finally:
+        if not job.closed:
+            scheduler.close(job, cancel=True)
+
+
+async def score_stream_async(gt_store, items, n_jobs=None, html_stats=None, job_id=None,
+                             window=_STREAM_WINDOW_ITEMS):
+    """score_stream 的 async 版本：在 thread 中讀取 items，等待評分結果時不佔用 thread"""
+    n_jobs = EVAL_JOBS if n_jobs is None else n_jobs
+    take = _stream_windows(items, window)
+    if n_jobs == 1:
+        while True:
+            batch = await asyncio.to_thread(take)
+            if not batch:
+                return
+            async for result in score_items_async(gt_store, batch, 1, html_stats, job_id):
+                yield result
+
+    scheduler = get_scheduler(n_jobs, gt_store.path)
+    job = scheduler.submit([], job_id=job_id, closed=False)
+    results = job.aiter_results()
+    outstanding = 0
+    try:
+        while True:
+            while not job.closed and outstanding < 2 * window:
+                batch = await asyncio.to_thread(take)
+                if batch:
+                    scheduler.extend(job, _plan_scoring_chunks(gt_store, batch, n_jobs))
+                    outstanding += len(batch)
+                else:
+                    scheduler.close(job)
+            try:
+                chunk_items, chunk_result = await results.__anext__()
+            except StopAsyncIteration:
+                return
+            outstanding -= len(chunk_items)
+            for result in _chunk_results(chunk_items, chunk_result, html_stats, None):
+                yield result
+    finally:
+        if not job.closed:
+            scheduler.close(job, cancel=True)
+        await results.aclose()
+
+
+# JSON Lines 預測檔的第一個物件以 "id" 或 "pred" 開頭
+_JSONL_START = re.compile(rb'\s*\{\s*"(?:id|pred)"\s*:')
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+# gzip 壓縮的預測檔損壞時拋出的錯誤
+_GZIP_ERRORS = (gzip.BadGzipFile, EOFError, zlib.error)
+
+
+def _open_predictions(pred_path):
+    """以文字模式開啟預測檔，gzip 壓縮的檔案（依開頭的 magic bytes 判斷）即時解壓縮"""
+    with open(pred_path, 'rb') as f:
+        compressed = f.read(2) == _GZIP_MAGIC
+    if compressed:
+        return gzip.open(pred_path, 'rt', encoding='utf-8')
+    return open(pred_path, 'r', encoding='utf-8')
+
+
+def is_jsonl_predictions(pred_path):
+    """預測檔是否為 JSON Lines（每行 {"id": ..., "pred": ...}），依檔案開頭判斷"""
+    try:
+        with _open_predictions(pred_path) as f:
+            head = f.buffer.read(4096)
+    except _GZIP_ERRORS:
+        return False
+    return _JSONL_START.match(head) is not None
+
+
+def _iter_jsonl_predictions(pred_path):
+    """逐行讀取 JSON Lines 預測檔，yield (id, pred_text)；格式錯誤時拋出 ValueError（附行號）"""
+    line_number = 0
+    try:
+        with _open_predictions(pred_path) as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    key, pred_text = record["id"], record.get("pred")
+                except (ValueError, TypeError, KeyError, AttributeError):
+                    raise ValueError(f"上傳的檔案格式錯誤：第 {line_number} 行必須是 "
+                                     f'{{"id": ..., "pred": ...}} 的 JSON 物件。')
+                if isinstance(key, int) and not isinstance(key, bool):
+                    key = str(key)
+                if not isinstance(key, str):
+                    raise ValueError(f"上傳的檔案格式錯誤：第 {line_number} 行的 id 必須是字串。")
+                yield key, pred_text
+    except UnicodeDecodeError:
+        raise ValueError(f"上傳的檔案格式錯誤：第 {line_number + 1} 行的編碼不正確，請確保使用 UTF-8 編碼。")
+    except _GZIP_ERRORS as e:
+        raise ValueError(f"上傳的檔案格式錯誤：gzip 解壓縮失敗（{e}）。")
+
+
+def _repeated_id_error(key):
+    return ValueError(f"上傳的檔案格式錯誤：id「{key}」重複出現。")
+
+
+def iter_predictions(pred_path):
+    """
+    逐筆讀取預測檔，yield (id, pred_text)。
+    JSON（{id: 表格}）整份載入；JSON Lines（每行 {"id": ..., "pred": ...}）逐行讀取，記憶體用量與檔案大小無關。
+    兩種格式都可以 gzip 壓縮。格式錯誤時拋出 ValueError。
+    """
+    if is_jsonl_predictions(pred_path):
+        return _iter_jsonl_predictions(pred_path)
+    return iter(_load_predictions(pred_path).items())
+
+
+def _load_predictions(pred_path):
+    """整份載入預測檔為 {id: pred_text}；JSON Lines 中同一個 Ground Truth id 出現兩次時拋出 ValueError"""
+    if is_jsonl_predictions(pred_path):
+        ground_truth = load_ground_truth()
+        predictions = {}
+        for key, pred_text in _iter_jsonl_predictions(pred_path):
+            if key in predictions and key in ground_truth:
+                raise _repeated_id_error(key)
+            predictions[key] = pred_text
+        return predictions
+    try:
+        with _open_predictions(pred_path) as f:
+            predictions = json.load(f)
+    except _GZIP_ERRORS as e:
+        raise ValueError(f"上傳的檔案格式錯誤：gzip 解壓縮失敗（{e}）。")
+    except json.JSONDecodeError as e:
+        raise ValueError(f"上傳的檔案格式錯誤：無法解析 JSON 格式。錯誤訊息：{str(e)}")
+    except UnicodeDecodeError:
+        raise ValueError("上傳的檔案格式錯誤：檔案編碼不正確，請確保使用 UTF-8 編碼。")
+    if not isinstance(predictions, dict):
+        raise ValueError("上傳的檔案格式錯誤：JSON 的最外層必須是 {id: 表格} 的物件。")
+    return predictions
+
+
+class _EvaluationState(object):
+    """一次評估的進行狀態：每筆的詳細分數與未四捨五入的分數（依 Ground Truth 的順序）與累計分數"""
+
+    def __init__(self, ground_truth, predictions, done=None):
+        """predictions 為 None 時（逐筆讀取的 JSON Lines）由 stream_pending 一邊讀取一邊分類"""
+        done = done or {}
+        self.ground_truth = ground_truth
+        self.total_items = len(ground_truth)
+        self.details = [None] * self.total_items
+        self.scores = [None] * self.total_items
+        self.total_score = 0.0
+        self.valid_count = 0
+        self.current_item = 0
+        self.html_stats = Counter()
+        self.skipped = []
+        self.resumed = []
+        self.pending = []
+        for index, (key, gt_text) in enumerate(ground_truth.items()):
+            # 檢查點中已評分的項目不再重新計算
+            if index in done and done[index][0] == key:
+                _, score, status = done[index]
+                self.resumed.append((index, key, score, status))
+                continue
+            if predictions is not None:
+                item = self._classify(index, key, gt_text, predictions.get(key, ""))
+                if item is not None:
+                    self.pending.append(item)
+
+    def _classify(self, index, key, gt_text, pred_text):
+        """需要評分時回傳 (index, key, pred_text)；缺失或空白的資料直接加入 skipped"""
+        if not gt_text or not pred_text:
+            self.skipped.append((index, key, 0.0, "missing" if not pred_text else "invalid"))
+            return None
+        return index, key, pred_text
+
+    def stream_pending(self, predictions):
+        """
+        逐筆分類 (id, pred_text) 的 iterator（例如 iter_predictions），yield 需要評分的 (index, key, pred_text)；
+        缺失或空白的加入 skipped，讀完後 Ground Truth 中沒有出現的 id 以 missing 補上。
+        不在 Ground Truth 中的 id 略過；同一個 id 出現兩次時拋出 ValueError。
+        """
+        index_of = {key: index for index, key in enumerate(self.ground_truth)}
+        resumed = {item[0] for item in self.resumed}
+        seen = set()
+        for key, pred_text in predictions:
+            index = index_of.get(key)
+            if index is None:
+                continue
+            if index in seen:
+                raise _repeated_id_error(key)
+            seen.add(index)
+            if index in resumed:
+                continue
+            item = self._classify(index, key, self.ground_truth[key], pred_text)
+            if item is not None:
+                yield item
+        for index, key in enumerate(self.ground_truth):
+            if index not in seen and index not in resumed:
+                self.skipped.append((index, key, 0.0, "missing"))
+
+    def record(self, index, key, score, status):
+        self.details[index] = {
+            "id": key,
+            "score": round(score, 4),
+            "status": status
+        }
+        self.scores[index] = score
+        if status == "valid":
+            self.total_score += score
+            self.valid_count += 1
+        self.current_item += 1
+        return self.details[index]
+
+    def result(self):
+        html_total = self.html_stats['fast'] + self.html_stats['lxml']
+        if html_total:
+            print(f"[INFO] HTML table fast path: {self.html_stats['fast']}/{html_total} "
+                  f"({self.html_stats['fast'] / html_total:.1%}), lxml fallback: {self.html_stats['lxml']}")
+
+        return {
+            "TEDS": average_score(self.details, self.scores),
+            "details": self.details,
+            "scores": self.scores,
+            "valid_count": self.valid_count,
+            "total_count": self.total_items
+        }
+
+
+def average_score(details, scores):
+    """
+    平均 TEDS（四捨五入到小數點後 4 位）：以 math.fsum 加總有效項目未四捨五入的分數（scores，與 details 對齊），
+    結果與評分完成的順序無關，修正後重新計算的平均分數與完整評估一致。
+    """
+    # 使用 ground_truth 的總筆數作為分母，而不是有效筆數
+    # 這樣缺失或錯誤的資料會以 0 分計入平均
+    total = math.fsum(score for score, detail in zip(scores, details) if detail["status"] == "valid")
+    return round(total / len(details), 4) if details else 0.0
+
+
+def _deferred(get_items):
+    """在前面的項目都產生完之後才取得 get_items() 的內容（JSON Lines 讀完後才知道缺少哪些 id）"""
+    yield from get_items()
+
+
+# 預估分數：依 Ground Truth 表格大小（節點數）分的層數與信賴區間的 z 值（95%）
+_PREVIEW_STRATA = 5
+_PREVIEW_Z = 1.96
+
+
+def stratified_sample(gt_store, keys, sample_size, strata=_PREVIEW_STRATA, seed=None):
+    """
+    依 Ground Truth 的表格大小分層隨機抽樣：有表格的項目依節點數排序後分成筆數相同的 strata 層，
+    沒有表格的項目另成一層；各層依筆數比例分配樣本（每層至少 2 筆，不超過該層筆數）。
+    同一個 seed 抽出相同的樣本。
+    回傳 [(該層的筆數, [抽中的 id, ...]), ...]
+    """
+    sizes = sorted((gt_store.n_nodes(key) if key in gt_store else 0, key) for key in keys)
+    groups = [[key for n_nodes, key in sizes if not n_nodes]]
+    tables = [key for n_nodes, key in sizes if n_nodes]
+    bounds = [round(len(tables) * i / strata) for i in range(strata + 1)]
+    groups += [tables[start:end] for start, end in zip(bounds, bounds[1:])]
+    rng = random.Random(seed)
+    sampled = []
+    for group in groups:
+        if group:
+            n = min(len(group), max(2, round(sample_size * len(group) / len(sizes))))
+            sampled.append((len(group), rng.sample(group, n)))
+    return sampled
+
+
+def preview_estimate(strata, scores, z=_PREVIEW_Z):
+    """
+    由 stratified_sample 的樣本分數（{id: score}）估計整份提交的平均 TEDS：
+    分層平均數與其信賴區間（各層的樣本變異數，含有限母體校正）。
+    回傳 {"teds", "ci_low", "ci_high", "margin", "sample_size", "strata"}
+    """
+    total = sum(size for size, _ in strata)
+    mean = 0.0
+    variance = 0.0
+    for size, keys in strata:
+        values = [scores[key] for key in keys]
+        n = len(values)
+        stratum_mean = sum(values) / n
+        weight = size / total
+        mean += weight * stratum_mean
+        if 1 < n < size:
+            sample_variance = sum((value - stratum_mean) ** 2 for value in values) / (n - 1)
+            variance += weight ** 2 * (1 - n / size) * sample_variance / n
+    margin = z * math.sqrt(variance)
+    return {
+        "teds": round(mean, 4),
+        "ci_low": round(max(mean - margin, 0.0), 4),
+        "ci_high": round(min(mean + margin, 1.0), 4),
+        "margin": round(margin, 4),
+        "sample_size": sum(len(keys) for _, keys in strata),
+        "strata": len(strata)
+    }
+
+
+async def _score_subset_async(ground_truth, gt_store, predictions, n_jobs=None, html_stats=None, job_id=None):
+    """只評分 predictions（{id: pred_text}，id 都在 ground_truth 中）的項目，回傳 {id: (未四捨五入的 score, status)}"""
+    # 依 Ground Truth 的順序，只包含要評分的項目
+    state = _EvaluationState({key: gt_text for key, gt_text in ground_truth.items() if key in predictions},
+                             predictions)
+    if html_stats is not None:
+        state.html_stats = html_stats
+    for item in state.skipped:
+        state.record(*item)
+    async for item in score_items_async(gt_store, state.pending, n_jobs, state.html_stats, job_id):
+        state.record(*item)
+    return {detail["id"]: (score, detail["status"]) for detail, score in zip(state.details, state.scores)}
+
+
+def evaluate(pred_path, progress_callback=None, n_jobs=None, job_id=None, profile=None):
     """
     使用 TEDS 計算 Ground Truth 與預測結果的平均相似度。
     回傳整體平均分數和每筆資料的詳細分數。
@@ -63,6 +883,9 @@ def evaluate(pred_path, progress_callback=None):
     Args:
         pred_path: 預測結果檔案路徑
         progress_callback: 進度回調函數，接收 (current, total, key) 參數
+        n_jobs: 評分用的 worker process 數，預設為 EVAL_JOBS
+        job_id: 排程器中的工作 ID，可用 get_job_status 查詢進度與吞吐量
+        profile: {"stages": Counter, "items": dict}，收集各階段耗時與每筆的評分秒數
     
     Returns:
         dict: {
@@ -70,79 +893,471 @@ def evaluate(pred_path, progress_callback=None):
             "details": [    # 每筆資料的詳細分數
                 {"id": str, "score": float, "status": str},
                 ...
-            ]
+            ],
+            "scores": [float, ...]  # 與 details 對齊的未四捨五入分數
         }
     """
     ground_truth = load_ground_truth()
-
-    try:
-        with open(pred_path, 'r', encoding='utf-8') as f:
-            predictions = json.load(f)
-    except json.JSONDecodeError as e:
-        raise ValueError(f"上傳的檔案格式錯誤：無法解析 JSON 格式。錯誤訊息：{str(e)}")
-    except UnicodeDecodeError:
-        raise ValueError("上傳的檔案格式錯誤：檔案編碼不正確，請確保使用 UTF-8 編碼。")
-    
-    teds = TEDS(n_jobs=4)
-    total_score = 0.0
-    valid_count = 0
-    
-    # 儲存每筆資料的詳細分數
-    details = []
-    
-    # 計算總數
-    total_items = len(ground_truth)
-    current_item = 0
-
-    for key, gt_text in ground_truth.items():
-        current_item += 1
-        
+    gt_store = load_ground_truth_store()
+    if is_jsonl_predictions(pred_path):
+        # JSON Lines：一邊讀取一邊評分，缺失的項目最後補上
+        state = _EvaluationState(ground_truth, None)
+        scored = score_stream(gt_store, state.stream_pending(iter_predictions(pred_path)), n_jobs,
+                              state.html_stats, job_id, profile)
+        items = itertools.chain(scored, _deferred(lambda: state.skipped))
+    else:
+        state = _EvaluationState(ground_truth, _load_predictions(pred_path))
+        scored = score_items(gt_store, state.pending, n_jobs, state.html_stats, job_id, profile)
+        items = itertools.chain(state.skipped, scored)
+    for index, key, score, status in items:
+        state.record(index, key, score, status)
         # 回報進度
         if progress_callback:
-            progress_callback(current_item, total_items, key)
-        
-        pred_text = predictions.get(key, "")
-        
-        # 處理缺失或空白的資料
-        if not gt_text or not pred_text:
-            details.append({
-                "id": key,
-                "score": 0.0,
-                "status": "missing" if not pred_text else "invalid"
-            })
-            continue
+            progress_callback(state.current_item, state.total_items, key)
+
+    return state.result()
+
 
+async def evaluate_async(pred_path, n_jobs=None, job_id=None, progress_interval=0.5, checkpoint=None,
+                         preview_size=None):
+    """
+    evaluate 的 async 版本，回傳 async iterator，依序產生：
+        {"type": "preview", "teds", "ci_low", "ci_high", "margin", "sample_size", "strata", "elapsed"}
+            預估分數：先評分 preview_size 筆（預設 PREVIEW_SAMPLE_SIZE）依表格大小分層的隨機樣本，
+            以分層平均數與 95% 信賴區間估計，也附在工作狀態中；Ground Truth 不到樣本數的 2 倍時省略。
+            樣本的分數直接沿用到完整評估，不會重複評分
+        {"type": "item", "index", "id", "score", "status"}  每筆評分完成時
+        {"type": "progress", "current", "total", "percentage", "current_key",
+         "teds_so_far", "valid_count", "items_per_second"}  至少每 progress_interval 秒一次
+        {"type": "complete", "result": evaluate 的回傳值}  最後一個
+    評分由共用的 worker pool 完成，等待結果時不佔用 thread，
+    同一個 event loop 可以同時服務大量的評估與觀看者。
+    checkpoint（EvaluationCheckpoint）：已記錄的項目直接沿用，
+    新完成的項目分批寫入，程序中斷後可從上次的檢查點繼續。
+    格式錯誤時拋出 ValueError。
+    """
+    ground_truth = load_ground_truth()
+    gt_store = load_ground_truth_store()
+    streamed = await asyncio.to_thread(is_jsonl_predictions, pred_path)
+    predictions = None if streamed else await asyncio.to_thread(_load_predictions, pred_path)
+    done = dict(checkpoint.done) if checkpoint else {}
+    checkpointed = set(done)
+    if done:
+        print(f"[INFO] Resuming from checkpoint: {len(done)}/{len(ground_truth)} items already scored")
+
+    preview_size = PREVIEW_SAMPLE_SIZE if preview_size is None else preview_size
+    html_stats = Counter()
+    if preview_size and len(ground_truth) >= 2 * preview_size:
+        started = time.perf_counter()
+        strata = stratified_sample(gt_store, ground_truth, preview_size, seed=job_id)
+        sample = {key for _, keys in strata for key in keys}
+        if streamed:
+            found = await asyncio.to_thread(
+                lambda: {key: pred_text for key, pred_text in iter_predictions(pred_path) if key in sample})
+        else:
+            found = predictions
+        index_of = {key: index for index, key in enumerate(ground_truth) if key in sample}
+        scores = {}
+        pending = {}
+        for key in sample:
+            index = index_of[key]
+            # 檢查點中已評分的項目不再重新計算
+            if index in done and done[index][0] == key:
+                scores[key] = done[index][1]
+            else:
+                pending[key] = found.get(key, "")
+        del found
+        for key, (score, status) in (await _score_subset_async(ground_truth, gt_store, pending, n_jobs,
+                                                                html_stats, job_id)).items():
+            scores[key] = score
+            done[index_of[key]] = (key, score, status)
+        preview = dict(preview_estimate(strata, scores), elapsed=round(time.perf_counter() - started, 2))
+        if job_id is not None:
+            _set_job_preview(job_id, preview)
+        print(f"[INFO] Preview TEDS {preview['teds']} (95% CI {preview['ci_low']}-{preview['ci_high']}) "
+              f"from {preview['sample_size']} sampled items in {preview['elapsed']:.1f}s")
+        yield dict(type="preview", **preview)
+
+    state = _EvaluationState(ground_truth, predictions, done)
+    state.html_stats = html_stats
+    del predictions
+
+    # 評分速度只計完整評估的部分（不含樣本與檢查點中的項目）
+    started = time.perf_counter()
+    last_progress = None
+
+    def progress(key):
+        elapsed = time.perf_counter() - started
+        # 沿用的項目（樣本與檢查點）最先記錄，在那之前還沒有新評分的項目
+        scored = max(state.current_item - len(state.skipped) - len(state.resumed), 0)
+        return {
+            "type": "progress",
+            "current": state.current_item,
+            "total": state.total_items,
+            "percentage": int(state.current_item / state.total_items * 100) if state.total_items else 100,
+            "current_key": key,
+            # 目前為止的平均（分母為已完成的筆數）
+            "teds_so_far": round(state.total_score / state.current_item, 4) if state.current_item else 0.0,
+            "valid_count": state.valid_count,
+            "items_per_second": round(scored / elapsed, 2) if elapsed > 0 else 0.0
+        }
+
+    async def scored_items():
+        # 樣本的分數也要寫入檢查點，只有檢查點中原有的項目不再寫入
+        for item in state.resumed:
+            yield item + (item[0] in checkpointed,)
+        if streamed:
+            # JSON Lines：一邊讀取一邊評分，缺失的項目最後補上
+            pending = state.stream_pending(iter_predictions(pred_path))
+            async for item in score_stream_async(gt_store, pending, n_jobs, state.html_stats, job_id):
+                yield item + (False,)
+            for item in state.skipped:
+                yield item + (False,)
+            return
+        for item in state.skipped:
+            yield item + (False,)
+        async for item in score_items_async(gt_store, state.pending, n_jobs, state.html_stats, job_id):
+            yield item + (False,)
+
+    key = None
+    async for index, key, score, status, resumed in scored_items():
+        if checkpoint is not None and not resumed:
+            checkpoint.add(index, key, score, status)
+        detail = state.record(index, key, score, status)
+        yield dict(type="item", index=index, **detail)
+        now = time.perf_counter()
+        if last_progress is None or now - last_progress >= progress_interval:
+            last_progress = now
+            yield progress(key)
+
+    if checkpoint is not None:
+        checkpoint.flush()
+    yield progress(key)
+    yield {"type": "complete", "result": state.result()}
+
+
+async def evaluate_batch_async(submissions, n_jobs=None, job_id=None, progress_interval=0.5):
+    """
+    一次評估多份提交（例如同一次訓練的多個 checkpoint），回傳 async iterator，依序產生：
+        {"type": "error", "name", "message"}  無法讀取的提交（不影響其他提交）
+        {"type": "progress", "current", "total", "percentage", "items_per_second", "completed"}
+            全批合計的進度，至少每 progress_interval 秒一次；completed 為已完成的提交數
+        {"type": "result", "name", "result": evaluate 的回傳值}  每份提交評分完成時
+    所有提交的待評分項目合併成同一個評分工作，依 Ground Truth 的順序排列（item-major），
+    同一筆 Ground Truth 的各份預測分在同一塊，共用 worker pool 與載入的表格樹。
+    submissions: [(name, pred_path), ...]
+    """
+    ground_truth = load_ground_truth()
+    gt_store = load_ground_truth_store()
+    states = {}
+    for name, pred_path in submissions:
         try:
-            gt_html = normalize_to_html(gt_text)
-            pred_html = normalize_to_html(pred_text)
-            score = teds.evaluate(pred_html, gt_html)
-
-            if score < 0:
-                score = 0.0
-
-            details.append({
-                "id": key,
-                "score": round(score, 4),
-                "status": "valid"
-            })
-            
-            total_score += score
-            valid_count += 1
-        except Exception as e:
-            # 處理單筆資料評估錯誤
-            details.append({
-                "id": key,
-                "score": 0.0,
-                "status": f"error: {str(e)[:50]}"
-            })
+            predictions = await asyncio.to_thread(_load_predictions, pred_path)
+        except ValueError as e:
+            yield {"type": "error", "name": name, "message": str(e)}
+            continue
+        states[name] = _EvaluationState(ground_truth, predictions)
+        del predictions
 
-    # 使用 ground_truth 的總筆數作為分母，而不是有效筆數
-    # 這樣缺失或錯誤的資料會以 0 分計入平均
-    avg_score = total_score / total_items if total_items > 0 else 0.0
-    
+    pending = [((name, index), key, pred_text)
+               for name, state in states.items() for index, key, pred_text in state.pending]
+    # 穩定排序：同一筆 Ground Truth 的各份預測相鄰
+    pending.sort(key=lambda item: item[0][1])
+    remaining = {name: len(state.pending) for name, state in states.items()}
+    total = sum(state.total_items for state in states.values())
+    # 缺失或空白的項目不需評分，不計入評分速度
+    skipped = sum(len(state.skipped) for state in states.values())
+    current = 0
+    completed = 0
+    started = time.perf_counter()
+    last_progress = None
+
+    def progress():
+        elapsed = time.perf_counter() - started
+        return {
+            "type": "progress",
+            "current": current,
+            "total": total,
+            "percentage": int(current / total * 100) if total else 100,
+            "items_per_second": round((current - skipped) / elapsed, 2) if elapsed > 0 else 0.0,
+            "completed": completed
+        }
+
+    for name, state in states.items():
+        for index, key, score, status in state.skipped:
+            state.record(index, key, score, status)
+        current += len(state.skipped)
+        if not remaining[name]:
+            completed += 1
+            yield {"type": "result", "name": name, "result": state.result()}
+
+    async for (name, index), key, score, status in score_items_async(gt_store, pending, n_jobs, job_id=job_id,
+                                                                     group_by_key=True):
+        state = states[name]
+        state.record(index, key, score, status)
+        current += 1
+        remaining[name] -= 1
+        if not remaining[name]:
+            completed += 1
+            yield {"type": "result", "name": name, "result": state.result()}
+        now = time.perf_counter()
+        if last_progress is None or now - last_progress >= progress_interval:
+            last_progress = now
+            yield progress()
+
+    yield progress()
+
+
+async def score_patch_async(patch, n_jobs=None, job_id=None):
+    """
+    只評分 patch（{id: pred_text}，部分的預測）中的項目，用於修正已評分的提交而不重新評估整份。
+    回傳 {id: (未四捨五入的 score, status)}；patch 中有不在 Ground Truth 內的 id 時拋出 ValueError。
+    pred_text 為 None 或空白時視為刪除該筆預測（以 missing 計）。
+    """
+    ground_truth = load_ground_truth()
+    gt_store = load_ground_truth_store()
+    unknown = [key for key in patch if key not in ground_truth]
+    if unknown:
+        shown = "、".join(unknown[:10]) + ("…" if len(unknown) > 10 else "")
+        raise ValueError(f"修正檔中有 {len(unknown)} 個 id 不在 Ground Truth 中：{shown}")
+    return await _score_subset_async(ground_truth, gt_store, patch, n_jobs, job_id=job_id)
+
+
+def patch_result(result, rescored):
+    """
+    把 score_patch_async 重新評分的項目套用到 result（evaluate 的回傳值），重新計算平均分數與有效筆數。
+    平均分數由未四捨五入的分數（result["scores"]）重新計算，與完整評估同一份預測的結果相同；
+    沒有 scores 的舊結果改用 details 中（四捨五入到小數點後 4 位）的分數。
+    回傳 (新的 result, changes)；changes 為 [{"id", "old_score", "old_status", "score", "status"}]，
+    只包含分數或狀態有變化的項目。
+    """
+    details = []
+    scores = []
+    changes = []
+    old_scores = result.get("scores") or [detail["score"] for detail in result["details"]]
+    for detail, score in zip(result["details"], old_scores):
+        new = rescored.get(detail["id"])
+        if new is not None:
+            score, status = new
+            new_detail = {"id": detail["id"], "score": round(score, 4), "status": status}
+            if (new_detail["score"], status) != (detail["score"], detail["status"]):
+                changes.append({"id": detail["id"], "old_score": detail["score"], "old_status": detail["status"],
+                                "score": new_detail["score"], "status": status})
+            detail = new_detail
+        details.append(detail)
+        scores.append(score)
     return {
-        "TEDS": round(avg_score, 4),
+        "TEDS": average_score(details, scores),
         "details": details,
-        "valid_count": valid_count,
-        "total_count": total_items
+        "scores": scores,
+        "valid_count": sum(detail["status"] == "valid" for detail in details),
+        "total_count": len(details)
+    }, changes
+
+
+def patch_predictions_file(pred_path, patch):
+    """
+    把 patch（{id: pred_text}）寫入預測檔：取代同 id 的預測，新的 id 加在最後。
+    JSON Lines 逐行改寫（gzip 壓縮的檔案改寫為未壓縮），JSON 整份載入後改寫；
+    先寫入暫存檔再取代原檔，讀取中的評估不會讀到寫到一半的檔案。
+    """
+    tmp_path = f"{pred_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            if is_jsonl_predictions(pred_path):
+                remaining = dict(patch)
+                for key, pred_text in _iter_jsonl_predictions(pred_path):
+                    if key in patch:
+                        # 同一個 id 重複出現時只寫一次
+                        if key not in remaining:
+                            continue
+                        pred_text = remaining.pop(key)
+                    f.write(json.dumps({"id": key, "pred": pred_text}, ensure_ascii=False) + "\n")
+                for key, pred_text in remaining.items():
+                    f.write(json.dumps({"id": key, "pred": pred_text}, ensure_ascii=False) + "\n")
+            else:
+                predictions = _load_predictions(pred_path)
+                predictions.update(patch)
+                json.dump(predictions, f, ensure_ascii=False)
+        os.replace(tmp_path, pred_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_details(name, result, details_dir=DETAILS_DIR, summaries_dir=SUMMARIES_DIR):
+    """
+    儲存一份提交的詳細分數（details_dir/<name>.json），
+    並在寫入時彙整各分組的分數摘要（summaries_dir/<name>.json），
+    之後查詢分組分數不需重新掃描每筆資料。
+    """
+    os.makedirs(details_dir, exist_ok=True)
+    os.makedirs(summaries_dir, exist_ok=True)
+    with open(os.path.join(details_dir, f"{name}.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "name": name,
+            "teds": result["TEDS"],
+            "details": result["details"],
+            # 未四捨五入的分數（與 details 對齊），修正時用來重新計算平均分數
+            "scores": result.get("scores"),
+            "valid_count": result["valid_count"],
+            "total_count": result["total_count"]
+        }, f, ensure_ascii=False, indent=2)
+    summary = {
+        "name": name,
+        "teds": result["TEDS"],
+        "slices": summarize_slices(result["details"], load_ground_truth_store())
+    }
+    with open(os.path.join(summaries_dir, f"{name}.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary
+
+
+def load_summary(name, details_dir=DETAILS_DIR, summaries_dir=SUMMARIES_DIR):
+    """
+    讀取一份提交的分組分數摘要，找不到時回傳 None。
+    摘要不存在（較早的提交）時由詳細分數補建一次。
+    """
+    summary_path = os.path.join(summaries_dir, f"{name}.json")
+    if os.path.exists(summary_path):
+        with open(summary_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    detail_path = os.path.join(details_dir, f"{name}.json")
+    if not os.path.exists(detail_path):
+        return None
+    with open(detail_path, "r", encoding="utf-8") as f:
+        detail_data = json.load(f)
+    summary = {
+        "name": name,
+        "teds": detail_data["teds"],
+        "slices": summarize_slices(detail_data["details"], load_ground_truth_store())
     }
+    os.makedirs(summaries_dir, exist_ok=True)
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary
+
+
+def _print_profile(stage_walls, profile, top):
+    print("[PROFILE] Wall time per stage:")
+    for stage, seconds in stage_walls.items():
+        print(f"  {stage:<28} {seconds:9.3f}s")
+    scoring_total = sum(profile["stages"].values())
+    print("[PROFILE] Scoring time per stage (summed over workers):")
+    for stage in ("gt_load", "pred_parse", "teds"):
+        seconds = profile["stages"][stage]
+        share = seconds / scoring_total if scoring_total else 0.0
+        print(f"  {stage:<28} {seconds:9.3f}s  {share:6.1%}")
+    slowest = sorted(profile["items"].items(), key=lambda item: item[1], reverse=True)[:top]
+    if slowest:
+        print(f"[PROFILE] Slowest {len(slowest)} items:")
+        for key, seconds in slowest:
+            print(f"  {key:<28} {seconds:9.3f}s")
+
+
+def main(argv=None):
+    """
+    離線批次評分：python -m app.evaluation pred1.json [pred2.json ...]
+    與伺服器使用相同的評分流程，結果以伺服器的詳細分數格式寫入 --output-dir，
+    可直接搬進 data/details/ 並用 --leaderboard 併入排行榜，不需重新評分。
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m app.evaluation",
+                                     description="Score prediction files against the ground truth with TEDS.")
+    parser.add_argument("predictions", nargs="+",
+                        help='prediction files: JSON ({id: table}) or JSON Lines ({"id": ..., "pred": ...} per line), '
+                             'optionally gzip-compressed')
+    parser.add_argument("--gt", default="data/ground_truth.json", help="ground truth JSON file")
+    parser.add_argument("--store", default=None,
+                        help="pre-processed ground truth store (default: next to --gt, *.gtstore)")
+    parser.add_argument("-j", "--jobs", type=int, default=EVAL_JOBS, help="worker processes (1 = in-process)")
+    parser.add_argument("-o", "--output-dir", default=DETAILS_DIR,
+                        help="directory for <name>.json details in the server's format")
+    parser.add_argument("--summary-dir", default=SUMMARIES_DIR,
+                        help="directory for <name>.json per-slice score summaries")
+    parser.add_argument("--name", default=None, help="participant name (single prediction file only)")
+    parser.add_argument("--leaderboard", default=None, help="also merge the scores into this leaderboard file")
+    parser.add_argument("--shared-state", default="data/shared_state.db",
+                        help="the server's SHARED_STATE_PATH: --leaderboard holds its leaderboard lock while merging")
+    parser.add_argument("--cache-dir", default="data/eval_cache",
+                        help="cache of results keyed by ground truth store and normalized prediction content "
+                             "(shared with the server)")
+    parser.add_argument("--no-cache", action="store_true", help="always re-score")
+    parser.add_argument("--profile", action="store_true", help="print per-stage timings and the slowest items")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest items shown by --profile")
+    args = parser.parse_args(argv)
+    if args.name and len(args.predictions) > 1:
+        parser.error("--name can only be used with a single prediction file")
+    # 名稱取自檔名（去掉 .gz 與副檔名），不同的檔案得到相同名稱時會互相覆蓋詳細分數與排行榜記錄
+    names = [args.name or os.path.splitext(os.path.basename(pred_path).removesuffix(".gz"))[0]
+             for pred_path in args.predictions]
+    paths_by_name = {}
+    for name, pred_path in zip(names, args.predictions):
+        paths_by_name.setdefault(name, []).append(pred_path)
+    clashes = {name: paths for name, paths in paths_by_name.items() if len(paths) > 1}
+    if clashes:
+        parser.error("prediction files map to the same participant name, rename them: " + "; ".join(
+            f"{', '.join(paths)} -> {name!r}" for name, paths in clashes.items()))
+
+    stage_walls = {}
+    start = time.perf_counter()
+    load_ground_truth(args.gt)
+    stage_walls["load_ground_truth"] = time.perf_counter() - start
+    start = time.perf_counter()
+    gt_store = load_ground_truth_store(args.store or os.path.splitext(args.gt)[0] + ".gtstore")
+    stage_walls["load_ground_truth_store"] = time.perf_counter() - start
+
+    cache = None if args.no_cache else ResultCache(args.cache_dir)
+    profile = {"stages": Counter(), "items": {}}
+    entries = []
+    failed = 0
+    for name, pred_path in zip(names, args.predictions):
+        start = time.perf_counter()
+        try:
+            digest, item_hashes = None, None
+            record = None
+            if cache is not None:
+                digest, item_hashes = submission_digest(load_ground_truth(), iter_predictions(pred_path))
+                record = cache.get(gt_store.fingerprint, digest)
+            if record is not None:
+                result = record["result"]
+                print(f"[INFO] {name}: cached ({record['source']})")
+            else:
+                result = evaluate(pred_path, n_jobs=args.jobs, job_id=f"cli-{name}", profile=profile)
+                if digest is not None:
+                    cache.put(gt_store.fingerprint, digest, item_hashes, result, name)
+        except ValueError as e:
+            print(f"[ERROR] {name}: {e}")
+            failed += 1
+            continue
+        stage_walls[f"evaluate {name}"] = time.perf_counter() - start
+
+        save_details(name, result, args.output_dir, args.summary_dir)
+        entries.append({"name": name, "teds": result["TEDS"]})
+        print(f"[INFO] {name}: TEDS = {result['TEDS']} "
+              f"({result['valid_count']}/{result['total_count']} valid)")
+
+    if args.leaderboard and entries:
+        # 與伺服器相同的讀取-修改-寫入，持有同一個排行榜鎖，伺服器同時寫入的記錄不會遺失
+        from app.leaderboard import Leaderboard
+        from app.shared_state import open_shared_state
+        shared_state = open_shared_state("sqlite", args.shared_state)
+        leaderboard = Leaderboard(args.leaderboard, write_lock=lambda: shared_state.lock("leaderboard"))
+        leaderboard.ensure_exists()
+        merged = {entry["name"] for entry in entries}
+        leaderboard.update(lambda leaders: sorted(
+            [entry for entry in leaders if entry["name"] not in merged] + entries,
+            key=lambda x: x["teds"], reverse=True))
+        print(f"[INFO] Merged {len(entries)} entries into {args.leaderboard}")
+
+    if args.profile:
+        _print_profile(stage_walls, profile, args.top)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    # 以 app.evaluation 執行，讓 worker process 以同一個模組名稱載入評分函式
+    from app.evaluation import main as _main
+    sys.exit(_main())
@@ -0,0 +1,289 @@
+import os
+import mmap
+import json
+import struct
+import numpy as np
+from app.TEDS_metric import TableTree, cell_tokens, intern_cell_tokens, cell_token_generation
+
+# status of each ground truth entry
+GT_TABLE = 0      # tree available
+GT_EMPTY = 1      # empty ground truth text
+GT_NO_TABLE = 2   # parsed, but no body/table (TEDS score 0)
+GT_ERROR = 3      # pre-processing raised, message kept in the header
+
+# per-entry features kept in the store (see GroundTruthStore.features)
+FEATURES = ('n_nodes', 'n_rows', 'n_cols', 'n_spans', 'source_format', 'text_length')
+
+_MAGIC = b'OCRGTST2'
+_HEADER_LEN = struct.Struct('<Q')
+_ALIGN = 8
+
+
+class GroundTruthError(Exception):
+    """Error recorded while pre-processing a ground truth entry."""
+
+
+class GroundTruthStore(object):
+    ''' Read-only, memory-mapped view of the pre-processed ground truth trees.
+
+        The trees of every entry are flattened in preorder into plain arrays
+        (tag ids, spans, parent index, cell token ranges and token ids) and
+        written once to a single file. Every process opening the file maps the
+        same pages, so the ground truth memory is paid once per host and
+        attaching is only an mmap plus a key index.
+        Per-entry features (node count, rows, columns, spanned cells, source
+        format and text length) are stored alongside as a statistics index.
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"{path} is not a ground truth store")
+        header_len, = _HEADER_LEN.unpack_from(self._mmap, len(_MAGIC))
+        header_start = len(_MAGIC) + _HEADER_LEN.size
+        header = json.loads(self._mmap[header_start:header_start + header_len].decode('utf-8'))
+        self.fingerprint = header['fingerprint']
+        self._tags = header['tags']
+        self.format_names = header['formats']
+        self._errors = {int(index): message for index, message in header['errors'].items()}
+        for name, (dtype, offset, count) in header['arrays'].items():
+            setattr(self, '_' + name, np.frombuffer(self._mmap, dtype=dtype, count=count, offset=offset))
+        self.keys = self._decode_strings(self._key_bytes, self._key_offsets)
+        self._index = {key: index for index, key in enumerate(self.keys)}
+        self._vocab = None
+        self._codes = None
+        self._codes_generation = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    @staticmethod
+    def _decode_strings(blob, offsets):
+        blob = blob.tobytes()
+        offsets = offsets.tolist()
+        return [blob[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:])]
+
+    @property
+    def vocab(self):
+        """Cell token strings, indexed by token id."""
+        if self._vocab is None:
+            self._vocab = self._decode_strings(self._vocab_bytes, self._vocab_offsets)
+        return self._vocab
+
+    @property
+    def codes(self):
+        """Interned code of every store token id in this process (see intern_cell_tokens)."""
+        # re-interned after the vocabulary was cleared (see cell_token_scope)
+        if self._codes is None or self._codes_generation != cell_token_generation():
+            self._codes_generation = cell_token_generation()
+            self._codes = intern_cell_tokens(self.vocab)
+        return self._codes
+
+    @property
+    def features(self):
+        """{feature: array aligned with keys} for every name in FEATURES; source_format indexes format_names."""
+        return {name: getattr(self, '_' + name) for name in FEATURES}
+
+    def index_of(self, key, default=-1):
+        """Position of key in keys (and in the feature arrays)."""
+        return self._index.get(key, default)
+
+    def status(self, key):
+        return int(self._status[self._index[key]])
+
+    def n_nodes(self, key):
+        """Node count used by TEDS for this entry (0 when it has no table)."""
+        return int(self._n_nodes[self._index[key]])
+
+    def load_table(self, key):
+        ''' Same result as TEDS.load_table(normalize_to_tree(ground_truth[key])):
+            (tree, n_nodes), or None when the entry has no table.
+            Raises GroundTruthError with the original message if pre-processing failed.
+        '''
+        index = self._index[key]
+        status = self._status[index]
+        if status == GT_ERROR:
+            raise GroundTruthError(self._errors[index])
+        if status != GT_TABLE:
+            return None
+        start, end = self._node_offsets[index:index + 2].tolist()
+        tags = self._node_tag[start:end].tolist()
+        colspans = self._node_colspan[start:end].tolist()
+        rowspans = self._node_rowspan[start:end].tolist()
+        parents = self._node_parent[start:end].tolist()
+        token_offsets = self._token_offsets[start:end + 1].tolist()
+        codes = self.codes
+        nodes = []
+        for i, tag_id in enumerate(tags):
+            tag = self._tags[tag_id]
+            if tag == 'td':
+                tokens = self._tokens[token_offsets[i]:token_offsets[i + 1]].tolist()
+                node = TableTree(tag, colspans[i], rowspans[i], ''.join([codes[t] for t in tokens]))
+            else:
+                node = TableTree(tag, None, None, None)
+            if parents[i] >= 0:
+                nodes[parents[i]].children.append(node)
+            nodes.append(node)
+        return nodes[0], int(self._n_nodes[index])
+
+    @classmethod
+    def build(cls, ground_truth, path, load_table, fingerprint=None, source_format=None):
+        ''' Pre-processes every ground truth entry with load_table
+            (text -> (tree, n_nodes) or None) and writes the store to path.
+            source_format (text -> format name) labels the entries for the
+            statistics index.
+            The file is written next to path and renamed, so processes opening
+            path never see a partial store.
+        '''
+        keys = list(ground_truth.keys())
+        status = np.zeros(len(keys), dtype=np.int8)
+        n_nodes = np.zeros(len(keys), dtype=np.int32)
+        n_rows = np.zeros(len(keys), dtype=np.int32)
+        n_cols = np.zeros(len(keys), dtype=np.int32)
+        n_spans = np.zeros(len(keys), dtype=np.int32)
+        formats = np.zeros(len(keys), dtype=np.int8)
+        text_length = np.zeros(len(keys), dtype=np.int32)
+        format_names, format_ids = [], {}
+        node_offsets = [0]
+        node_tag, node_colspan, node_rowspan, node_parent = [], [], [], []
+        token_offsets = [0]
+        tokens = []
+        tags, tag_ids = [], {}
+        vocab, vocab_ids = [], {}
+        errors = {}
+
+        for index, key in enumerate(keys):
+            gt_text = ground_truth[key]
+            if isinstance(gt_text, str):
+                text_length[index] = len(gt_text)
+            if not gt_text:
+                format_name = 'none'
+            elif source_format is None or not isinstance(gt_text, str):
+                format_name = 'other'
+            else:
+                format_name = source_format(gt_text)
+            format_id = format_ids.get(format_name)
+            if format_id is None:
+                format_id = format_ids[format_name] = len(format_names)
+                format_names.append(format_name)
+            formats[index] = format_id
+            if not gt_text:
+                status[index] = GT_EMPTY
+                node_offsets.append(len(node_tag))
+                continue
+            try:
+                table = load_table(gt_text)
+            except Exception as e:
+                status[index] = GT_ERROR
+                errors[str(index)] = str(e)
+                table = None
+            else:
+                if table is None:
+                    status[index] = GT_NO_TABLE
+            if table is not None:
+                tree, n_nodes[index] = table
+                start = len(node_tag)
+                row_widths = {}
+                # [rows left, width] of cells spanning down into later rows
+                carried = []
+                stack = [(tree, -1)]
+                while stack:
+                    node, parent = stack.pop()
+                    tag_id = tag_ids.get(node.tag)
+                    if tag_id is None:
+                        tag_id = tag_ids[node.tag] = len(tags)
+                        tags.append(node.tag)
+                    node_tag.append(tag_id)
+                    node_colspan.append(node.colspan or 0)
+                    node_rowspan.append(node.rowspan or 0)
+                    node_parent.append(parent)
+                    if node.tag == 'tr':
+                        n_rows[index] += 1
+                        row_widths[len(node_tag) - 1 - start] = sum(width for _, width in carried)
+                        carried = [[rows - 1, width] for rows, width in carried if rows > 1]
+                    elif node.tag == 'td':
+                        colspan, rowspan = node.colspan or 1, node.rowspan or 1
+                        row_widths[parent] = row_widths.get(parent, 0) + colspan
+                        if colspan > 1 or rowspan > 1:
+                            n_spans[index] += 1
+                        if rowspan > 1:
+                            carried.append([rowspan - 1, colspan])
+                    for token in cell_tokens(node.content or ''):
+                        token_id = vocab_ids.get(token)
+                        if token_id is None:
+                            token_id = vocab_ids[token] = len(vocab)
+                            vocab.append(token)
+                        tokens.append(token_id)
+                    token_offsets.append(len(tokens))
+                    position = len(node_tag) - 1 - start
+                    stack.extend((child, position) for child in reversed(node.children))
+                n_cols[index] = max(row_widths.values(), default=0)
+            node_offsets.append(len(node_tag))
+
+        key_bytes, key_offsets = _encode_strings(keys)
+        vocab_bytes, vocab_offsets = _encode_strings(vocab)
+        arrays = {
+            'status': status,
+            'n_nodes': n_nodes,
+            'n_rows': n_rows,
+            'n_cols': n_cols,
+            'n_spans': n_spans,
+            'source_format': formats,
+            'text_length': text_length,
+            'node_offsets': np.asarray(node_offsets, dtype=np.int64),
+            'node_tag': np.asarray(node_tag, dtype=np.int16),
+            'node_colspan': np.asarray(node_colspan, dtype=np.int32),
+            'node_rowspan': np.asarray(node_rowspan, dtype=np.int32),
+            'node_parent': np.asarray(node_parent, dtype=np.int32),
+            'token_offsets': np.asarray(token_offsets, dtype=np.int64),
+            'tokens': np.asarray(tokens, dtype=np.int32),
+            'key_bytes': key_bytes,
+            'key_offsets': key_offsets,
+            'vocab_bytes': vocab_bytes,
+            'vocab_offsets': vocab_offsets,
+        }
+        _write_store(path, {'fingerprint': fingerprint, 'tags': tags, 'formats': format_names,
+                                 'errors': errors}, arrays)
+        return cls(path)
+
+
+def _encode_strings(strings):
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _write_store(path, header, arrays):
+    # array offsets depend on the header length, so lay the arrays out after a
+    # first sizing pass of the header
+    layout = {name: [array.dtype.str, 0, len(array)] for name, array in arrays.items()}
+    header['arrays'] = layout
+    data_start = 0
+    while True:
+        header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        start = _aligned(len(_MAGIC) + _HEADER_LEN.size + len(header_bytes))
+        if start == data_start:
+            break
+        data_start = offset = start
+        for name, array in arrays.items():
+            layout[name][1] = offset
+            offset = _aligned(offset + array.nbytes)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_MAGIC)
+        f.write(_HEADER_LEN.pack(len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.write(b'\0' * (layout[name][1] - f.tell()))
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+
+def _aligned(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
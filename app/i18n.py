@@ -61,6 +61,18 @@ TRANSLATIONS = {
         "high_score": "高分 (≥0.8)",
         "medium_score": "中分 (0.5-0.8)",
         "low_score": "低分 (<0.5)",
+        "slice_breakdown": "🧩 分組分數",
+        "slice_group": "分組",
+        "slice_count": "筆數",
+        "slice_valid": "有效",
+        "slice_names": {
+            "format": "來源格式",
+            "spans": "合併儲存格",
+            "size": "表格大小（節點數）",
+            "rows": "列數",
+            "cols": "欄數",
+            "length": "文字長度",
+        },
         "serial_number": "序號",
         "table_id": "表格 ID",
         "teds_score_col": "TEDS 分數",
@@ -98,6 +110,10 @@ TRANSLATIONS = {
         "connection_error": "連接錯誤，請重試",
         "error_occurred": "發生錯誤：{error}",
         "not_found": "找不到「{name}」的詳細資料",
+        "queue_full": "評估佇列已滿，請稍後再試。",
+        "participant_busy": "您已有評估正在進行中，請等待完成後再上傳。",
+        "estimated_wait": "預估等待約 {seconds} 秒。",
+        "queue_position": "排隊中：前面還有 {position} 個評估",
         
         # CSV download
         "csv_filename": "{name}_詳細分數.csv",
@@ -160,6 +176,18 @@ TRANSLATIONS = {
         "high_score": "High Score (≥0.8)",
         "medium_score": "Medium Score (0.5-0.8)",
         "low_score": "Low Score (<0.5)",
+        "slice_breakdown": "🧩 Scores by Slice",
+        "slice_group": "Group",
+        "slice_count": "Items",
+        "slice_valid": "Valid",
+        "slice_names": {
+            "format": "Source format",
+            "spans": "Spanned cells",
+            "size": "Table size (nodes)",
+            "rows": "Rows",
+            "cols": "Columns",
+            "length": "Text length",
+        },
         "serial_number": "No.",
         "table_id": "Table ID",
         "teds_score_col": "TEDS Score",
@@ -197,6 +225,10 @@ TRANSLATIONS = {
         "connection_error": "Connection error, please retry",
         "error_occurred": "Error occurred: {error}",
         "not_found": "Cannot find detailed data for '{name}'",
+        "queue_full": "The evaluation queue is full, please try again later.",
+        "participant_busy": "You already have an evaluation in progress, please wait for it to finish.",
+        "estimated_wait": "Estimated wait: about {seconds} seconds.",
+        "queue_position": "Queued: {position} evaluation(s) ahead",
         
         # CSV download
         "csv_filename": "{name}_detailed_scores.csv",
@@ -0,0 +1,169 @@
+import os
+import json
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+from email.utils import formatdate
+
+
+def leaderboard_version(entries):
+    """Short content hash of the leaderboard, identifies the state a diff applies to."""
+    encoded = json.dumps(entries, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()[:12]
+
+
+def leaderboard_diff(old, new):
+    ''' Compact edit script turning the ranking old into new, applied in order:
+            {"op": "delete", "name"}
+            {"op": "insert", "rank", "name", "teds"}
+            {"op": "move", "rank", "name", "teds"}    (moved to rank, 1-based)
+            {"op": "update", "name", "teds"}          (same rank, new score)
+        Moves are only emitted for entries that are out of place after the
+        inserts and deletes, so a new submission is a single insert.
+    '''
+    new_names = {entry["name"] for entry in new}
+    old_teds = {entry["name"]: entry["teds"] for entry in old}
+    ops = [{"op": "delete", "name": entry["name"]} for entry in old if entry["name"] not in new_names]
+    current = [entry["name"] for entry in old if entry["name"] in new_names]
+    for rank, entry in enumerate(new):
+        name = entry["name"]
+        if name not in old_teds:
+            current.insert(rank, name)
+            ops.append({"op": "insert", "rank": rank + 1, "name": name, "teds": entry["teds"]})
+        elif current[rank] != name:
+            current.remove(name)
+            current.insert(rank, name)
+            ops.append({"op": "move", "rank": rank + 1, "name": name, "teds": entry["teds"]})
+        elif old_teds[name] != entry["teds"]:
+            ops.append({"op": "update", "name": name, "teds": entry["teds"]})
+    return ops
+
+
+class LeaderboardSnapshot(object):
+    def __init__(self, entries, signature, mtime):
+        self.entries = entries
+        self.signature = signature
+        self.version = leaderboard_version(entries)
+        self.last_modified = formatdate(mtime, usegmt=True)
+
+
+class CachedPage(object):
+    def __init__(self, snapshot, body):
+        self.snapshot = snapshot
+        self.body = body
+        self.etag = '"%s"' % hashlib.sha1(body).hexdigest()[:20]
+
+    @property
+    def last_modified(self):
+        return self.snapshot.last_modified
+
+
+class Leaderboard(object):
+    ''' leaderboard.json behind a parsed-data cache and a rendered-page cache.
+
+        The file is re-read only when its (mtime, size) changes, so any writer
+        (update() here, an admin delete, another process) invalidates both
+        caches. Pages rendered from the leaderboard are kept per key (page,
+        language, ...) until the leaderboard changes, each with an ETag of its
+        bytes. Cached entries are shared: callers must not mutate them.
+
+        on_change(old, new) is called after every update() that changed the
+        entries, and by poll() for changes written by other processes; old is
+        always the new of the previous call. write_lock() returns the context
+        manager serializing writers across processes.
+    '''
+    def __init__(self, path, max_pages=64, on_change=None, write_lock=None):
+        self.path = path
+        self.max_pages = max_pages
+        self.on_change = on_change
+        self.write_lock = write_lock
+        self._published = None
+        self._snapshot = None
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ensure_exists(self):
+        if not os.path.exists(self.path):
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump([], f, ensure_ascii=False, indent=2)
+
+    def snapshot(self):
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if self._snapshot is None or self._snapshot.signature != signature:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    entries = json.load(f)
+                self._snapshot = LeaderboardSnapshot(entries, signature, stat.st_mtime)
+                self._pages.clear()
+            return self._snapshot
+
+    def load(self):
+        return self.snapshot().entries
+
+    def update(self, mutate):
+        ''' Read-modify-write of the leaderboard file, replaced as a whole under the write lock.
+            @params mutate: called with the current entries, returns the new ones
+            @output: the new entries
+        '''
+        with self.write_lock() if self.write_lock else nullcontext(), self._lock:
+            with open(self.path, "r", encoding="utf-8") as f:
+                old = json.load(f)
+            entries = mutate(list(old))
+            self._write(entries)
+            # also covers writes that land within the file system's mtime granularity
+            self._snapshot = None
+            self._pages.clear()
+            if self._published is None:
+                self._published = old
+        self._notify(entries)
+        return entries
+
+    def _write(self, entries):
+        """Replaces the file atomically, so readers without the write lock never see a partial file."""
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def poll(self):
+        """Reports to on_change the changes other processes wrote since the last report."""
+        entries = self.snapshot().entries
+        with self._lock:
+            if self._published is None:
+                self._published = entries
+        self._notify(entries)
+
+    def _notify(self, entries):
+        with self._lock:
+            old, self._published = self._published, entries
+        if self.on_change is not None and old != entries:
+            self.on_change(old, entries)
+
+    def page(self, key, render):
+        ''' The page key for the current leaderboard, rendered by render(entries) on a miss.
+            @output: CachedPage (body bytes, etag, last_modified)
+        '''
+        snapshot = self.snapshot()
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None and page.snapshot is snapshot:
+                self._pages.move_to_end(key)
+                return page
+        page = CachedPage(snapshot, render(snapshot.entries).encode("utf-8"))
+        with self._lock:
+            # a page rendered from a snapshot that was replaced meanwhile is served but not kept
+            if self._snapshot is snapshot:
+                self._pages[key] = page
+                while len(self._pages) > self.max_pages:
+                    self._pages.popitem(last=False)
+        return page
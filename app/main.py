@@ -1,42 +1,149 @@
 from fastapi import FastAPI, UploadFile, File, Form, Request, WebSocket, WebSocketDisconnect, Cookie, Response
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-import os, json, shutil, asyncio, secrets
-from app.evaluation import evaluate, load_ground_truth
+from starlette.requests import HTTPConnection
+import os, json, asyncio, secrets, hashlib
+from app.evaluation import (evaluate_async, evaluate_batch_async, load_ground_truth, load_ground_truth_store,
+                            get_job_status, list_job_statuses, iter_predictions, estimate_prediction_cost,
+                            reference_submission_cost, save_details, load_summary, score_patch_async,
+                            patch_result, patch_predictions_file)
+from app.admission import AdmissionController, AdmissionRejected
+from app.submissions import SubmissionRegistry, SubmissionRun
+from app.checkpoints import EvaluationCheckpoint, CheckpointLocked
+from app.leaderboard import Leaderboard, leaderboard_diff, leaderboard_version
+from app.pubsub import PubSubHub, OVERFLOW
+from app.shared_state import open_shared_state
+from app.uploads import store_upload, split_batch_upload, UploadTooLarge, UploadCorrupted, RequestSizeLimit
+from app.result_cache import ResultCache, submission_digest
+from app.entry_history import EntryHistory
 from app.i18n import get_all_translations
-from concurrent.futures import ThreadPoolExecutor
 
 app = FastAPI(title="OCR Evaluation Platform with Leaderboard")
 
 # 管理員密碼（建議使用環境變數）
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
-# 存儲活躍的管理員 session tokens
-admin_sessions = set()
+# 管理員 session 的有效秒數
+ADMIN_SESSION_TTL = 3600
+
+# 多個 worker process（uvicorn --workers N）共用的狀態：管理員 session、評估工作與排行榜寫入鎖。
+# sqlite：同一台主機的所有 process 共用 SHARED_STATE_PATH；memory：只有單一 process 時使用
+SHARED_STATE_BACKEND = os.getenv("SHARED_STATE_BACKEND", "sqlite")
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "data/shared_state.db")
+shared_state = open_shared_state(SHARED_STATE_BACKEND, SHARED_STATE_PATH)
 
 # 掛載靜態文件
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
 templates = Jinja2Templates(directory="app/templates")
 UPLOAD_DIR = "data/uploads"
+# 上傳檔（gzip 上傳以解壓縮後計）的大小上限
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+# 批次上傳（/api/batch）每個檔案的大小上限；其中每份提交仍以 MAX_UPLOAD_BYTES 為上限
+MAX_BATCH_UPLOAD_BYTES = int(os.getenv("MAX_BATCH_UPLOAD_BYTES", str(2 * 1024 * 1024 * 1024)))
+# 一次批次上傳請求（所有檔案合計）的大小上限
+MAX_BATCH_REQUEST_BYTES = int(os.getenv("MAX_BATCH_REQUEST_BYTES", str(MAX_BATCH_UPLOAD_BYTES)))
+# 其他請求（表單、JSON）的大小上限
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(1024 * 1024)))
+# 單檔上傳的請求除了檔案以外的表單欄位與 multipart 標頭（gzip 壓縮後可能比原始內容稍大）
+UPLOAD_REQUEST_SLACK = 1024 * 1024
 LEADERBOARD_PATH = "data/leaderboard.json"
+
+
+def request_body_limit(scope) -> int:
+    """
+    請求內容的大小上限，在 multipart 解析（暫存到磁碟）之前由 RequestSizeLimit 檢查：
+    上傳檔案的端點依檔案上限，其他請求為 MAX_REQUEST_BYTES
+    """
+    path = scope["path"]
+    if path == "/api/batch":
+        return MAX_BATCH_REQUEST_BYTES
+    if path in ("/upload", "/evaluate") or (path.startswith("/api/entries/") and path.endswith("/patch")):
+        return MAX_UPLOAD_BYTES + UPLOAD_REQUEST_SLACK
+    return MAX_REQUEST_BYTES
+
+
+app.add_middleware(RequestSizeLimit, limit_for=request_body_limit)
 DETAILS_DIR = "data/details"  # 儲存每個參賽者的詳細分數
+SUMMARIES_DIR = "data/summaries"  # 每個參賽者的分組分數摘要
+CHECKPOINT_DIR = "data/checkpoints"  # 進行中評估的檢查點，重新啟動後據此繼續
+RESULT_CACHE_DIR = "data/eval_cache"  # 依提交內容（正規化後）與 Ground Truth 版本保存的評分結果
+HISTORY_DIR = "data/history"  # 每個參賽者的版本紀錄（提交與之後的每次修正）
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(DETAILS_DIR, exist_ok=True)
 
-# 用於異步執行評估任務的執行器
-executor = ThreadPoolExecutor(max_workers=4)
+# 內容相同的提交直接沿用先前的評分結果（與 python -m app.evaluation 的 --cache-dir 共用）
+result_cache = ResultCache(RESULT_CACHE_DIR)
+
+# 排行榜記錄的版本紀錄與修正用的 patch_token（上傳時發給參賽者）
+entry_history = EntryHistory(HISTORY_DIR)
+
+# 排行榜變更時，把名次差異推送給所有開著排行榜頁面的觀看者
+leaderboard_hub = PubSubHub()
+# 每則訊息之間超過這個秒數時送出 keep-alive，也藉此發現已斷線的觀看者
+LEADERBOARD_PING_INTERVAL = 15
+# 檢查其他 worker process 寫入的排行榜變更的間隔秒數
+LEADERBOARD_WATCH_INTERVAL = 1.0
+
+
+# 處理請求的 event loop（啟動時設定）；leaderboard_hub 只能在這個 loop 的 thread 上使用
+event_loop = None
+
+
+def publish_leaderboard_diff(old, new):
+    """
+    排行榜可能在 thread 中寫入（檔案 I/O 與跨 process 的鎖不佔用 event loop），
+    推送一律排入 event loop 執行，也保持各次變更的先後順序。
+    """
+    message = {
+        "type": "diff",
+        "base": leaderboard_version(old),
+        "version": leaderboard_version(new),
+        "ops": leaderboard_diff(old, new)
+    }
+    if event_loop is None:
+        leaderboard_hub.publish("leaderboard", message)
+    else:
+        event_loop.call_soon_threadsafe(leaderboard_hub.publish, "leaderboard", message)
+
+
+# 排行榜資料與依排行榜渲染的頁面（每種語言一份）都快取在記憶體中，排行榜變更時才重新讀取、渲染
+# 寫入時持有跨 process 的鎖，update 一律以 asyncio.to_thread 呼叫，等待鎖時不阻塞 event loop
+leaderboard_store = Leaderboard(LEADERBOARD_PATH, on_change=publish_leaderboard_diff,
+                                write_lock=lambda: shared_state.lock("leaderboard"))
+
+# 進行中與最近完成的評估（以 WebSocket 的 session_id 識別），可重新連線接續；
+# 由其他 worker process 執行的評估透過 shared_state 轉送
+submission_runs = SubmissionRegistry(state=shared_state, job_status=get_job_status)
 
-# 儲存評估任務的結果
-evaluation_results = {}
+# 流量控制：排隊中的評分成本上限（以「完整提交」的份數計）與每位參賽者同時進行的評估數，
+# 受理的提交記錄在 shared_state 中，所有 worker process 共用同一個上限
+EVAL_QUEUE_BUDGET = float(os.getenv("EVAL_QUEUE_BUDGET", "8"))
+EVAL_MAX_PER_PARTICIPANT = int(os.getenv("EVAL_MAX_PER_PARTICIPANT", "1"))
+admission = AdmissionController(budget=0, max_per_participant=EVAL_MAX_PER_PARTICIPANT, state=shared_state)
 
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
+    global event_loop
+    event_loop = asyncio.get_running_loop()
     load_ground_truth()
-    if not os.path.exists(LEADERBOARD_PATH):
-        with open(LEADERBOARD_PATH, "w", encoding="utf-8") as f:
-            json.dump([], f, ensure_ascii=False, indent=2)
+    gt_store = load_ground_truth_store()
+    admission.budget = EVAL_QUEUE_BUDGET * max(reference_submission_cost(gt_store), 1)
+    leaderboard_store.ensure_exists()
+    leaderboard_store.poll()
+    asyncio.get_running_loop().create_task(watch_leaderboard())
+    await resume_checkpointed_runs()
+
+
+async def watch_leaderboard():
+    """其他 worker process 寫入的排行榜變更也推送給這個 process 的觀看者"""
+    while True:
+        await asyncio.sleep(LEADERBOARD_WATCH_INTERVAL)
+        try:
+            leaderboard_store.poll()
+        except Exception as e:
+            print(f"[ERROR] Leaderboard watch: {e}")
 
 
 def get_language(request: Request) -> str:
@@ -44,28 +151,117 @@ def get_language(request: Request) -> str:
     return request.cookies.get("lang", "en")
 
 
+async def is_admin(admin_token) -> bool:
+    return bool(admin_token) and await asyncio.to_thread(shared_state.has_session, admin_token)
+
+
+def entry_lock(name: str):
+    """修正與刪除同一筆排行榜記錄時持有的鎖（所有 worker process 共用）"""
+    return shared_state.lock("entry-" + hashlib.sha256(name.encode("utf-8")).hexdigest()[:16])
+
+
+def get_participant(request: HTTPConnection) -> str:
+    """以來源 IP 識別參賽者（用於每位參賽者的同時評估數限制）"""
+    return request.client.host if request.client else "unknown"
+
+
+def read_submission(file_path: str) -> tuple:
+    """
+    讀過一次預測檔（JSON Lines 逐行讀取），回傳評分成本估計與正規化後的內容雜湊：(cost, digest, item_hashes)。
+    無法解析的檔案回傳 (0, None, None)，格式錯誤留給評估階段回報。
+    """
+    gt_store = load_ground_truth_store()
+    cost = 0
+
+    def counted(predictions):
+        nonlocal cost
+        for key, pred_text in predictions:
+            cost += estimate_prediction_cost(gt_store, key, pred_text)
+            yield key, pred_text
+
+    try:
+        digest, item_hashes = submission_digest(load_ground_truth(), counted(iter_predictions(file_path)))
+    except ValueError:
+        return 0, None, None
+    return cost, digest, item_hashes
+
+
+def cached_result(digest: str):
+    """與目前 Ground Truth 版本下已評分過、內容相同的提交的快取紀錄，沒有時回傳 None"""
+    if digest is None:
+        return None
+    return result_cache.get(load_ground_truth_store().fingerprint, digest)
+
+
+def submission_cost(file_path: str) -> float:
+    """預測檔的評分成本估計；內容相同的提交已評分過時不需評分，以 0 成本計"""
+    cost, digest, _ = read_submission(file_path)
+    if cached_result(digest) is not None:
+        return 0.0
+    return cost
+
+
+async def admit_submission(request: Request, name: str, file_path: str) -> dict:
+    """依預測檔的評分成本估計決定是否受理，超過上限時拋出 AdmissionRejected"""
+    cost = await asyncio.to_thread(submission_cost, file_path)
+    return await asyncio.to_thread(admission.admit, name, get_participant(request), cost)
+
+
+def admission_rejected_response(e: AdmissionRejected) -> JSONResponse:
+    headers = {"Retry-After": str(int(e.estimated_wait) + 1)} if e.estimated_wait is not None else None
+    return JSONResponse(status_code=429, headers=headers, content={
+        "success": False,
+        "error": str(e),
+        "reason": e.reason,
+        "estimated_wait": e.estimated_wait,
+        "queue_position": e.queue_position
+    })
+
+
+def leaderboard_page(request: Request, template: str, cache_control: str = "no-cache") -> Response:
+    """
+    只依排行榜與語言決定內容的頁面：由快取回應，排行榜變更後才重新渲染。
+    回應附 ETag / Last-Modified，瀏覽器帶著相同的驗證值重新整理時回傳 304。
+    """
+    lang = get_language(request)
+    page = leaderboard_store.page((template, lang), lambda leaders: templates.get_template(template).render(
+        error=None,
+        leaders=leaders,
+        leaderboard_version=leaderboard_version(leaders),
+        lang=lang,
+        t=get_all_translations(lang)
+    ))
+    headers = {
+        "ETag": page.etag,
+        "Last-Modified": page.last_modified,
+        "Cache-Control": cache_control,
+        # 語言由 cookie 決定
+        "Vary": "Cookie"
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        not_modified = page.etag in etags or "*" in etags
+    else:
+        not_modified = request.headers.get("if-modified-since") == page.last_modified
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(page.body, headers=headers)
+
+
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     """首頁：上傳介面 + 排行榜"""
-    lang = get_language(request)
-    # 讀取排行榜數據
-    with open(LEADERBOARD_PATH, "r", encoding="utf-8") as f:
-        leaders = json.load(f)
-    return templates.TemplateResponse("index.html", {
-        "request": request, 
-        "error": None,
-        "leaders": leaders,
-        "lang": lang,
-        "t": get_all_translations(lang)
-    })
+    return leaderboard_page(request, "index.html")
 
 
 @app.post("/upload")
 async def upload_file(
+    request: Request,
     name: str = Form(...),
     file: UploadFile = File(...)
 ):
-    """只上傳檔案，不進行評估"""
+    """只上傳檔案，不進行評估；評估佇列已滿時回傳 429 與預估等待時間"""
     filename = f"{name}.json"
     save_path = os.path.join(UPLOAD_DIR, filename)
 
@@ -73,12 +269,42 @@ async def upload_file(
     if os.path.exists(save_path):
         return {"success": False, "error": f"名稱「{name}」已存在排行榜，請換一個名稱。"}
 
-    # 儲存上傳的檔案
+    # 串流寫入暫存檔（限制大小、邊寫邊計算雜湊，gzip 即時解壓縮）
+    try:
+        stored = await store_upload(file, save_path, MAX_UPLOAD_BYTES)
+    except UploadTooLarge as e:
+        return JSONResponse(status_code=413, content={"success": False, "error": str(e)})
+    except UploadCorrupted as e:
+        return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
+    except Exception as e:
+        return {"success": False, "error": f"檔案上傳失敗：{str(e)}"}
+
+    # 估計評分成本並排入佇列
     try:
-        with open(save_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        return {"success": True, "file_path": save_path}
+        queued = await admit_submission(request, name, stored.tmp_path)
+    except AdmissionRejected as e:
+        stored.remove()
+        return admission_rejected_response(e)
+
+    # 以獨佔方式放到正式檔名；多個 process 同時上傳同名時只有一個成功
+    try:
+        if not stored.publish():
+            stored.remove()
+            await asyncio.to_thread(admission.release, name)
+            return {"success": False, "error": f"名稱「{name}」已存在排行榜，請換一個名稱。"}
+        return {
+            "success": True,
+            "file_path": save_path,
+            "size": stored.size,
+            "sha256": stored.sha256,
+            # 之後以 /api/entries/{name}/patch 修正部分預測時使用，只在這裡發出一次
+            "patch_token": entry_history.issue_token(name),
+            "queue_position": queued["queue_position"],
+            "estimated_wait": queued["estimated_wait"]
+        }
     except Exception as e:
+        stored.remove()
+        await asyncio.to_thread(admission.release, name)
         return {"success": False, "error": f"檔案上傳失敗：{str(e)}"}
 
 
@@ -97,8 +323,7 @@ async def evaluate_file(
     # 檢查名稱是否已存在
     if os.path.exists(save_path):
         # 讀取排行榜數據以顯示在錯誤頁面
-        with open(LEADERBOARD_PATH, "r", encoding="utf-8") as f:
-            leaders = json.load(f)
+        leaders = leaderboard_store.load()
         return templates.TemplateResponse("index.html", {
             "request": request,
             "error": t["name_exists"].format(name=name),
@@ -107,92 +332,154 @@ async def evaluate_file(
             "t": t
         })
 
-    # 儲存上傳的檔案
-    with open(save_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    # 計算評分（加入錯誤處理）
+    # 串流寫入暫存檔（限制大小、邊寫邊計算雜湊，gzip 即時解壓縮）
     try:
-        result = evaluate(save_path)
-        
-        # 儲存詳細分數
-        detail_path = os.path.join(DETAILS_DIR, f"{name}.json")
-        with open(detail_path, "w", encoding="utf-8") as f:
-            json.dump({
-                "name": name,
-                "teds": result["TEDS"],
-                "details": result["details"],
-                "valid_count": result["valid_count"],
-                "total_count": result["total_count"]
-            }, f, ensure_ascii=False, indent=2)
-    except ValueError as e:
-        # 格式錯誤：刪除已上傳的檔案，顯示錯誤訊息
-        if os.path.exists(save_path):
-            os.remove(save_path)
-        
-        # 讀取排行榜數據以顯示在錯誤頁面
-        with open(LEADERBOARD_PATH, "r", encoding="utf-8") as f:
-            leaders = json.load(f)
-        
+        stored = await store_upload(file, save_path, MAX_UPLOAD_BYTES)
+    except (UploadTooLarge, UploadCorrupted) as e:
+        leaders = leaderboard_store.load()
         return templates.TemplateResponse("index.html", {
             "request": request,
-            "error": f"❌ {str(e)}\n\n請檢查您的檔案格式後重新上傳。",
+            "error": f"❌ {str(e)}",
             "leaders": leaders,
+            "leaderboard_version": leaderboard_version(leaders),
             "lang": lang,
             "t": t
-        })
-    except Exception as e:
-        # 其他錯誤
-        if os.path.exists(save_path):
-            os.remove(save_path)
-        
-        with open(LEADERBOARD_PATH, "r", encoding="utf-8") as f:
-            leaders = json.load(f)
-        
+        }, status_code=413 if isinstance(e, UploadTooLarge) else 400)
+
+    # 估計評分成本並排入佇列
+    try:
+        await admit_submission(request, name, stored.tmp_path)
+    except AdmissionRejected as e:
+        stored.remove()
+        leaders = leaderboard_store.load()
         return templates.TemplateResponse("index.html", {
             "request": request,
-            "error": f"❌ 評估過程中發生錯誤：{str(e)}\n\n請聯絡管理員或檢查檔案格式。",
+            "error": f"❌ {str(e)}",
             "leaders": leaders,
             "lang": lang,
             "t": t
+        }, status_code=429)
+
+    # 以獨佔方式放到正式檔名
+    if not stored.publish():
+        stored.remove()
+        await asyncio.to_thread(admission.release, name)
+        return templates.TemplateResponse("index.html", {
+            "request": request,
+            "error": t["name_exists"].format(name=name),
+            "leaders": leaderboard_store.load(),
+            "leaderboard_version": leaderboard_store.snapshot().version,
+            "lang": lang,
+            "t": t
         })
 
-    # 更新排行榜（儲存所有指標）
-    with open(LEADERBOARD_PATH, "r+", encoding="utf-8") as f:
-        data = json.load(f)
-        data.append({
-            "name": name, 
-            "teds": result["TEDS"]
+    # 與 WebSocket 相同的評估流程（含檢查點）；請求中斷時評估仍會在背景完成
+    run = await submission_runs.start(f"evaluate-{name}", name, lambda run: run_submission(run, save_path))
+    final = None
+    async for message in run.stream():
+        final = message
+
+    leaders = leaderboard_store.load()
+    if final is None or final["type"] == "error":
+        return templates.TemplateResponse("index.html", {
+            "request": request,
+            "error": final["message"] if final else f"❌ 找不到評估工作「{run.run_id}」",
+            "leaders": leaders,
+            "leaderboard_version": leaderboard_version(leaders),
+            "lang": lang,
+            "t": t
         })
-        data = sorted(data, key=lambda x: x["teds"], reverse=True)
-        f.seek(0)
-        json.dump(data, f, ensure_ascii=False, indent=2)
-        f.truncate()
 
     # 重新渲染首頁，顯示更新後的排行榜並高亮新上傳的記錄
     return templates.TemplateResponse("index.html", {
         "request": request,
         "error": None,
-        "leaders": data,
+        "leaders": leaders,
+        "leaderboard_version": leaderboard_version(leaders),
         "highlight_name": name,  # 標記要高亮的名稱
-        "success_message": t["score_result"].format(name=name, score=result['TEDS']),
+        "success_message": t["score_result"].format(name=name, score=final["result"]["TEDS"]),
         "lang": lang,
         "t": t
     })
 
 
+@app.post("/api/batch")
+async def upload_batch(request: Request, files: list[UploadFile] = File(...)):
+    """
+    一次上傳多份提交（例如同一次訓練的多個 checkpoint），作為同一個工作評估：
+    zip 檔（每個 .json / .json.gz 一份提交，名稱為檔名）、多個檔案欄位（名稱為檔名），
+    或 JSONL（每行 {"name", "predictions"}）。
+    整批一起受理（合計成本）並合併評分；進度與結果以 WebSocket /ws/{run_id} 傳送 {"cursor": 0} 接收。
+    """
+    batch_id = secrets.token_hex(6)
+    members = []
+    try:
+        for i, file in enumerate(files):
+            stored = await store_upload(file, os.path.join(UPLOAD_DIR, f".batch-{batch_id}-{i}"),
+                                        MAX_BATCH_UPLOAD_BYTES)
+            members.extend(await asyncio.to_thread(split_batch_upload, stored, file.filename, UPLOAD_DIR,
+                                                   MAX_UPLOAD_BYTES))
+    except (UploadTooLarge, UploadCorrupted) as e:
+        for _, member in members:
+            member.remove()
+        return JSONResponse(status_code=413 if isinstance(e, UploadTooLarge) else 400,
+                            content={"success": False, "error": str(e)})
+
+    def reject(status_code, error, **extra):
+        for _, member in members:
+            member.remove()
+        return JSONResponse(status_code=status_code, content={"success": False, "error": error, **extra})
+
+    names = [name for name, _ in members]
+    if not names:
+        return reject(400, "批次中沒有任何提交（zip 內需有 .json 檔，JSONL 每行一份提交）。")
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        return reject(400, f"批次中的名稱重複：{'、'.join(duplicates)}", names=duplicates)
+    existing = [name for name, member in members if os.path.exists(member.dest_path)]
+    if existing:
+        return reject(409, f"名稱已存在排行榜：{'、'.join(existing)}，請換一個名稱。", names=existing)
+
+    # 整批以一張票受理，成本為各份提交的合計
+    ticket = f"batch-{batch_id}"
+    costs = await asyncio.gather(*(asyncio.to_thread(submission_cost, member.tmp_path) for _, member in members))
+    try:
+        queued = await asyncio.to_thread(admission.admit, ticket, get_participant(request), sum(costs))
+    except AdmissionRejected as e:
+        for _, member in members:
+            member.remove()
+        return admission_rejected_response(e)
+
+    # 以獨佔方式放到正式檔名；任一名稱被同時上傳的提交佔用時整批取消
+    published = []
+    for name, member in members:
+        if not member.publish():
+            for _, other in members:
+                other.remove()
+            for other in published:
+                os.remove(other.dest_path)
+            await asyncio.to_thread(admission.release, ticket)
+            return JSONResponse(status_code=409, content={
+                "success": False, "error": f"名稱「{name}」已存在排行榜，請換一個名稱。", "names": [name]})
+        published.append(member)
+
+    submissions = [(name, member.dest_path) for name, member in members]
+    run = await submission_runs.start(ticket, ticket, lambda run: run_batch(run, submissions))
+    return {
+        "success": True,
+        "batch_id": batch_id,
+        "run_id": run.run_id,
+        "submissions": [{"name": name, "size": member.size, "sha256": member.sha256,
+                         "patch_token": entry_history.issue_token(name)} for name, member in members],
+        "queue_position": queued["queue_position"],
+        "estimated_wait": queued["estimated_wait"]
+    }
+
+
 @app.get("/leaderboard", response_class=HTMLResponse)
 async def leaderboard(request: Request):
     """顯示排行榜"""
-    lang = get_language(request)
-    with open(LEADERBOARD_PATH, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return templates.TemplateResponse("leaderboard.html", {
-        "request": request,
-        "leaders": data,
-        "lang": lang,
-        "t": get_all_translations(lang)
-    })
+    return leaderboard_page(request, "leaderboard.html")
 
 
 @app.get("/details/{name}", response_class=HTMLResponse)
@@ -214,9 +501,12 @@ async def get_details(request: Request, name: str):
     with open(detail_path, "r", encoding="utf-8") as f:
         detail_data = json.load(f)
     
+    summary = load_summary(name, DETAILS_DIR, SUMMARIES_DIR)
+    
     return templates.TemplateResponse("details.html", {
         "request": request,
         "detail_data": detail_data,
+        "slices": summary["slices"] if summary else {},
         "lang": lang,
         "t": t
     })
@@ -236,6 +526,236 @@ async def api_get_details(name: str):
     return {"success": True, "data": detail_data}
 
 
+@app.get("/api/details/{name}/slices")
+async def api_get_slices(name: str):
+    """API: 某個參賽者各分組（表格大小、合併儲存格、來源格式等）的平均分數"""
+    summary = load_summary(name, DETAILS_DIR, SUMMARIES_DIR)
+    if summary is None:
+        return {"success": False, "error": f"找不到「{name}」的詳細資料"}
+    return {"success": True, "data": summary}
+
+
+def read_patch(file_path: str) -> dict:
+    """讀取修正檔（部分的預測 {id: 表格}，JSON 或 JSON Lines）；同一個 id 出現兩次時拋出 ValueError"""
+    patch = {}
+    for key, pred_text in iter_predictions(file_path):
+        if key in patch:
+            raise ValueError(f"修正檔中 id「{key}」重複出現。")
+        patch[key] = pred_text
+    return patch
+
+
+def apply_patch(name: str, patch: dict, rescored: dict, sha256: str):
+    """
+    在 entry_lock 內把重新評分的項目套用到 name 的記錄：改寫上傳檔、詳細分數與分組摘要，
+    記錄新版本並更新排行榜分數。記錄已被刪除時回傳 None，否則回傳 (版本紀錄, 名次)。
+    """
+    upload_path = os.path.join(UPLOAD_DIR, f"{name}.json")
+    detail_path = os.path.join(DETAILS_DIR, f"{name}.json")
+    with entry_lock(name):
+        if not any(entry["name"] == name for entry in leaderboard_store.load()) or not os.path.exists(detail_path):
+            return None
+        # 在鎖內重新讀取：同時進行的修正依序套用，不會互相覆蓋
+        with open(detail_path, "r", encoding="utf-8") as f:
+            detail_data = json.load(f)
+        result, changes = patch_result({
+            "TEDS": detail_data["teds"],
+            "details": detail_data["details"],
+            "scores": detail_data.get("scores"),
+            "valid_count": detail_data["valid_count"],
+            "total_count": detail_data["total_count"]
+        }, rescored)
+        if not entry_history.versions(name):
+            # 較早的提交沒有版本紀錄：以修正前的分數作為第 1 版
+            entry_history.start(name, {
+                "kind": "submission",
+                "teds": detail_data["teds"],
+                "valid_count": detail_data["valid_count"],
+                "total_count": detail_data["total_count"]
+            })
+
+        # 上傳檔也套用修正，之後的去重與重新評估都以修正後的內容為準
+        digest = None
+        if os.path.exists(upload_path):
+            patch_predictions_file(upload_path, patch)
+            _, digest, item_hashes = read_submission(upload_path)
+            if digest is not None:
+                result_cache.put(load_ground_truth_store().fingerprint, digest, item_hashes, result, name)
+        save_details(name, result, DETAILS_DIR, SUMMARIES_DIR)
+        version = entry_history.append(name, {
+            "kind": "patch",
+            "teds": result["TEDS"],
+            "previous_teds": detail_data["teds"],
+            "valid_count": result["valid_count"],
+            "total_count": result["total_count"],
+            "digest": digest,
+            "sha256": sha256,
+            "rescored": list(rescored),
+            "changes": changes
+        })
+
+        def set_score(entries):
+            entries = [dict(entry, teds=result["TEDS"]) if entry["name"] == name else entry for entry in entries]
+            return sorted(entries, key=lambda x: x["teds"], reverse=True)
+
+        leaderboard_data = leaderboard_store.update(set_score)
+    return version, next(rank for rank, entry in enumerate(leaderboard_data, 1) if entry["name"] == name)
+
+
+@app.post("/api/entries/{name}/patch")
+async def patch_entry(
+    request: Request,
+    name: str,
+    file: UploadFile = File(...),
+    token: str = Form(None),
+    admin_token: str = Cookie(None)
+):
+    """
+    API: 修正排行榜上的一筆記錄，只重新評分修正檔中的 id。
+    修正檔為部分的預測（{id: 表格}，JSON 或 JSON Lines，可 gzip 壓縮），表格為 null 或空字串時刪除該筆預測。
+    就地更新詳細分數、分組摘要、排行榜分數與上傳檔，並在版本紀錄（/api/entries/{name}/history）加上一版。
+    需要上傳時取得的 patch_token（token 欄位）或管理員權限；評分成本與一般提交一樣經過流量控制。
+    """
+    if not await is_admin(admin_token) and not entry_history.check_token(name, token):
+        return JSONResponse(status_code=403, content={
+            "success": False, "error": "未授權：需要上傳時取得的 patch_token 或管理員權限"})
+    if (not any(entry["name"] == name for entry in leaderboard_store.load())
+            or not os.path.exists(os.path.join(DETAILS_DIR, f"{name}.json"))):
+        return JSONResponse(status_code=404, content={"success": False, "error": f"找不到「{name}」的記錄"})
+
+    # 串流寫入暫存檔（限制大小、gzip 即時解壓縮）後整份讀入
+    try:
+        stored = await store_upload(file, os.path.join(UPLOAD_DIR, f".patch-{secrets.token_hex(6)}"),
+                                    MAX_UPLOAD_BYTES)
+    except (UploadTooLarge, UploadCorrupted) as e:
+        return JSONResponse(status_code=413 if isinstance(e, UploadTooLarge) else 400,
+                            content={"success": False, "error": str(e)})
+    try:
+        patch = await asyncio.to_thread(read_patch, stored.tmp_path)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
+    finally:
+        stored.remove()
+    if not patch:
+        return JSONResponse(status_code=400, content={"success": False, "error": "修正檔中沒有任何預測。"})
+
+    # 只有修正的項目需要評分，成本也只計這些項目
+    gt_store = load_ground_truth_store()
+    ticket = f"patch-{name}-{secrets.token_hex(4)}"
+    try:
+        cost = sum(estimate_prediction_cost(gt_store, key, pred_text) for key, pred_text in patch.items())
+        await asyncio.to_thread(admission.admit, ticket, get_participant(request), cost)
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+    completed = False
+    try:
+        await asyncio.to_thread(admission.start, ticket)
+        try:
+            rescored = await score_patch_async(patch, job_id=ticket)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
+        completed = True
+        applied = await asyncio.to_thread(apply_patch, name, patch, rescored, stored.sha256)
+    finally:
+        await asyncio.to_thread(admission.release, ticket, completed=completed)
+    if applied is None:
+        return JSONResponse(status_code=404, content={"success": False, "error": f"找不到「{name}」的記錄"})
+
+    version, rank = applied
+    print(f"[INFO] Patched '{name}': {len(rescored)} items rescored, "
+          f"TEDS {version['previous_teds']} -> {version['teds']} (version {version['version']})")
+    return {
+        "success": True,
+        "name": name,
+        "version": version["version"],
+        "TEDS": version["teds"],
+        "previous_TEDS": version["previous_teds"],
+        "valid_count": version["valid_count"],
+        "total_count": version["total_count"],
+        "rescored": len(rescored),
+        "changes": version["changes"],
+        "rank": rank
+    }
+
+
+@app.get("/api/entries/{name}/history")
+async def api_entry_history(name: str):
+    """API: 某個參賽者的版本紀錄（第 1 版為提交，之後每次修正一版），由舊到新"""
+    versions = await asyncio.to_thread(entry_history.versions, name)
+    if not versions and not os.path.exists(os.path.join(DETAILS_DIR, f"{name}.json")):
+        return {"success": False, "error": f"找不到「{name}」的詳細資料"}
+    return {"success": True, "name": name, "versions": versions}
+
+
+def leaderboard_event(message: dict) -> str:
+    # 事件 id 為套用後的排行榜版本，EventSource 重新連線時以 Last-Event-ID 帶回
+    return f"id: {message['version']}\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+
+
+def leaderboard_reset_event() -> str:
+    snapshot = leaderboard_store.snapshot()
+    return leaderboard_event({"type": "reset", "version": snapshot.version, "leaderboard": snapshot.entries})
+
+
+@app.get("/api/leaderboard/events")
+async def leaderboard_events(request: Request, version: str = None):
+    """
+    API（Server-Sent Events）：排行榜變更時推送名次差異
+    {"type": "diff", "base", "version", "ops": [insert / delete / move / update]}。
+    觀看者帶著頁面上的排行榜版本（version 參數或 Last-Event-ID）連線，
+    版本不同或落後太多時改送完整排行榜 {"type": "reset", "version", "leaderboard"}。
+    """
+    client_version = request.headers.get("last-event-id") or version
+
+    async def stream():
+        with leaderboard_hub.subscribe("leaderboard") as subscription:
+            # 先訂閱再比對版本：其間的變更會以 diff 送達，觀看者依 base 略過已套用的部分
+            if client_version != leaderboard_store.snapshot().version:
+                yield leaderboard_reset_event()
+            while not await request.is_disconnected():
+                message = await subscription.get(timeout=LEADERBOARD_PING_INTERVAL)
+                if message is None:
+                    yield ": ping\n\n"
+                elif message is OVERFLOW:
+                    yield leaderboard_reset_event()
+                else:
+                    yield leaderboard_event(message)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # 不讓反向代理緩衝事件
+        "X-Accel-Buffering": "no"
+    })
+
+
+@app.get("/api/queue")
+async def api_queue():
+    """API: 評估佇列的狀態（排隊數、排隊成本與上限、預估等待秒數）"""
+    return {"success": True, "queue": await asyncio.to_thread(admission.status)}
+
+
+@app.get("/api/jobs")
+async def api_list_jobs():
+    """API: 目前與最近完成的評估工作（排隊等待時間、進度、每秒評分筆數）"""
+    jobs = list_job_statuses()
+    # 其他 worker process 執行中的評估
+    local_ids = {job["job_id"] for job in jobs}
+    jobs += [job for job in await asyncio.to_thread(shared_state.run_statuses) if job["job_id"] not in local_ids]
+    return {"success": True, "jobs": jobs}
+
+
+@app.get("/api/jobs/{job_id}")
+async def api_get_job(job_id: str):
+    """API: 某個評估工作的狀態"""
+    status = get_job_status(job_id)
+    if status is None:
+        status = next((job for job in await asyncio.to_thread(shared_state.run_statuses)
+                       if job["job_id"] == job_id), None)
+    if status is None:
+        return {"success": False, "error": f"找不到工作「{job_id}」"}
+    return {"success": True, "job": status}
+
+
 @app.get("/admin/login", response_class=HTMLResponse)
 async def admin_login_page(request: Request):
     """管理員登入頁面"""
@@ -255,10 +775,10 @@ async def admin_login(request: Request, password: str = Form(...)):
     if password == ADMIN_PASSWORD:
         # 生成 session token
         token = secrets.token_urlsafe(32)
-        admin_sessions.add(token)
+        await asyncio.to_thread(shared_state.add_session, token, ADMIN_SESSION_TTL)
         
         response = RedirectResponse(url="/admin/dashboard", status_code=303)
-        response.set_cookie(key="admin_token", value=token, httponly=True, max_age=3600)
+        response.set_cookie(key="admin_token", value=token, httponly=True, max_age=ADMIN_SESSION_TTL)
         return response
     else:
         return templates.TemplateResponse("admin_login.html", {
@@ -273,27 +793,17 @@ async def admin_login(request: Request, password: str = Form(...)):
 async def admin_dashboard(request: Request, admin_token: str = Cookie(None)):
     """管理員控制面板"""
     # 驗證 session
-    if not admin_token or admin_token not in admin_sessions:
+    if not await is_admin(admin_token):
         return RedirectResponse(url="/admin/login")
     
-    lang = get_language(request)
-    # 讀取排行榜數據
-    with open(LEADERBOARD_PATH, "r", encoding="utf-8") as f:
-        leaders = json.load(f)
-    
-    return templates.TemplateResponse("admin_dashboard.html", {
-        "request": request,
-        "leaders": leaders,
-        "lang": lang,
-        "t": get_all_translations(lang)
-    })
+    return leaderboard_page(request, "admin_dashboard.html", cache_control="private, no-cache")
 
 
 @app.post("/admin/logout")
 async def admin_logout(admin_token: str = Cookie(None)):
     """管理員登出"""
-    if admin_token and admin_token in admin_sessions:
-        admin_sessions.remove(admin_token)
+    if admin_token:
+        await asyncio.to_thread(shared_state.remove_session, admin_token)
     
     response = RedirectResponse(url="/", status_code=303)
     response.delete_cookie(key="admin_token")
@@ -319,32 +829,38 @@ async def set_language(lang: str, request: Request):
 async def delete_entry(name: str, admin_token: str = Cookie(None)):
     """API: 刪除某個參賽者的所有資料（僅限管理員）"""
     # 驗證管理員權限
-    if not admin_token or admin_token not in admin_sessions:
+    if not await is_admin(admin_token):
         return {"success": False, "error": "未授權：需要管理員權限"}
     
+    def remove_entry():
+        # 與修正（/api/entries/{name}/patch）互斥，修正不會寫回已刪除的記錄
+        with entry_lock(name):
+            # 1. 從排行榜中移除
+            if not any(entry["name"] == name for entry in leaderboard_store.load()):
+                return None
+            leaderboard_data = leaderboard_store.update(
+                lambda entries: [entry for entry in entries if entry["name"] != name])
+
+            # 2. 刪除詳細資料檔案
+            detail_path = os.path.join(DETAILS_DIR, f"{name}.json")
+            if os.path.exists(detail_path):
+                os.remove(detail_path)
+
+            summary_path = os.path.join(SUMMARIES_DIR, f"{name}.json")
+            if os.path.exists(summary_path):
+                os.remove(summary_path)
+
+            # 3. 刪除上傳的檔案與版本紀錄
+            upload_path = os.path.join(UPLOAD_DIR, f"{name}.json")
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
+            entry_history.remove(name)
+            return leaderboard_data
+
     try:
-        # 1. 從排行榜中移除
-        with open(LEADERBOARD_PATH, "r+", encoding="utf-8") as f:
-            leaderboard_data = json.load(f)
-            original_length = len(leaderboard_data)
-            leaderboard_data = [entry for entry in leaderboard_data if entry["name"] != name]
-            
-            if len(leaderboard_data) == original_length:
-                return {"success": False, "error": f"找不到「{name}」的記錄"}
-            
-            f.seek(0)
-            json.dump(leaderboard_data, f, ensure_ascii=False, indent=2)
-            f.truncate()
-        
-        # 2. 刪除詳細資料檔案
-        detail_path = os.path.join(DETAILS_DIR, f"{name}.json")
-        if os.path.exists(detail_path):
-            os.remove(detail_path)
-        
-        # 3. 刪除上傳的檔案
-        upload_path = os.path.join(UPLOAD_DIR, f"{name}.json")
-        if os.path.exists(upload_path):
-            os.remove(upload_path)
+        leaderboard_data = await asyncio.to_thread(remove_entry)
+        if leaderboard_data is None:
+            return {"success": False, "error": f"找不到「{name}」的記錄"}
         
         return {
             "success": True,
@@ -356,9 +872,313 @@ async def delete_entry(name: str, admin_token: str = Cookie(None)):
         return {"success": False, "error": f"刪除時發生錯誤：{str(e)}"}
 
 
+# 每批推送的評分結果筆數上限（另外每次進度更新時也會推送已累積的結果）
+ITEM_BATCH_SIZE = 64
+
+
+def submission_version(result: dict, digest: str, cached: bool) -> dict:
+    """版本紀錄的第 1 版：評分完成的提交"""
+    return {
+        "kind": "submission",
+        "teds": result["TEDS"],
+        "valid_count": result["valid_count"],
+        "total_count": result["total_count"],
+        "digest": digest,
+        "cached": cached
+    }
+
+
+def save_entry(name: str, result: dict, digest: str, cached: bool):
+    """儲存一份提交的詳細分數與分組摘要，版本紀錄從這份提交（第 1 版）開始"""
+    save_details(name, result, DETAILS_DIR, SUMMARIES_DIR)
+    entry_history.start(name, submission_version(result, digest, cached))
+
+
+def remove_entries(submissions: list):
+    """刪除 submissions（[(name, file_path)]）的上傳檔、詳細分數、分組摘要與版本紀錄"""
+    for name, file_path in submissions:
+        for path in (file_path, os.path.join(DETAILS_DIR, f"{name}.json"),
+                     os.path.join(SUMMARIES_DIR, f"{name}.json")):
+            if os.path.exists(path):
+                os.remove(path)
+        entry_history.remove(name)
+
+
+async def run_submission(run: SubmissionRun, file_path: str, checkpoint: EvaluationCheckpoint = None):
+    """
+    評估一份已上傳的提交，寫入詳細分數與排行榜。
+    進度、每筆分數（分批）與結果都發佈到 run 的事件紀錄，由所有連線中的 WebSocket 轉送。
+    已評分的項目分批寫入 CHECKPOINT_DIR 的檢查點，伺服器重新啟動後由
+    resume_checkpointed_runs 以同一個 run_id 從檢查點繼續；評估結束（成功或失敗）後刪除檢查點。
+    """
+    name = run.name
+    completed = False
+    resumed = False
+    items = []
+
+    def flush_items():
+        if items:
+            run.publish({"type": "items", "items": items[:]})
+            items.clear()
+
+    try:
+        # 只評分已受理的提交（/upload、/evaluate 或從檢查點繼續），不能繞過流量控制
+        if not await asyncio.to_thread(admission.start, name):
+            run.publish({
+                "type": "error",
+                "message": "❌ 這份提交尚未受理或受理已逾期，請重新上傳。"
+            }, final=True)
+            return
+        _, digest, item_hashes = await asyncio.to_thread(read_submission, file_path)
+        cached = await asyncio.to_thread(cached_result, digest)
+        if cached is not None:
+            # 內容相同的提交已評分過：直接沿用結果，不需評分
+            result = cached["result"]
+            print(f"[INFO] '{name}' is identical to '{cached['source']}', reusing its scores")
+            details = result["details"]
+            for start in range(0, len(details), ITEM_BATCH_SIZE):
+                run.publish({"type": "items", "items": [
+                    dict(index=index, **detail)
+                    for index, detail in enumerate(details[start:start + ITEM_BATCH_SIZE], start)]})
+            run.publish({
+                "type": "progress",
+                "current": result["total_count"],
+                "total": result["total_count"],
+                "percentage": 100,
+                "current_key": details[-1]["id"] if details else None,
+                "items_per_second": 0.0
+            })
+        else:
+            # 執行評估：直接在 event loop 上消費評分結果，不佔用 thread
+            if checkpoint is None:
+                checkpoint = await asyncio.to_thread(
+                    EvaluationCheckpoint.open, CHECKPOINT_DIR, run.run_id, name, file_path,
+                    load_ground_truth_store().fingerprint)
+            resumed = bool(checkpoint.done)
+            result = None
+            async for event in evaluate_async(file_path, job_id=run.run_id, checkpoint=checkpoint):
+                if event["type"] == "item":
+                    items.append({key: event[key] for key in ("index", "id", "score", "status")})
+                    if len(items) >= ITEM_BATCH_SIZE:
+                        flush_items()
+                elif event["type"] == "progress":
+                    flush_items()
+                    run.publish({
+                        "type": "progress",
+                        "current": event["current"],
+                        "total": event["total"],
+                        "percentage": event["percentage"],
+                        "current_key": event["current_key"],
+                        "items_per_second": event["items_per_second"]
+                    })
+                elif event["type"] == "preview":
+                    # 分層樣本的預估分數，完整評估接著進行
+                    run.publish({key: event[key] for key in
+                                 ("type", "teds", "ci_low", "ci_high", "margin", "sample_size", "elapsed")})
+                elif event["type"] == "complete":
+                    flush_items()
+                    result = event["result"]
+            completed = True
+            if digest is not None:
+                await asyncio.to_thread(result_cache.put, load_ground_truth_store().fingerprint,
+                                        digest, item_hashes, result, name)
+
+        # 詳細分數是整份提交的檔案寫入，不佔用 event loop
+        await asyncio.to_thread(save_entry, name, result, digest, cached is not None)
+
+        # 更新排行榜（先移除同名的記錄：上次在寫入排行榜後、刪除檢查點前中斷時不會重複）
+        def add_entry(entries):
+            entries = [entry for entry in entries if entry["name"] != name]
+            entries.append({
+                "name": name,
+                "teds": result["TEDS"]
+            })
+            return sorted(entries, key=lambda x: x["teds"], reverse=True)
+
+        leaderboard_data = await asyncio.to_thread(leaderboard_store.update, add_entry)
+
+        # 發送完成訊息（每筆分數已經分批送出，排行榜的變更由 /api/leaderboard/events 推送，這裡只附摘要與名次）
+        run.publish({
+            "type": "complete",
+            "result": {
+                "TEDS": result["TEDS"],
+                "valid_count": result["valid_count"],
+                "total_count": result["total_count"]
+            },
+            "name": name,
+            "cached": cached is not None,
+            "rank": next(rank for rank, entry in enumerate(leaderboard_data, 1) if entry["name"] == name)
+        }, final=True)
+
+    except ValueError as e:
+        # 格式錯誤：刪除已上傳的檔案
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        run.publish({
+            "type": "error",
+            "message": f"❌ {str(e)}\n\n請檢查您的檔案格式後重新上傳。"
+        }, final=True)
+    except Exception as e:
+        # 其他錯誤
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        run.publish({
+            "type": "error",
+            "message": f"❌ 評估過程中發生錯誤：{str(e)}\n\n請聯絡管理員或檢查檔案格式。"
+        }, final=True)
+    finally:
+        # 被取消（伺服器關閉）時保留檢查點，下次啟動時繼續
+        if checkpoint is not None:
+            if run.finished:
+                # 等待寫入中的批次完成後才刪除，不佔用 event loop
+                await asyncio.to_thread(checkpoint.remove)
+            else:
+                await asyncio.to_thread(checkpoint.close)
+        # 從檢查點繼續的評估只算了部分項目，不用來估計評分速度
+        await asyncio.to_thread(admission.release, name, completed=completed and not resumed)
+
+
+async def run_batch(run: SubmissionRun, submissions: list):
+    """
+    評估一批已上傳的提交（/api/batch），寫入各自的詳細分數，最後一次更新排行榜。
+    發佈到 run 的事件：
+        progress  全批合計的進度（completed 為已完成的提交數）
+        result    每份提交評分完成時的摘要（內容相同的提交已評分過時立即送出，cached 為 true）
+        submission_error  無法評分的提交（刪除其上傳檔，不影響其他提交）
+        complete  全部完成，附每份提交的分數與名次
+    批次評估不寫檢查點：中途失敗或伺服器重新啟動時整批取消（刪除上傳檔），需要重新上傳。
+    """
+    ticket = run.name
+    completed = False
+    added = False
+    results = {}
+    cached_names = set()
+    errors = []
+    file_paths = dict(submissions)
+
+    async def record(name, result, digest, cached=False):
+        results[name] = result
+        await asyncio.to_thread(save_entry, name, result, digest, cached)
+        run.publish({
+            "type": "result",
+            "name": name,
+            "cached": cached,
+            "result": {
+                "TEDS": result["TEDS"],
+                "valid_count": result["valid_count"],
+                "total_count": result["total_count"]
+            }
+        })
+
+    try:
+        await asyncio.to_thread(admission.start, ticket)
+        fingerprint = load_ground_truth_store().fingerprint
+        digests = {}
+        pending = []
+        for name, file_path in submissions:
+            _, digest, item_hashes = await asyncio.to_thread(read_submission, file_path)
+            cached = await asyncio.to_thread(cached_result, digest)
+            if cached is not None:
+                cached_names.add(name)
+                await record(name, cached["result"], digest, cached=True)
+            else:
+                digests[name] = (digest, item_hashes)
+                pending.append((name, file_path))
+
+        async for event in evaluate_batch_async(pending, job_id=run.run_id):
+            if event["type"] == "progress":
+                run.publish({key: event[key] for key in
+                             ("type", "current", "total", "percentage", "items_per_second", "completed")})
+            elif event["type"] == "result":
+                name = event["name"]
+                digest, item_hashes = digests[name]
+                if digest is not None:
+                    await asyncio.to_thread(result_cache.put, fingerprint, digest, item_hashes,
+                                            event["result"], name)
+                await record(name, event["result"], digest)
+            elif event["type"] == "error":
+                errors.append({"name": event["name"], "message": event["message"]})
+                if os.path.exists(file_paths[event["name"]]):
+                    os.remove(file_paths[event["name"]])
+                run.publish({"type": "submission_error", "name": event["name"], "message": f"❌ {event['message']}"})
+        completed = True
+
+        # 整批一次更新排行榜（觀看者只收到一次名次差異）
+        def add_entries(entries):
+            entries = [entry for entry in entries if entry["name"] not in results]
+            entries.extend({"name": name, "teds": result["TEDS"]} for name, result in results.items())
+            return sorted(entries, key=lambda x: x["teds"], reverse=True)
+
+        leaderboard_data = await asyncio.to_thread(leaderboard_store.update, add_entries)
+        added = True
+        ranks = {entry["name"]: rank for rank, entry in enumerate(leaderboard_data, 1)}
+        run.publish({
+            "type": "complete",
+            "results": [{
+                "name": name,
+                "TEDS": results[name]["TEDS"],
+                "valid_count": results[name]["valid_count"],
+                "total_count": results[name]["total_count"],
+                "cached": name in cached_names,
+                "rank": ranks.get(name)
+            } for name, _ in submissions if name in results],
+            "errors": errors
+        }, final=True)
+
+    except Exception as e:
+        run.publish({
+            "type": "error",
+            "message": f"❌ 批次評估過程中發生錯誤：{str(e)}\n\n請聯絡管理員或檢查檔案格式。"
+        }, final=True)
+    finally:
+        # 失敗或被取消（伺服器關閉）而未寫入排行榜時刪除整批的資料，名稱可以重新使用
+        if not added:
+            await asyncio.to_thread(remove_entries, submissions)
+        await asyncio.to_thread(admission.release, ticket, completed=completed)
+
+
+async def resume_checkpointed_runs():
+    """
+    啟動時繼續上次未完成的評估：CHECKPOINT_DIR 中留下的檢查點各以原本的 run_id 重新開始，
+    已評分的項目直接沿用，重新連線的 WebSocket 可以繼續接收進度。
+    上傳檔已不存在的檢查點直接刪除。
+    有多個 worker process 時，每個檢查點由先取得其檔案鎖的 process 接手，
+    仍在執行中（擁有者還活著）的評估不會被重複接手。
+    """
+    fingerprint = load_ground_truth_store().fingerprint
+    for header in EvaluationCheckpoint.pending(CHECKPOINT_DIR):
+        run_id, name, file_path = header["run_id"], header["name"], header["file_path"]
+        if not os.path.exists(file_path):
+            try:
+                os.remove(os.path.join(CHECKPOINT_DIR, f"{run_id}.jsonl"))
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            checkpoint = EvaluationCheckpoint.open(CHECKPOINT_DIR, run_id, name, file_path, fingerprint,
+                                                   create=False)
+        except CheckpointLocked:
+            continue
+        except FileNotFoundError:
+            # 評估剛好結束並刪除了上傳檔
+            continue
+        if checkpoint is None:
+            continue
+        cost = submission_cost(file_path)
+        # 這些提交在重新啟動前已經受理過，不受佇列上限限制
+        await asyncio.to_thread(admission.admit, name, "resumed", cost, force=True)
+        await submission_runs.start(run_id, name, takeover=True, run_coroutine=(
+            lambda run, file_path=file_path, checkpoint=checkpoint: run_submission(run, file_path, checkpoint)))
+        print(f"[INFO] Resuming evaluation '{name}' (run {run_id}) from checkpoint")
+
+
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
-    """WebSocket 端點用於推送評估進度"""
+    """
+    WebSocket 端點用於推送評估進度與每筆分數。
+    第一則訊息為 {name, file_path} 開始評估，或 {cursor} 重新連線：
+    同一個 session_id 的評估已存在時，從 cursor（上次收到的 seq + 1）開始重送事件。
+    """
     await websocket.accept()
     
     try:
@@ -366,91 +1186,42 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
         data = await websocket.receive_json()
         name = data.get("name")
         file_path = data.get("file_path")
+        cursor = data.get("cursor", 0)
         
-        if not name or not file_path:
-            await websocket.send_json({
-                "type": "error",
-                "message": "缺少必要參數"
-            })
-            await websocket.close()
-            return
-        
-        # 進度回調函數
-        async def send_progress(current, total, key):
-            percentage = int((current / total) * 100)
-            await websocket.send_json({
-                "type": "progress",
-                "current": current,
-                "total": total,
-                "percentage": percentage,
-                "current_key": key
-            })
-        
-        # 在執行器中運行評估任務
-        loop = asyncio.get_event_loop()
-        
-        def eval_with_progress():
-            results = []
-            def sync_progress(current, total, key):
-                # 在同步函數中，我們需要將進度發送到異步上下文
-                asyncio.run_coroutine_threadsafe(
-                    send_progress(current, total, key),
-                    loop
-                )
-            
-            return evaluate(file_path, progress_callback=sync_progress)
-        
-        try:
-            # 執行評估
-            result = await loop.run_in_executor(executor, eval_with_progress)
-            
-            # 儲存詳細分數
-            detail_path = os.path.join(DETAILS_DIR, f"{name}.json")
-            with open(detail_path, "w", encoding="utf-8") as f:
-                json.dump({
-                    "name": name,
-                    "teds": result["TEDS"],
-                    "details": result["details"],
-                    "valid_count": result["valid_count"],
-                    "total_count": result["total_count"]
-                }, f, ensure_ascii=False, indent=2)
-            
-            # 更新排行榜
-            with open(LEADERBOARD_PATH, "r+", encoding="utf-8") as f:
-                leaderboard_data = json.load(f)
-                leaderboard_data.append({
-                    "name": name,
-                    "teds": result["TEDS"]
+        run = await submission_runs.get(session_id)
+        if run is None:
+            if not name or not file_path:
+                await websocket.send_json({
+                    "type": "error",
+                    "message": "缺少必要參數" if "cursor" not in data else f"找不到評估工作「{session_id}」"
                 })
-                leaderboard_data = sorted(leaderboard_data, key=lambda x: x["teds"], reverse=True)
-                f.seek(0)
-                json.dump(leaderboard_data, f, ensure_ascii=False, indent=2)
-                f.truncate()
-            
-            # 發送完成訊息
-            await websocket.send_json({
-                "type": "complete",
-                "result": result,
-                "name": name,
-                "leaderboard": leaderboard_data
-            })
-            
-        except ValueError as e:
-            # 格式錯誤：刪除已上傳的檔案
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            await websocket.send_json({
-                "type": "error",
-                "message": f"❌ {str(e)}\n\n請檢查您的檔案格式後重新上傳。"
-            })
-        except Exception as e:
-            # 其他錯誤
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            await websocket.send_json({
-                "type": "error",
-                "message": f"❌ 評估過程中發生錯誤：{str(e)}\n\n請聯絡管理員或檢查檔案格式。"
-            })
+                await websocket.close()
+                return
+            # 沒有經過 /upload 受理（或受理已逾期）的評估在這裡重新受理，佇列已滿時回報預估等待時間
+            if not await asyncio.to_thread(admission.start, name):
+                try:
+                    cost = await asyncio.to_thread(submission_cost, file_path)
+                except OSError:
+                    await websocket.send_json({"type": "error", "message": "❌ 找不到上傳的檔案，請重新上傳。"})
+                    await websocket.close()
+                    return
+                try:
+                    await asyncio.to_thread(admission.admit, name, get_participant(websocket), cost)
+                except AdmissionRejected as e:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": f"❌ {str(e)}",
+                        "reason": e.reason,
+                        "estimated_wait": e.estimated_wait,
+                        "queue_position": e.queue_position
+                    })
+                    await websocket.close()
+                    return
+            run = await submission_runs.start(session_id, name, lambda run: run_submission(run, file_path))
+        
+        # 評估在獨立的 task 中執行，斷線只會停止推送，重新連線時從 cursor 繼續
+        async for message in run.stream(cursor):
+            await websocket.send_json(message)
     
     except WebSocketDisconnect:
         print(f"WebSocket 連接斷開: {session_id}")
@@ -0,0 +1,955 @@
+# Copyright 2020 IBM
+# Author: peter.zhong@au1.ibm.com
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the Apache 2.0 License.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# Apache 2.0 License for more details.
+
+# KIE, document parsing, OCR and chart metrics. They are not used to score
+# tables, so they live apart from the TEDS code and their dependencies (zss,
+# numpy, editdistance, ...) are only imported by code that needs them.
+# app.TEDS_metric still exposes these names and loads this module on first use.
+
+import re
+import ast
+import json
+from itertools import product
+from difflib import SequenceMatcher
+from zss import simple_distance, Node
+import numpy as np
+import Levenshtein
+import editdistance
+from app.parallel import parallel_process
+from app.TEDS_metric import _tree_size
+
+
+def dict_to_html(data):
+    html = "<html><body><table>\n"
+    for key, value in data.items():
+        if not isinstance(value, str):
+            value = str(value)
+        value_str = ' '.join(value)
+        
+        html += f"  <tr><td>{key}</td><td>{value_str}</td></tr>\n"
+    html += "</table></body></html>"
+    return html
+
+
+def convert_str_to_dict(predict_str: str):
+    """
+    Parses the 'predict' string and returns a dictionary.
+    Missing or unparseable content is handled gracefully.
+
+    Parameters:
+    - predict_str (str): The prediction string containing the output dict.
+
+    Returns:
+    - dict: A dictionary extracted from the predict string.
+    """
+    # Remove code fences like ```python\n...\n```
+    code_fence_pattern = r'```(?:python|json)?\n(.*?)\n```'
+    match = re.search(code_fence_pattern, predict_str, re.DOTALL | re.IGNORECASE)
+    if match:
+        content = match.group(1)
+    else:
+        content = predict_str.strip()
+
+    data = {}
+    success = False
+
+    # try parsing with JSON
+    try:
+        data = json.loads(content)
+        success = True
+    except json.JSONDecodeError:
+        pass
+
+    # try parsing with ast.literal_eval
+    if not success:
+        try:
+            data = ast.literal_eval(content)
+            if isinstance(data, dict):
+                success = True
+        except (ValueError, SyntaxError):
+            pass
+
+    # try parsing with regex
+    if not success:
+        key_value_pattern = r'["\']?([\w\s]+)["\']?\s*[:=]\s*["\']?([^\n,"\'{}]+)["\']?'
+        matches = re.findall(key_value_pattern, content)
+        try:
+            for key, value in matches:
+                data[key.strip()] = value.strip()
+        except:
+            return {}
+
+    if not data:
+        return {}
+
+    try:
+        result = {k.strip(): str(v).strip() for k, v in data.items()}
+    except:
+        return {}
+    return result
+
+
+def convert_str_to_multi_dict(predict_str: str):
+    """
+    Parses the 'predict' string and returns a dictionary.
+    Handles nested dictionaries and missing or unparseable content gracefully.
+
+    Parameters:
+    - predict_str (str): The prediction string containing the output dict.
+
+    Returns:
+    - dict: A dictionary extracted from the predict string.
+    """
+    # Remove code fences like ```python\n...\n```
+    code_fence_pattern = r'```(?:python|json)?\n(.*?)\n```'
+    matches = re.findall(code_fence_pattern, predict_str, re.DOTALL | re.IGNORECASE)
+    if matches:
+        content = max(matches, key=len)
+    else:
+        content = predict_str.strip()
+    
+    def strip_variable_assignment(s):
+        variable_assignment_pattern = r'^\s*\w+\s*=\s*'
+        return re.sub(variable_assignment_pattern, '', s.strip(), count=1)
+
+    content = strip_variable_assignment(content)
+
+    def remove_comments(s):
+        return re.sub(r'#.*', '', s)
+
+    content = remove_comments(content)
+
+    last_brace_pos = content.rfind('}')
+    if last_brace_pos != -1:
+        content = content[:last_brace_pos+1]
+
+    data = {}
+    success = False
+
+    # try parsing with ast.literal_eval
+    try:
+        data = ast.literal_eval(content)
+        if isinstance(data, dict):
+            success = True
+    except (ValueError, SyntaxError, TypeError):
+        pass
+
+    if not success:
+        return {}
+
+    def process_data(obj):
+        if isinstance(obj, dict):
+            return {k: process_data(v) for k, v in obj.items()}
+        elif isinstance(obj, list):
+            return [process_data(elem) for elem in obj]
+        else:
+            return obj
+
+    data = process_data(data)
+
+    return data
+
+
+def generate_combinations(input_dict):
+    """
+    Function to generate all possible combinations of values from a dictionary.
+    """
+    kie_answer = input_dict
+    if not isinstance(kie_answer, dict):
+        kie_answer = kie_answer.strip('"')
+        try:
+            kie_answer = json.loads(kie_answer)
+        except json.JSONDecodeError:
+            try:
+                kie_answer = ast.literal_eval(kie_answer)
+                if not isinstance(kie_answer, dict):
+                    kie_answer = ast.literal_eval(kie_answer)
+            except (ValueError, SyntaxError):
+                print(f"Unable to parse 'answers' field: {kie_answer}")
+                return {}
+        
+        # Ensure the parsed result is a dictionary.
+        if not isinstance(kie_answer, dict):
+            print("Parsed 'answers' is still not a dictionary.")
+            raise ValueError("Input could not be parsed into a dictionary.")
+    
+        keys = list(kie_answer.keys())
+        
+        value_lists = []
+        for single_key in keys:
+            sinlge_value = kie_answer[single_key]
+            if not isinstance(sinlge_value, list):
+                sinlge_value = [sinlge_value]
+            value_lists.append(sinlge_value)
+    
+        # Compute the Cartesian product of the value lists.
+        combinations = list(product(*value_lists))
+    
+        # Create a dictionary for each combination of values.
+        result = [dict(zip(keys, values)) for values in combinations]
+
+        return result
+    
+    else:
+        keys = list(input_dict.keys())
+        value_lists = [input_dict[key] for key in keys]
+
+        # Compute the Cartesian product of the value lists.
+        combinations = list(product(*value_lists))
+
+        # Create a dictionary for each combination of values.
+        result = [dict(zip(keys, values)) for values in combinations]
+
+        return result
+
+
+def compute_f1_score(preds, gts, ignores=[]):
+    """Compute the F1-score for KIE task between predicted and ground truth dictionaries.
+
+    Args:
+        preds (dict): The predicted key-value pairs.
+        gts (dict): The ground truth key-value pairs.
+        ignores (list): The list of keys to ignore during evaluation.
+
+    Returns:
+        dict: A dictionary where keys are field names and values are their corresponding F1-scores.
+    """
+    # Optionally remove ignored keys from predictions and ground truths
+    keys = set(preds.keys()).union(set(gts.keys())) - set(ignores)
+    f1_scores = {}
+
+    for key in keys:
+        pred_value = preds.get(key, None)
+        gt_value = gts.get(key, None)
+
+        if pred_value:
+            pred_value = pred_value.lower().strip().replace("\n"," ").replace(" ", "")
+        if gt_value:
+            gt_value = gt_value.lower().strip().replace("\n"," ").replace(" ", "")
+
+        if pred_value is None and gt_value is None:
+            continue
+        elif pred_value is None:
+            precision = 0.0
+            recall = 0.0
+        elif gt_value is None:
+            # false positive
+            precision = 0.0
+            recall = 0.0
+        else:
+            if pred_value == gt_value:
+                # True positive
+                precision = 1.0
+                recall = 1.0
+            else:
+                precision = 0.0
+                recall = 0.0
+
+        # Compute F1-score
+        f1_score = 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0.0
+        f1_scores[key] = f1_score
+
+    if len(f1_scores) == 0:
+        return 0
+    average_f1 = sum(f1_scores.values()) / len(f1_scores)
+
+    return average_f1
+
+
+_PRE_CLEAN_SUBS = [
+    (re.compile(r'<bos>|<eos>|<pad>|<unk>'), ''),
+    (re.compile(r'\s##(\S)'), r'\1'),
+    (re.compile(r'\\\s'), r'\\'),
+    (re.compile(r'\s\*\s\*\s'), r'**'),
+    (re.compile(r'{\s'), r'{'),
+    (re.compile(r'\s}'), r'}'),
+    (re.compile(r'\s}'), r'}'),
+    (re.compile(r'\\begin\s'), r'\\begin'),
+    (re.compile(r'\\end\s'), r'\\end'),
+    (re.compile(r'\\end{table}'), r'\\end{table} \n\n'),
+]
+_PRE_CLEAN_CHARS = str.maketrans({'\n': ' ', '*': ' ', '_': ' '})
+
+# default max_exact_nodes of doc_parsing_evaluation: None always computes the exact
+# distance; a node count (e.g. 200) opts in to the sectioned approximation above it
+DOC_TREE_EXACT_MAX_NODES = None
+
+
+def pre_clean(text):
+    for pattern, repl in _PRE_CLEAN_SUBS:
+        text = pattern.sub(repl, text)
+    return text.translate(_PRE_CLEAN_CHARS)
+
+
+def get_tree(input_str):
+    """
+    Builds the ROOT -> heading -> line tree in a single pass.
+    Lines are attached through a direct reference to the node that
+    tree.get(last_title) would return, i.e. the first node carrying that label
+    in preorder. Nodes are only ever appended, so the child-index path of a node
+    never changes and comparing paths gives the preorder position.
+    """
+    tree = Node('ROOT')
+    title = Node('TITLE')
+    tree.addkid(title)
+    paths = {id(tree): (), id(title): (0,)}
+    first_node = {'ROOT': ((), tree), 'TITLE': ((0,), title)}
+
+    def add(parent, label):
+        node = Node(label)
+        parent.addkid(node)
+        path = paths[id(parent)] + (len(parent.children) - 1,)
+        paths[id(node)] = path
+        known = first_node.get(label)
+        if known is None or path < known[0]:
+            first_node[label] = (path, node)
+
+    parent = title
+    for line in input_str.split("\n"):
+        line = pre_clean(line)
+        if line.startswith('#'):
+            line = line.replace('#', '')
+            add(tree, line)
+            parent = title if line == '' else first_node[line][1]
+        else:
+            add(parent, line)
+    return tree
+
+
+def _steds_label_distance(pred, ref):
+    if len(pred.split()) == 0 or len(ref.split()) == 0:
+        return 1
+    else:
+        return 0
+
+
+def _sectioned_distance(pred_tree, ref_tree):
+    """
+    Tree edit distance computed per section (TITLE and every heading subtree).
+    Sections are aligned by heading label; aligned sections are compared with
+    zss, unaligned ones cost their full size. The result is the cost of a valid
+    edit script, i.e. an upper bound of the exact distance: nodes cannot be
+    matched across section boundaries, so it can be larger even when the
+    headings line up, and the score it gives is a lower bound of STEDS.
+    """
+    pred_sections = pred_tree.children
+    ref_sections = ref_tree.children
+    if len(pred_sections) == len(ref_sections):
+        pairs = list(zip(pred_sections, ref_sections))
+        unmatched = []
+    else:
+        matcher = SequenceMatcher(None, [n.label for n in pred_sections],
+                                  [n.label for n in ref_sections], autojunk=False)
+        pairs, unmatched = [], []
+        for _, i1, i2, j1, j2 in matcher.get_opcodes():
+            n_pairs = min(i2 - i1, j2 - j1)
+            pairs += zip(pred_sections[i1:i1 + n_pairs], ref_sections[j1:j1 + n_pairs])
+            unmatched += pred_sections[i1 + n_pairs:i2] + ref_sections[j1 + n_pairs:j2]
+    total_distance = _steds_label_distance(pred_tree.label, ref_tree.label)
+    for pred_section, ref_section in pairs:
+        total_distance += simple_distance(pred_section, ref_section, label_dist=_steds_label_distance)
+    total_distance += sum(_tree_size(section) for section in unmatched)
+    return total_distance
+
+
+def STEDS(pred_tree, ref_tree, max_exact_nodes=None):
+    """
+    Structure-aware TEDS for document parsing.
+    Trees with more than `max_exact_nodes` nodes are scored per section
+    (see _sectioned_distance, an approximation from below); by default the
+    exact distance is always used.
+    """
+    num_of_nodes = max(_tree_size(pred_tree), _tree_size(ref_tree))
+    if max_exact_nodes is None or num_of_nodes <= max_exact_nodes:
+        total_distance = simple_distance(pred_tree, ref_tree, label_dist=_steds_label_distance)
+    else:
+        total_distance = _sectioned_distance(pred_tree, ref_tree)
+    return 1-total_distance/num_of_nodes
+
+
+def doc_parsing_evaluation(pred, gt, max_exact_nodes=DOC_TREE_EXACT_MAX_NODES):
+    score = 0
+    if not isinstance(pred, str):
+        return 0
+    pred_tree = get_tree(pred)
+    gt_tree = get_tree(gt)
+    score = STEDS(pred_tree, gt_tree, max_exact_nodes=max_exact_nodes)
+
+    return score
+
+
+def get_anls(s1, s2):
+    try:
+        s1 = s1.lower()
+        s2 = s2.lower()
+    except:
+        pass
+    if s1 == s2:
+        return 1.0
+    iou = 1 - editdistance.eval(s1, s2) / max(len(s1), len(s2))
+    anls = iou
+    return anls
+
+
+def ocr_eval(references,predictions):
+    socre_=0.0
+    None_num=0
+    for idx,ref_value in enumerate(references):
+        pred_value = predictions[idx]
+        pred_values, ref_values = [], []
+        if isinstance(pred_value, str):
+            pred_values.append(pred_value)
+        else:
+            pred_values = pred_value
+        if isinstance(ref_value, str):
+            ref_values.append(ref_value)
+        else:
+            ref_values = ref_value
+        
+        temp_score = 0.0
+        temp_num = len(ref_values)
+        
+        for tmpidx, tmpref in enumerate(ref_values):
+            tmppred = pred_values[tmpidx] if tmpidx < len(pred_values) else pred_values[0]
+            if len(pred_values) == 1 and tmppred != "None" and "None" not in ref_values:  # pred 1, and not None
+                temp_score = max(temp_score, get_anls(tmppred, tmpref))
+                temp_num = len(ref_values)
+            else:
+                if tmppred=='None' and tmpref!='None':
+                    temp_score += 0.0
+                elif tmpref=='None':
+                    temp_num -= 1
+                else:
+                    temp_score += get_anls(tmppred, tmpref)
+        if temp_num == 0:
+            ocr_score = 0.0
+            None_num += 1
+        else:
+            ocr_score = temp_score / (temp_num)
+        socre_ += ocr_score
+    if None_num == len(references):
+        return 9999
+    else:
+        return round(socre_ / (len(references)-None_num), 5)
+
+
+_INLINE_SCORE = object()
+
+
+def _lower_anls_input(s):
+    """Same lowercasing rule as get_anls (non-strings are left untouched)."""
+    try:
+        return s.lower()
+    except:
+        return s
+
+
+def _anls_chunk(pairs):
+    """ANLS for a chunk of already lowercased (pred, ref) pairs."""
+    scores = []
+    for s1, s2 in pairs:
+        if s1 == s2:
+            scores.append(1.0)
+        else:
+            scores.append(1 - editdistance.eval(s1, s2) / max(len(s1), len(s2)))
+    return scores
+
+
+def _ocr_row_plan(ref_value, pred_value):
+    """
+    Mirrors the branching of ocr_eval for one row.
+    Returns (use_max, pairs, temp_num) where pairs lists the (pred, ref) values
+    whose ANLS contributes to the row score (None for a 0.0 contribution).
+    """
+    pred_values = [pred_value] if isinstance(pred_value, str) else pred_value
+    ref_values = [ref_value] if isinstance(ref_value, str) else ref_value
+    temp_num = len(ref_values)
+    if not ref_values:
+        return False, [], temp_num
+    # a single prediction compared with every reference keeps the best match
+    if len(pred_values) == 1 and pred_values[0] != "None" and "None" not in ref_values:
+        return True, [(pred_values[0], tmpref) for tmpref in ref_values], temp_num
+    pairs = []
+    for tmpidx, tmpref in enumerate(ref_values):
+        tmppred = pred_values[tmpidx] if tmpidx < len(pred_values) else pred_values[0]
+        if tmppred == 'None' and tmpref != 'None':
+            pairs.append(None)
+        elif tmpref == 'None':
+            temp_num -= 1
+        else:
+            pairs.append((tmppred, tmpref))
+    return False, pairs, temp_num
+
+
+def batch_ocr_eval_columns(columns, n_jobs=1, chunk_size=2048):
+    """
+    Batched version of ocr_eval for several OCR fields at once
+    (e.g. title / source / x_title / y_title of a chart set).
+
+    Identical (pred, ref) pairs are scored once across all columns, lowercased
+    forms are computed once per distinct string and the remaining edit distances
+    are computed in chunks over the worker pool.
+
+    Args:
+        columns (dict): {column_name: (references, predictions)}
+        n_jobs (int): number of worker processes used for the distance computations
+        chunk_size (int): number of unique pairs per worker task
+    Returns:
+        dict: {column_name: score}, each score equal to ocr_eval(references, predictions)
+    """
+    lowered = {}
+    unique_pairs = {}
+    plans = {}
+
+    def lower(value):
+        lowered_value = lowered.get(value)
+        if lowered_value is None:
+            lowered_value = lowered[value] = _lower_anls_input(value)
+        return lowered_value
+
+    def pair_key(pred, ref):
+        try:
+            key = (lower(pred), lower(ref))
+            unique_pairs.setdefault(key, None)
+            return key
+        except TypeError:
+            # unhashable values (e.g. nested lists) are scored inline
+            return (_INLINE_SCORE, get_anls(pred, ref))
+
+    for name, (references, predictions) in columns.items():
+        column_plan = []
+        for ref_value, pred_value in zip(references, predictions):
+            if (isinstance(ref_value, str) and isinstance(pred_value, str)
+                    and ref_value != "None" and pred_value != "None"):
+                # common case: one prediction against one reference, row score is its ANLS
+                key = (lower(pred_value), lower(ref_value))
+                unique_pairs.setdefault(key, None)
+                column_plan.append(key)
+            else:
+                use_max, pairs, temp_num = _ocr_row_plan(ref_value, pred_value)
+                keys = [None if pair is None else pair_key(*pair) for pair in pairs]
+                column_plan.append([use_max, keys, temp_num])
+        if len(column_plan) < len(references):
+            # same IndexError as ocr_eval when predictions are shorter than references
+            predictions[len(references) - 1]
+        plans[name] = column_plan
+
+    # equal pairs never need a distance computation
+    pending = []
+    for key in unique_pairs:
+        if key[0] == key[1]:
+            unique_pairs[key] = 1.0
+        else:
+            pending.append(key)
+
+    if pending:
+        chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+        if n_jobs == 1 or len(chunks) == 1:
+            results = [_anls_chunk(chunk) for chunk in chunks]
+        else:
+            results = parallel_process(chunks, _anls_chunk, n_jobs=n_jobs, chunk_size=1)
+        for chunk, chunk_scores in zip(chunks, results):
+            if isinstance(chunk_scores, Exception):
+                raise chunk_scores
+            unique_pairs.update(zip(chunk, chunk_scores))
+
+    def lookup(key):
+        if key is None:
+            return 0.0
+        if key[0] is _INLINE_SCORE:
+            return key[1]
+        return unique_pairs[key]
+
+    scores = {}
+    for name, column_plan in plans.items():
+        socre_ = 0.0
+        None_num = 0
+        for entry in column_plan:
+            if type(entry) is tuple:
+                socre_ += unique_pairs[entry]
+                continue
+            use_max, keys, temp_num = entry
+            temp_score = 0.0
+            for key in keys:
+                if use_max:
+                    temp_score = max(temp_score, lookup(key))
+                else:
+                    temp_score += lookup(key)
+            if temp_num == 0:
+                None_num += 1
+            else:
+                socre_ += temp_score / temp_num
+        if None_num == len(column_plan):
+            scores[name] = 9999
+        else:
+            scores[name] = round(socre_ / (len(column_plan) - None_num), 5)
+    return scores
+
+
+def batch_ocr_eval(references, predictions, n_jobs=1, chunk_size=2048):
+    """
+    Batched ocr_eval over whole columns of references and predictions.
+    Returns the same score as ocr_eval(references, predictions).
+    """
+    return batch_ocr_eval_columns({'ocr': (references, predictions)},
+                                  n_jobs=n_jobs, chunk_size=chunk_size)['ocr']
+
+
+def csv_eval(predictions,references,easy, pred_type='json'):
+    predictions = predictions
+    labels = references
+    def is_int(val):
+        try:
+            int(val)
+            return True
+        except ValueError:
+            return False
+
+    def is_float(val):
+        try:
+            float(val)
+            return True
+        except ValueError:
+            return False
+    
+    def convert_dict_to_list(data):
+        """
+        Convert a dictionary to a list of tuples, handling both simple and nested dictionaries.
+        
+        Args:
+        data (dict): The input dictionary, which might be nested or simple.
+        
+        Returns:
+        list: A list of tuples generated from the input dictionary.
+        """
+        # print(data)
+        converted_list = []
+        for key, value in data.items():
+            # Check if the value is a dictionary (indicating a nested structure)
+            if isinstance(value, dict):
+                # Handle nested dictionary
+                for subkey, subvalue in value.items():
+                    # converted_list.append((key, subkey, subvalue))
+                    converted_list.append((key, subkey, re.sub(r'[^\d.-]', '', str(subvalue))))
+
+            else:
+                # Handle simple key-value pair
+                # converted_list.append((key, "value", value))
+                converted_list.append((key, "value", re.sub(r'[^\d.-]', '', str(value))))
+        return converted_list
+
+
+    def csv2triples(csv, separator='\\t', delimiter='\\n'):  
+        lines = csv.strip().split(delimiter)
+        header = lines[0].split(separator) 
+        triples = []
+        for line in lines[1:]:   
+            if not line:
+                continue
+            values = line.split(separator)
+            entity = values[0]
+            for i in range(1, len(values)):
+                if i >= len(header):
+                    break
+                #---------------------------------------------------------
+                temp = [entity.strip(), header[i].strip()]
+                temp = [x if len(x)==0 or x[-1] != ':' else x[:-1] for x in temp]
+                value = values[i].strip()
+                value = re.sub(r'[^\d.-]', '', str(value))
+                # value = value.replace("%","")     
+                # value = value.replace("$","")     
+                triples.append((temp[0], temp[1], value))
+                #---------------------------------------------------------
+        return triples
+    
+    def csv2triples_noheader(csv, separator='\\t', delimiter='\\n'):  
+        lines = csv.strip().split(delimiter)
+        maybe_header = [x.strip() for x in lines[0].split(separator)]
+        not_header = False
+        if len(maybe_header) > 2:
+            for c in maybe_header[1:]:
+                try:
+                    num = float(c)
+                    not_header = True
+                except:
+                    continue
+                if not_header:
+                    break
+        header = None if not_header else maybe_header
+        data_start = 0 if not_header and separator in lines[0] else 1
+        triples = []
+        for line in lines[data_start:]:   
+            if not line:
+                continue
+            values = [x.strip() for x in line.split(separator)]
+            entity = values[0]
+            for i in range(1, len(values)):
+                try:
+                    temp = [entity if entity[-1]!=':' else entity[:-1], ""]
+                except:
+                    temp = [entity, ""]
+                if header is not None:
+                    try:
+                        this_header = header[i]
+                        temp = [entity, this_header]
+                        temp = [x if x[-1] != ':' else x[:-1] for x in temp]
+                    except:
+                        this_header = entity.strip()
+                value = values[i].strip()
+                value = re.sub(r'[^\d.-]', '', str(value))
+                # value = value.replace("%","")     
+                # value = value.replace("$","")     
+                triples.append((temp[0], temp[1], value))
+                #---------------------------------------------------------
+        return triples
+
+    def process_triplets(triplets):
+        new_triplets = []
+        for triplet in triplets:
+            new_triplet = []
+            triplet_temp = []
+            if len(triplet) > 2:
+                if is_int(triplet[2]) or is_float(triplet[2]):
+                    triplet_temp = (triplet[0].lower(), triplet[1].lower(), float(triplet[2]))
+                else:
+                    triplet_temp = (triplet[0].lower(), triplet[1].lower(), triplet[2].lower())
+            else: 
+                triplet_temp = (triplet[0].lower(), triplet[1].lower(), "no meaning")
+            new_triplets.append(triplet_temp)
+        return new_triplets
+
+    def intersection_with_tolerance(a, b, tol_word, tol_num):
+        a = set(a)
+        b = set(b)
+        c = set()
+        for elem1 in a:
+            for elem2 in b:
+                if is_float(elem1[-1]) and is_float(elem2[-1]):
+                    if ((Levenshtein.distance(''.join(elem1[:-1]),''.join(elem2[:-1])) <= tol_word) and (abs(elem1[-1] - elem2[-1]) / (abs(elem2[-1])+0.000001) <= tol_num))or \
+                    ((''.join(elem1[:-1]) in ''.join(elem2[:-1])) and (abs(elem1[-1] - elem2[-1]) / (abs(elem2[-1])+0.000001) <= tol_num)) or \
+                    ((''.join(elem2[:-1]) in ''.join(elem1[:-1])) and (abs(elem1[-1] - elem2[-1]) / (abs(elem2[-1])+0.000001) <= tol_num)):
+                        c.add(elem1)
+                else:
+                    if (Levenshtein.distance(''.join([str(i) for i in elem1]),''.join([str(j) for j in elem2])) <= tol_word):
+                        c.add(elem1)
+        return list(c)
+
+    def union_with_tolerance(a, b, tol_word, tol_num):
+        c = set(a) | set(b)
+        d = set(a) & set(b)
+        e = intersection_with_tolerance(a, b, tol_word, tol_num)
+        f = set(e)
+        g = c-(f-d)
+        return list(g)
+
+    def get_eval_list(pred_csv, label_csv, separator='\\t', delimiter='\\n', tol_word=3, tol_num=0.05, pred_type='json'):
+
+        if pred_type == 'json':
+            pred_triple_list=[]
+            for it in pred_csv:
+                pred_triple_temp = convert_dict_to_list(it)
+                pred_triple_pre = process_triplets(pred_triple_temp)
+                pred_triple_list.append(pred_triple_pre) 
+        else:
+            pred_triple_list=[]
+            for it in pred_csv:
+                pred_triple_temp = csv2triples(it, separator=separator, delimiter=delimiter)
+                # pred_triple_temp = csv2triples_noheader(it, separator=separator, delimiter=delimiter)
+                pred_triple_pre = process_triplets(pred_triple_temp)
+                pred_triple_list.append(pred_triple_pre) 
+
+        label_triple_list=[]
+        for it in label_csv:
+            label_triple_temp = convert_dict_to_list(it)
+            label_triple_pre = process_triplets(label_triple_temp)
+            label_triple_list.append(label_triple_pre) 
+
+            
+        intersection_list=[]
+        union_list=[]
+        sim_list=[]
+        # for each chart image
+        for pred,label in zip(pred_triple_list, label_triple_list):
+            for idx in range(len(pred)):
+                try:
+                    if label[idx][1] == "value" and "value" not in pred[idx][:2]:
+                        pred[idx] = (pred[idx][0], "value", pred[idx][2]) 
+                    temp_pred_head = sorted(pred[idx][:2])
+                    temp_gt_head = sorted(label[idx][:2])
+                    pred[idx] = (temp_pred_head[0], temp_pred_head[1], pred[idx][2])
+                    label[idx] = (temp_gt_head[0], temp_gt_head[1], label[idx][2])
+                except:
+                    continue
+            intersection = intersection_with_tolerance(pred, label, tol_word = tol_word, tol_num=tol_num)
+            union = union_with_tolerance(pred, label, tol_word = tol_word, tol_num=tol_num)
+            sim = len(intersection)/len(union)
+            intersection_list.append(intersection)
+            union_list.append(union)
+            sim_list.append(sim)
+        return intersection_list, union_list, sim_list
+
+    def get_ap(predictions, labels, sim_threhold, tolerance, separator='\\t', delimiter='\\n', easy=1):
+        if tolerance == 'strict':
+            tol_word=0
+            if easy == 1:
+                tol_num=0
+            else:
+                tol_num=0.1
+
+        elif tolerance == 'slight':
+            tol_word=2
+            if easy == 1:
+                tol_num=0.05
+            else:
+                tol_num=0.3
+
+        elif tolerance == 'high':
+            tol_word= 5
+            if easy == 1:
+                tol_num=0.1
+            else:
+                tol_num=0.5      
+        intersection_list, union_list, sim_list = get_eval_list(predictions, labels, separator=separator, delimiter=delimiter, tol_word=tol_word, tol_num=tol_num, pred_type=pred_type)
+        ap = len([num for num in sim_list if num >= sim_threhold])/(len(sim_list)+1e-16)
+        return ap   
+
+    map_strict = 0
+    map_slight = 0
+    map_high = 0
+    s="\\t"
+    d="\\n"
+
+    for sim_threhold in np.arange (0.5, 1, 0.05):
+        map_temp_strict = get_ap(predictions, labels, sim_threhold=sim_threhold, tolerance='strict', separator=s, delimiter=d, easy=easy)
+        map_temp_slight = get_ap(predictions, labels, sim_threhold=sim_threhold, tolerance='slight', separator=s, delimiter=d, easy=easy)
+        map_temp_high = get_ap(predictions, labels, sim_threhold=sim_threhold, tolerance='high', separator=s, delimiter=d, easy=easy)
+        map_strict += map_temp_strict/10
+        map_slight += map_temp_slight/10
+        map_high += map_temp_high/10
+
+    em = get_ap(predictions, labels, sim_threhold=1, tolerance='strict', separator=s, delimiter=d, easy=easy)
+    ap_50_strict = get_ap(predictions, labels, sim_threhold=0.5, tolerance='strict', separator=s, delimiter=d, easy=easy)
+    ap_75_strict = get_ap(predictions, labels, sim_threhold=0.75, tolerance='strict', separator=s, delimiter=d, easy=easy)    
+    ap_90_strict = get_ap(predictions, labels, sim_threhold=0.90, tolerance='strict', separator=s, delimiter=d, easy=easy)
+    ap_50_slight = get_ap(predictions, labels, sim_threhold=0.5, tolerance='slight', separator=s, delimiter=d, easy=easy)
+    ap_75_slight = get_ap(predictions, labels, sim_threhold=0.75, tolerance='slight', separator=s, delimiter=d, easy=easy)    
+    ap_90_slight = get_ap(predictions, labels, sim_threhold=0.90, tolerance='slight', separator=s, delimiter=d, easy=easy)
+    ap_50_high = get_ap(predictions, labels, sim_threhold=0.5, tolerance='high', separator=s, delimiter=d, easy=easy)
+    ap_75_high = get_ap(predictions, labels, sim_threhold=0.75, tolerance='high', separator=s, delimiter=d, easy=easy)    
+    ap_90_high = get_ap(predictions, labels, sim_threhold=0.90, tolerance='high', separator=s, delimiter=d, easy=easy)
+
+
+    return em, map_strict, map_slight, map_high, ap_50_strict, ap_75_strict, ap_90_strict, ap_50_slight, ap_75_slight, ap_90_slight, ap_50_high, ap_75_high, ap_90_high
+
+def draw_SCRM_table(em, map_strict, map_slight, map_high, ap_50_strict, ap_75_strict, ap_90_strict, ap_50_slight, ap_75_slight, ap_90_slight, ap_50_high, ap_75_high, ap_90_high,title_ocr_socre,source_ocr_socre,x_title_ocr_socre,y_title_ocr_socre,structure_accuracy):
+
+    result=f'''
+            -----------------------------------------------------------\n
+            |  Metrics   |  Sim_threshold  |  Tolerance  |    Value    |\n
+            -----------------------------------------------------------\n
+            |             |                 |   strict    |    {'%.4f' % map_strict}    |     \n
+            |             |                 ----------------------------\n
+            |  mPrecison  |  0.5:0.05:0.95  |   slight    |    {'%.4f' % map_slight}    |\n
+            |             |                  ---------------------------\n
+            |             |                 |    high     |    {'%.4f' % map_high}    |\n
+            -----------------------------------------------------------\n
+            |             |                 |   strict    |    {'%.4f' % ap_50_strict}    |\n
+            |             |                  ---------------------------\n
+            |  Precison   |       0.5       |   slight    |    {'%.4f' % ap_50_slight }    |\n
+            |             |                  ---------------------------\n
+            |             |                 |    high     |    {'%.4f' % ap_50_high }    |\n
+            -----------------------------------------------------------\n
+            |             |                 |   strict    |    {'%.4f' % ap_75_strict}    |\n
+            |             |                  ---------------------------\n
+            |  Precison   |      0.75       |   slight    |    {'%.4f' % ap_75_slight}    |\n
+            |             |                  ---------------------------\n
+            |             |                 |    high     |    {'%.4f' % ap_75_high}    |\n
+            -----------------------------------------------------------\n
+            |             |                 |   strict    |    {'%.4f' % ap_90_strict}    |\n
+            |             |                  ---------------------------\n
+            |  Precison   |       0.9       |   slight    |    {'%.4f' % ap_90_slight }    |\n
+            |             |                  ---------------------------\n
+            |             |                 |    high     |    {'%.4f' % ap_90_high}    |\n
+            -----------------------------------------------------------\n
+            |Precison(EM) |                                    {'%.4f' % em}    |\n
+            -----------------------------------------------------------\n
+            |Title(EM)    |                                    {'%.4f' % title_ocr_socre}    |\n
+            -----------------------------------------------------------\n
+            |Source(EM)   |                                    {'%.4f' % source_ocr_socre}    |\n
+            -----------------------------------------------------------\n
+            |X_title(EM)  |                                    {'%.4f' % x_title_ocr_socre}    |\n
+            -----------------------------------------------------------\n
+            |Y_title(EM)  |                                    {'%.4f' % y_title_ocr_socre}    |\n
+            -----------------------------------------------------------\n
+            |structure_acc|                                    {'%.4f' % structure_accuracy}    |\n
+            -----------------------------------------------------------\n
+
+
+            '''
+    return result
+
+
+if __name__ == '__main__':
+    from app.TEDS_metric import TEDS, convert_markdown_table_to_html
+    import json
+    import pprint
+
+    # markdown structure for Table Parsing task
+    pred_markdown = "| 1 | august 5 , 1972 | detroit lions | l 23 - 31 | 0 - 1 |\n| 2 | august 12 , 1972 | green bay packers | l 13 - 14 | 0 - 2 |\n| 3 | august 19 , 1972 | cincinnati bengals | w 35 - 17 | 1 - 2 |\n| 4 | august 25 , 1972 | atlanta falcons | w 24 - 10 | 2 - 2 |\n| 5 | august 31 , 1972 | washington redskins | l 24 - 27 | 2 - 3 |\n| 6 | september 10 , 1972 | minnesota vikings | w 21 - 19 | 3 - 3 |"
+    true_markdown = "| week | date | opponent | result | record |\n| --- | --- | --- | --- | --- |\n| 1 | august 5 , 1972 | detroit lions | l 23 - 31 | 0 - 1 |\n| 2 | august 12 , 1972 | green bay packers | l 13 - 14 | 0 - 2 |\n| 3 | august 19 , 1972 | cincinnati bengals | w 35 - 17 | 1 - 2 |\n| 4 | august 25 , 1972 | atlanta falcons | w 24 - 10 | 2 - 2 |\n| 5 | august 31 , 1972 | washington redskins | l 24 - 27 | 2 - 3 |\n| 6 | september 10 , 1972 | minnesota vikings | w 21 - 19 | 3 - 3 |"
+    teds = TEDS(n_jobs=4)
+    pred_table_html = convert_markdown_table_to_html(pred_markdown)
+    true_table_html = convert_markdown_table_to_html(true_markdown)
+
+    scores = teds.evaluate(pred_table_html, true_table_html)
+
+    pp = pprint.PrettyPrinter()
+    pp.pprint(scores)
+
+    # dict structure for Key Information Extraction task
+    pred_dict = {
+            "company": [
+                "OLD TOWN "
+            ],
+            "date": [
+                "2024"
+            ],
+            "address": [
+                "SRI RAMPAI"
+            ],
+            "total": [
+                "30"
+            ]
+        }
+    true_dict = {
+            "company": [
+                "OLD TOWN KOPITAM SND BHD"
+            ],
+            "date": [
+                "2024/9/27"
+            ],
+            "address": [
+                "SRI RAMPAI"
+            ],
+            "total": [
+                "30"
+            ]
+        }
+    teds = TEDS(n_jobs=4)
+    pred_dict_html = dict_to_html(pred_dict)
+    true_dict_html = dict_to_html(true_dict)
+    print(pred_dict_html)
+    print(true_dict_html)
+
+    scores = teds.evaluate(pred_dict_html, true_dict_html)
+
+    pp = pprint.PrettyPrinter()
+    pp.pprint(scores)
\ No newline at end of file
@@ -1,9 +1,105 @@
-from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
-def parallel_process(array, function, n_jobs=16, use_kwargs=False, front_num=0):
+
+def _run_chunk(function, chunk, use_kwargs):
+    """Runs function over a chunk in a worker, keeping each item's exception instead of failing the chunk."""
+    out = []
+    for a in chunk:
+        try:
+            out.append(function(**a) if use_kwargs else function(a))
+        except Exception as e:
+            out.append(e)
+    return out
+
+
+class ParallelExecutor(object):
+    ''' Reusable facade over a persistent process pool.
+
+        The pool is started on the first map() and kept for later calls, so
+        repeated batches do not pay the worker start-up again. Elements are
+        sent in chunks: the function is pickled once per chunk instead of once
+        per element.
+    '''
+    def __init__(self, n_jobs=16, chunks_per_worker=4, mp_context=None):
+        self.n_jobs = n_jobs
+        self.chunks_per_worker = chunks_per_worker
+        self.mp_context = mp_context
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.n_jobs, mp_context=self.mp_context)
+            return self._pool
+
+    def map(self, function, array, use_kwargs=False, chunk_size=None, progress_callback=None):
+        ''' [function(array[0]), function(array[1]), ...] computed in the pool.
+            An element whose call raises gets the exception object in its place.
+            @params chunk_size: elements per task (default: spread over n_jobs × chunks_per_worker tasks)
+            @params progress_callback: called with (done, total) as chunks complete
+        '''
+        array = list(array)
+        total = len(array)
+        if not total:
+            return []
+        if chunk_size is None:
+            chunk_size = max(1, -(-total // (self.n_jobs * self.chunks_per_worker)))
+        pool = self.pool
+        futures = {}
+        for start in range(0, total, chunk_size):
+            future = pool.submit(_run_chunk, function, array[start:start + chunk_size], use_kwargs)
+            futures[future] = start
+        out = [None] * total
+        done = 0
+        pending = set(futures)
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                start = futures[future]
+                size = min(chunk_size, total - start)
+                try:
+                    out[start:start + size] = future.result()
+                except Exception as e:
+                    # the chunk itself failed (e.g. unpicklable element, dead worker)
+                    out[start:start + size] = [e] * size
+                done += size
+            if progress_callback:
+                progress_callback(done, total)
+        return out
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+_EXECUTORS = {}
+_EXECUTORS_LOCK = threading.Lock()
+
+
+def get_executor(n_jobs):
+    """Shared ParallelExecutor with n_jobs workers, created on first use."""
+    with _EXECUTORS_LOCK:
+        executor = _EXECUTORS.get(n_jobs)
+        if executor is None:
+            executor = _EXECUTORS[n_jobs] = ParallelExecutor(n_jobs)
+        return executor
+
+
+def parallel_process(array, function, n_jobs=16, use_kwargs=False, front_num=0, chunk_size=None,
+                     progress_callback=None):
     """
-        A parallel version of the map function with a progress bar.
+        A parallel version of the map function with a progress callback.
 
         Args:
             array (array-like): An array to iterate over.
@@ -11,40 +107,29 @@ def parallel_process(array, function, n_jobs=16, use_kwargs=False, front_num=0):
             n_jobs (int, default=16): The number of cores to use
             use_kwargs (boolean, default=False): Whether to consider the elements of array as dictionaries of
                 keyword arguments to function
-            front_num (int, default=3): The number of iterations to run serially before kicking off the parallel job.
+            front_num (int, default=0): The number of iterations to run serially before kicking off the parallel job.
                 Useful for catching bugs
+            chunk_size (int, default=None): Elements per task sent to a worker (see ParallelExecutor.map)
+            progress_callback (function, default=None): Called with (done, total) as elements complete
         Returns:
-            [function(array[0]), function(array[1]), ...]
+            [function(array[0]), function(array[1]), ...], in order; in the parallel part an element
+            whose call raised gets the exception object instead
     """
+    array = list(array)
+    total = len(array)
     # We run the first few iterations serially to catch bugs
-    if front_num > 0:
-        front = [function(**a) if use_kwargs else function(a) for a in array[:front_num]]
-    else:
-        front = []
+    front = [function(**a) if use_kwargs else function(a) for a in array[:front_num]]
+    if progress_callback and front:
+        progress_callback(len(front), total)
     # If we set n_jobs to 1, just run a list comprehension. This is useful for benchmarking and debugging.
     if n_jobs == 1:
-        return front + [function(**a) if use_kwargs else function(a) for a in tqdm(array[front_num:])]
-    # Assemble the workers
-    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
-        # Pass the elements of array into function
-        if use_kwargs:
-            futures = [pool.submit(function, **a) for a in array[front_num:]]
-        else:
-            futures = [pool.submit(function, a) for a in array[front_num:]]
-        kwargs = {
-            'total': len(futures),
-            'unit': 'it',
-            'unit_scale': True,
-            'leave': True
-        }
-        # Print out the progress as tasks complete
-        for f in tqdm(as_completed(futures), **kwargs):
-            pass
-    out = []
-    # Get the results from the futures.
-    for i, future in tqdm(enumerate(futures)):
-        try:
-            out.append(future.result())
-        except Exception as e:
-            out.append(e)
-    return front + out
\ No newline at end of file
+        out = []
+        for a in array[front_num:]:
+            out.append(function(**a) if use_kwargs else function(a))
+            if progress_callback:
+                progress_callback(len(front) + len(out), total)
+        return front + out
+    out = get_executor(n_jobs).map(
+        function, array[front_num:], use_kwargs=use_kwargs, chunk_size=chunk_size,
+        progress_callback=(lambda done, _: progress_callback(len(front) + done, total)) if progress_callback else None)
+    return front + out
@@ -0,0 +1,65 @@
+import asyncio
+
+
+# delivered instead of the dropped messages to a subscriber that fell too far behind
+OVERFLOW = object()
+
+
+class Subscription(object):
+    def __init__(self, hub, topic, max_queue):
+        self.hub = hub
+        self.topic = topic
+        self.queue = asyncio.Queue(maxsize=max_queue)
+
+    def _deliver(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # a subscriber this far behind has to resynchronize anyway: drop its backlog
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+
+    async def get(self, timeout=None):
+        ''' Next message, OVERFLOW if messages were dropped, or None after timeout seconds. '''
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub._subscribers.get(self.topic, set()).discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PubSubHub(object):
+    ''' In-process fan-out of messages to every subscriber of a topic.
+
+        Each subscriber has its own bounded queue, so publishing never waits on
+        a slow viewer; one that falls max_queue messages behind gets OVERFLOW
+        and is expected to reload the full state. Must be used from the event
+        loop thread.
+    '''
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._subscribers = {}
+
+    def subscribe(self, topic):
+        subscription = Subscription(self, topic, self.max_queue)
+        self._subscribers.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def publish(self, topic, message):
+        """Delivers message to the current subscribers of topic; returns how many there were."""
+        subscribers = list(self._subscribers.get(topic, ()))
+        for subscription in subscribers:
+            subscription._deliver(message)
+        return len(subscribers)
+
+    def subscriber_count(self, topic):
+        return len(self._subscribers.get(topic, ()))
@@ -0,0 +1,95 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+
+# hash of a prediction that is missing or empty (scored as "missing")
+_MISSING = ""
+
+
+def prediction_item_hash(pred_text):
+    ''' Hash of one prediction, normalized the way scoring sees it:
+        surrounding whitespace is ignored (tables are stripped before parsing),
+        missing and empty predictions share one hash.
+    '''
+    if not pred_text:
+        return _MISSING
+    if isinstance(pred_text, str):
+        # whitespace-only text is still scored (not "missing"), so it keeps a prefix
+        data = 's:' + pred_text.strip()
+    else:
+        data = 'j:' + json.dumps(pred_text, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:32]
+
+
+def submission_digest(ground_truth, predictions):
+    ''' Canonical digest of a submission: the same for files that differ only
+        in format (JSON or JSON Lines), key order, formatting, whitespace around
+        tables or keys that are not in the ground truth.
+        @params predictions: {id: prediction}, or an iterator of (id, prediction)
+            pairs read one at a time; a repeated ground truth id raises ValueError
+        @output: (digest, item_hashes) with item_hashes {ground truth id: prediction_item_hash}
+    '''
+    if isinstance(predictions, dict):
+        hashes = {key: prediction_item_hash(predictions.get(key)) for key in ground_truth}
+    else:
+        hashes = {}
+        for key, pred_text in predictions:
+            if key not in ground_truth:
+                continue
+            if key in hashes:
+                raise ValueError(f"Repeated id: {key!r}")
+            hashes[key] = prediction_item_hash(pred_text)
+    item_hashes = {}
+    digest = hashlib.sha256()
+    for key in ground_truth:
+        item_hash = hashes.get(key, _MISSING)
+        item_hashes[key] = item_hash
+        digest.update(f"{len(key)}:{key}={item_hash};".encode('utf-8'))
+    return digest.hexdigest(), item_hashes
+
+
+class ResultCache(object):
+    ''' Scoring results keyed by ground truth fingerprint and submission_digest,
+        one JSON file per result; a submission identical to one already scored
+        against the same ground truth reuses its result without scoring.
+        Files are replaced atomically, so processes can share the directory.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, gt_fingerprint, digest):
+        key = hashlib.sha256(f"{gt_fingerprint}:{digest}".encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, gt_fingerprint, digest):
+        ''' @output: the stored record {gt_fingerprint, digest, items, result, source, created_at}, or None '''
+        try:
+            with open(self._path(gt_fingerprint, digest), 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if record.get('gt_fingerprint') != gt_fingerprint or record.get('digest') != digest:
+            return None
+        return record
+
+    def put(self, gt_fingerprint, digest, item_hashes, result, source=None):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(gt_fingerprint, digest)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'gt_fingerprint': gt_fingerprint,
+                    'digest': digest,
+                    'items': item_hashes,
+                    'result': result,
+                    'source': source,
+                    'created_at': time.time()
+                }, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
@@ -0,0 +1,281 @@
+import time
+import uuid
+import queue
+import asyncio
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+_JOB_DONE = object()
+
+
+class ScoringJob(object):
+    ''' Chunks of one submission queued on a FairScheduler.
+        Results are consumed in completion order, with iter_results() from a
+        thread or with aiter_results() from an event loop.
+    '''
+    def __init__(self, job_id, weight=1.0):
+        self.job_id = job_id
+        self.weight = weight
+        self.pending = []
+        self.vtime = 0.0
+        self.total_chunks = 0
+        self.done_chunks = 0
+        self.total_items = 0
+        self.done_items = 0
+        self.in_flight = 0
+        # an open job (see FairScheduler.extend) does not finish before it is closed
+        self.closed = True
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._results = queue.Queue()
+        self._listeners = []
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def status(self):
+        """Progress and throughput of the job, as served by /api/jobs."""
+        now = self.finished_at or time.time()
+        running_time = now - self.started_at if self.started_at else 0.0
+        if self.error is not None:
+            state = "failed"
+        elif self.finished:
+            state = "done"
+        elif self.started_at is None:
+            state = "queued"
+        else:
+            state = "running"
+        return {
+            "job_id": self.job_id,
+            "state": state,
+            "weight": self.weight,
+            "items_done": self.done_items,
+            "items_total": self.total_items,
+            "chunks_done": self.done_chunks,
+            "chunks_total": self.total_chunks,
+            "chunks_in_flight": self.in_flight,
+            "wait_seconds": round((self.started_at or now) - self.submitted_at, 3),
+            "running_seconds": round(running_time, 3),
+            "items_per_second": round(self.done_items / running_time, 2) if running_time > 0 else 0.0,
+            "error": str(self.error) if self.error is not None else None,
+        }
+
+    def _put(self, item):
+        self._results.put(item)
+        for notify in list(self._listeners):
+            notify()
+
+    def iter_results(self):
+        """Yields (context, result) for every chunk as it completes; re-raises a pool failure."""
+        while True:
+            item = self._results.get()
+            if item is _JOB_DONE:
+                break
+            yield item
+        if self.error is not None:
+            raise self.error
+
+    async def aiter_results(self):
+        """Async version of iter_results: waits on the event loop, no thread is blocked."""
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+
+        def notify():
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:
+                # the loop was closed while the job was running
+                pass
+
+        self._listeners.append(notify)
+        try:
+            while True:
+                ready.clear()
+                try:
+                    item = self._results.get_nowait()
+                except queue.Empty:
+                    await ready.wait()
+                    continue
+                if item is _JOB_DONE:
+                    break
+                yield item
+        finally:
+            self._listeners.remove(notify)
+        if self.error is not None:
+            raise self.error
+
+
+class FairScheduler(object):
+    ''' Shares one process pool between concurrent jobs.
+
+        Every job is a list of chunks. At most max_in_flight chunks are handed to
+        the pool at a time and the next chunk always comes from the job with the
+        smallest virtual time (cost already dispatched / weight), i.e. weighted
+        fair queueing at chunk granularity: a small job arriving behind a large
+        one is interleaved with it instead of waiting for it to drain.
+        Dispatching happens on submit and in the pool's completion callbacks,
+        no thread is dedicated to a job or to the scheduler.
+    '''
+    def __init__(self, n_workers, function, initializer=None, initargs=(), max_in_flight=None,
+                 max_finished_jobs=200):
+        self.n_workers = n_workers
+        self.function = function
+        self.initializer = initializer
+        self.initargs = initargs
+        self.max_in_flight = max_in_flight or 2 * n_workers
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs = OrderedDict()
+        self._active = []
+        self._in_flight = 0
+        self._vclock = 0.0
+        self._lock = threading.Lock()
+        self._pool = self._new_pool()
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.n_workers,
+                                   mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=self.initializer,
+                                   initargs=self.initargs)
+
+    def submit(self, chunks, job_id=None, weight=1.0, closed=True):
+        ''' Queues a job.
+            @params chunks: [(payload, cost, context), ...] in dispatch order;
+                function(payload) runs in a worker, context is handed back with the result
+            @params closed: False to keep adding chunks with extend() (e.g. while a
+                file is being read); the job then finishes only after close()
+            @output: ScoringJob
+        '''
+        job = ScoringJob(job_id or uuid.uuid4().hex, weight)
+        job.pending = list(reversed(chunks))
+        job.total_chunks = len(chunks)
+        job.total_items = sum(len(payload) for payload, _, _ in chunks)
+        job.closed = closed
+        with self._lock:
+            # a new job starts level with the jobs already queued
+            job.vtime = min((active.vtime for active in self._active), default=self._vclock)
+            self.jobs[job.job_id] = job
+            self.jobs.move_to_end(job.job_id)
+            self._prune_jobs()
+            if job.pending:
+                self._active.append(job)
+            elif closed:
+                job.started_at = job.finished_at = time.time()
+                job._put(_JOB_DONE)
+        self._fill()
+        return job
+
+    def extend(self, job, chunks):
+        """Queues more chunks of an open job, after the ones it already has."""
+        with self._lock:
+            if job.closed or job.error is not None:
+                return
+            job.pending[:0] = reversed(chunks)
+            job.total_chunks += len(chunks)
+            job.total_items += sum(len(payload) for payload, _, _ in chunks)
+            if job.pending and job not in self._active:
+                # an idle job rejoins level with the jobs already queued
+                job.vtime = max(job.vtime, min((active.vtime for active in self._active), default=self._vclock))
+                self._active.append(job)
+        self._fill()
+
+    def close(self, job, cancel=False):
+        ''' Marks an open job complete: it finishes once its queued chunks are done.
+            cancel: drop the chunks not dispatched yet (their results are not needed).
+        '''
+        with self._lock:
+            job.closed = True
+            if cancel and job.pending:
+                job.total_chunks -= len(job.pending)
+                job.total_items -= sum(len(payload) for payload, _, _ in job.pending)
+                job.pending = []
+                if job in self._active:
+                    self._active.remove(job)
+            if job.started_at is None and not job.pending and not job.in_flight:
+                job.started_at = time.time()
+            finished = self._finish_if_complete(job)
+        if finished:
+            job._put(_JOB_DONE)
+
+    def status(self, job_id):
+        job = self.jobs.get(job_id)
+        return job.status() if job is not None else None
+
+    def _prune_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
+
+    def _fill(self):
+        dispatch = []
+        with self._lock:
+            while self._in_flight < self.max_in_flight and self._active:
+                job = min(self._active, key=lambda active: active.vtime)
+                payload, cost, context = job.pending.pop()
+                job.vtime += cost / job.weight
+                self._vclock = job.vtime
+                if not job.pending:
+                    self._active.remove(job)
+                if job.started_at is None:
+                    job.started_at = time.time()
+                job.in_flight += 1
+                self._in_flight += 1
+                dispatch.append((job, payload, context))
+            pool = self._pool
+        for job, payload, context in dispatch:
+            try:
+                future = pool.submit(self.function, payload)
+            except Exception as e:
+                self._chunk_failed(job, pool, e)
+                continue
+            future.add_done_callback(lambda future, job=job, payload=payload, context=context, pool=pool:
+                                     self._chunk_done(job, pool, payload, context, future))
+
+    def _chunk_done(self, job, pool, payload, context, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            self._chunk_failed(job, pool, e)
+            return
+        with self._lock:
+            self._in_flight -= 1
+            job.in_flight -= 1
+            job.done_chunks += 1
+            job.done_items += len(payload)
+            finished = self._finish_if_complete(job)
+        job._put((context, result))
+        if finished:
+            job._put(_JOB_DONE)
+        self._fill()
+
+    def _chunk_failed(self, job, pool, error):
+        with self._lock:
+            self._in_flight -= 1
+            job.in_flight -= 1
+            if isinstance(error, BrokenProcessPool) and pool is self._pool:
+                # a worker died: later chunks go to a fresh pool
+                self._pool.shutdown(wait=False)
+                self._pool = self._new_pool()
+            if job.error is None:
+                job.error = error
+                job.pending = []
+                if job in self._active:
+                    self._active.remove(job)
+            finished = self._finish_if_complete(job)
+        if finished:
+            job._put(_JOB_DONE)
+        self._fill()
+
+    def _finish_if_complete(self, job):
+        """Marks the job finished once nothing of it is left to run (called with the lock held)."""
+        if job.finished or job.in_flight or job.pending:
+            return False
+        if job.error is None and (not job.closed or job.done_chunks < job.total_chunks):
+            return False
+        job.finished_at = time.time()
+        return True
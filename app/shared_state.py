@@ -0,0 +1,328 @@
+import os
+import json
+import time
+import fcntl
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+
+class SharedState(ABC):
+    ''' State shared by every server process on the host (uvicorn --workers N).
+
+        Holds the admin sessions, which process owns each submission run, the
+        runs' event logs and job statuses, the admission tickets and named
+        locks (e.g. around leaderboard writes). A run is owned by the process that claimed it and
+        kept alive by touch_run(); a run whose owner stopped touching it for
+        stale_after seconds can be taken over (its owner died).
+    '''
+    def __init__(self, stale_after=30.0, retention=3600.0):
+        self.stale_after = stale_after
+        self.retention = retention
+
+    # admin sessions
+    @abstractmethod
+    def add_session(self, token, ttl):
+        """Stores an admin session token, valid for ttl seconds."""
+
+    @abstractmethod
+    def has_session(self, token):
+        """Whether token is an admin session that has not expired."""
+
+    @abstractmethod
+    def remove_session(self, token):
+        """Ends the admin session token."""
+
+    # submission runs
+    @abstractmethod
+    def claim_run(self, run_id, name, takeover=False):
+        ''' Makes this process the owner of run_id, starting an empty event log.
+            Fails (False) if the run exists and is finished or has a live owner,
+            unless takeover.
+        '''
+
+    @abstractmethod
+    def touch_run(self, run_id, status=None):
+        """Owner's heartbeat, with the run's current job status (see /api/jobs)."""
+
+    @abstractmethod
+    def append_run_events(self, run_id, messages, final=False):
+        """Appends messages (in seq order) to the event log of run_id; final marks the run finished."""
+
+    @abstractmethod
+    def run_events(self, run_id, cursor=0):
+        ''' Events of run_id from seq == cursor on.
+            @output: (events, state) with state "running", "finished" or "stale"; None for an unknown run
+        '''
+
+    @abstractmethod
+    def run_statuses(self):
+        """Job statuses last reported by the owners of unfinished runs."""
+
+    def _run_state(self, finished, updated_at):
+        if finished:
+            return "finished"
+        return "stale" if time.time() - updated_at >= self.stale_after else "running"
+
+    # admission tickets (see AdmissionController, which holds lock("admission") around them)
+    @abstractmethod
+    def tickets(self):
+        ''' Admitted tickets in admission order.
+            @output: [{"ticket_id", "participant", "cost", "admitted_at", "started_at", "owner" (pid)}]
+        '''
+
+    @abstractmethod
+    def add_ticket(self, ticket):
+        """Queues ticket (a dict as returned by tickets()) last, replacing a ticket with the same id."""
+
+    @abstractmethod
+    def start_ticket(self, ticket_id, started_at, owner):
+        """Marks ticket_id as being scored by the process owner; False if it is unknown."""
+
+    @abstractmethod
+    def remove_ticket(self, ticket_id):
+        """Removes ticket_id; returns the removed ticket, None if it is unknown."""
+
+    # locks
+    @abstractmethod
+    def lock(self, name):
+        """Context manager holding the lock name across all processes."""
+
+
+class LocalState(SharedState):
+    """SharedState of a single process, kept in memory."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._sessions = {}
+        self._runs = {}
+        self._tickets = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def add_session(self, token, ttl):
+        with self._lock:
+            self._sessions[token] = time.time() + ttl
+
+    def has_session(self, token):
+        with self._lock:
+            expires_at = self._sessions.get(token)
+            if expires_at is not None and expires_at < time.time():
+                del self._sessions[token]
+                expires_at = None
+            return expires_at is not None
+
+    def remove_session(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def claim_run(self, run_id, name, takeover=False):
+        now = time.time()
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is not None and not takeover and (
+                    run['finished'] or now - run['updated_at'] < self.stale_after):
+                return False
+            self._runs[run_id] = {'name': name, 'events': [], 'finished': False, 'updated_at': now,
+                                  'status': None}
+            for old_id in [old_id for old_id, old in self._runs.items()
+                           if old['finished'] and now - old['updated_at'] > self.retention]:
+                del self._runs[old_id]
+            return True
+
+    def touch_run(self, run_id, status=None):
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is not None:
+                run['updated_at'] = time.time()
+                if status is not None:
+                    run['status'] = status
+
+    def append_run_events(self, run_id, messages, final=False):
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is not None:
+                run['events'].extend(messages)
+                run['finished'] = run['finished'] or final
+                run['updated_at'] = time.time()
+
+    def run_events(self, run_id, cursor=0):
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None:
+                return None
+            return list(run['events'][cursor:]), self._run_state(run['finished'], run['updated_at'])
+
+    def run_statuses(self):
+        with self._lock:
+            return [run['status'] for run in self._runs.values() if not run['finished'] and run['status']]
+
+    def tickets(self):
+        with self._lock:
+            return [dict(ticket) for ticket in self._tickets.values()]
+
+    def add_ticket(self, ticket):
+        with self._lock:
+            self._tickets.pop(ticket['ticket_id'], None)
+            self._tickets[ticket['ticket_id']] = dict(ticket)
+
+    def start_ticket(self, ticket_id, started_at, owner):
+        with self._lock:
+            ticket = self._tickets.get(ticket_id)
+            if ticket is None:
+                return False
+            if ticket['started_at'] is None:
+                ticket['started_at'] = started_at
+            ticket['owner'] = owner
+            return True
+
+    def remove_ticket(self, ticket_id):
+        with self._lock:
+            return self._tickets.pop(ticket_id, None)
+
+    def lock(self, name):
+        with self._lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+        return lock
+
+
+class SQLiteState(SharedState):
+    ''' SharedState in a SQLite database (WAL mode) on the local disk.
+
+        Every process opens its own connection; locks are flock()s on files
+        next to the database, released by the kernel if the holder dies.
+    '''
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS sessions (token TEXT PRIMARY KEY, expires_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY, name TEXT, owner TEXT, finished INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL, status TEXT);
+            CREATE TABLE IF NOT EXISTS run_events (
+                run_id TEXT NOT NULL, seq INTEGER NOT NULL, message TEXT NOT NULL, PRIMARY KEY (run_id, seq));
+            CREATE TABLE IF NOT EXISTS tickets (
+                ticket_id TEXT PRIMARY KEY, participant TEXT, cost REAL NOT NULL, admitted_at REAL NOT NULL,
+                started_at REAL, owner INTEGER NOT NULL);
+        ''')
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def add_session(self, token, ttl):
+        with self._transaction() as db:
+            db.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),))
+            db.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?)", (token, time.time() + ttl))
+
+    def has_session(self, token):
+        return bool(self._query("SELECT 1 FROM sessions WHERE token = ? AND expires_at >= ?", (token, time.time())))
+
+    def remove_session(self, token):
+        self._query("DELETE FROM sessions WHERE token = ?", (token,))
+
+    def claim_run(self, run_id, name, takeover=False):
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute("SELECT finished, updated_at FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            if row is not None and not takeover and (row[0] or now - row[1] < self.stale_after):
+                return False
+            db.execute("DELETE FROM run_events WHERE run_id = ?", (run_id,))
+            db.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, 0, ?, NULL)",
+                       (run_id, name, str(os.getpid()), now))
+            expired = "SELECT run_id FROM runs WHERE finished = 1 AND updated_at < ?"
+            db.execute(f"DELETE FROM run_events WHERE run_id IN ({expired})", (now - self.retention,))
+            db.execute("DELETE FROM runs WHERE finished = 1 AND updated_at < ?", (now - self.retention,))
+            return True
+
+    def touch_run(self, run_id, status=None):
+        if status is None:
+            self._query("UPDATE runs SET updated_at = ? WHERE run_id = ?", (time.time(), run_id))
+        else:
+            self._query("UPDATE runs SET updated_at = ?, status = ? WHERE run_id = ?",
+                        (time.time(), json.dumps(status), run_id))
+
+    def append_run_events(self, run_id, messages, final=False):
+        with self._transaction() as db:
+            db.executemany("INSERT INTO run_events VALUES (?, ?, ?)",
+                           [(run_id, message['seq'], json.dumps(message, ensure_ascii=False))
+                            for message in messages])
+            db.execute("UPDATE runs SET updated_at = ?, finished = MAX(finished, ?) WHERE run_id = ?",
+                       (time.time(), int(final), run_id))
+
+    def run_events(self, run_id, cursor=0):
+        with self._lock:
+            row = self._db.execute("SELECT finished, updated_at FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            if row is None:
+                return None
+            events = self._db.execute("SELECT message FROM run_events WHERE run_id = ? AND seq >= ? ORDER BY seq",
+                                      (run_id, cursor)).fetchall()
+        return [json.loads(message) for message, in events], self._run_state(row[0], row[1])
+
+    def run_statuses(self):
+        rows = self._query("SELECT status FROM runs WHERE finished = 0 AND status IS NOT NULL")
+        return [json.loads(status) for status, in rows]
+
+    _TICKET_COLUMNS = ("ticket_id", "participant", "cost", "admitted_at", "started_at", "owner")
+
+    def tickets(self):
+        # rowid grows with every insert, so it orders the tickets by admission
+        rows = self._query(f"SELECT {', '.join(self._TICKET_COLUMNS)} FROM tickets ORDER BY rowid")
+        return [dict(zip(self._TICKET_COLUMNS, row)) for row in rows]
+
+    def add_ticket(self, ticket):
+        with self._transaction() as db:
+            db.execute("DELETE FROM tickets WHERE ticket_id = ?", (ticket['ticket_id'],))
+            db.execute("INSERT INTO tickets VALUES (?, ?, ?, ?, ?, ?)",
+                       tuple(ticket[column] for column in self._TICKET_COLUMNS))
+
+    def start_ticket(self, ticket_id, started_at, owner):
+        with self._transaction() as db:
+            updated = db.execute("UPDATE tickets SET started_at = COALESCE(started_at, ?), owner = ? "
+                                 "WHERE ticket_id = ?", (started_at, owner, ticket_id)).rowcount
+        return updated > 0
+
+    def remove_ticket(self, ticket_id):
+        with self._transaction() as db:
+            row = db.execute(f"SELECT {', '.join(self._TICKET_COLUMNS)} FROM tickets WHERE ticket_id = ?",
+                             (ticket_id,)).fetchone()
+            db.execute("DELETE FROM tickets WHERE ticket_id = ?", (ticket_id,))
+        return dict(zip(self._TICKET_COLUMNS, row)) if row is not None else None
+
+    @contextmanager
+    def lock(self, name):
+        with open(f"{self.path}.{name}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def open_shared_state(backend, path):
+    ''' SharedState for the backend named in the configuration.
+        @params backend: "sqlite" (processes on one host, stored at path) or "memory" (single process)
+    '''
+    if backend == "memory":
+        return LocalState()
+    if backend == "sqlite":
+        return SQLiteState(path)
+    raise ValueError(f"Unknown shared state backend: {backend!r}")
@@ -0,0 +1,62 @@
+import numpy as np
+
+# (slice name, feature, bucket upper bounds, bucket labels); a value goes to the
+# first bucket whose bound it does not exceed, entries without a table to "none"
+SIZE_SLICES = (
+    ("size", "n_nodes", (50, 200), ("small", "medium", "large")),
+    ("rows", "n_rows", (10, 30), ("1-10", "11-30", "31+")),
+    ("cols", "n_cols", (4, 8), ("1-4", "5-8", "9+")),
+    ("length", "text_length", (1000, 5000), ("<=1k", "1k-5k", ">5k")),
+)
+
+
+def _bucket_labels(values, bounds, labels, has_table):
+    codes = np.searchsorted(np.asarray(bounds), values, side='left') + 1
+    codes[~has_table] = 0
+    return codes, ("none",) + tuple(labels)
+
+
+def _group(codes, names, scores, valid):
+    ''' Vectorized group-by of one slice dimension.
+        @output: {label: {"count", "valid_count", "teds"}} for non-empty groups
+    '''
+    n_groups = len(names)
+    counts = np.bincount(codes, minlength=n_groups)
+    valid_counts = np.bincount(codes, weights=valid, minlength=n_groups)
+    score_sums = np.bincount(codes, weights=scores, minlength=n_groups)
+    groups = {}
+    for code in np.flatnonzero(counts):
+        groups[names[code]] = {
+            "count": int(counts[code]),
+            "valid_count": int(valid_counts[code]),
+            # missing / error entries count as 0, as in the overall TEDS
+            "teds": round(float(score_sums[code] / counts[code]), 4),
+        }
+    return groups
+
+
+def summarize_slices(details, gt_store):
+    ''' Per-slice TEDS of one submission, from its per-item details and the
+        statistics index of the ground truth store.
+        @output: {slice name: {label: {"count", "valid_count", "teds"}}}
+    '''
+    features = gt_store.features
+    index = np.fromiter((gt_store.index_of(item["id"]) for item in details),
+                        dtype=np.int64, count=len(details))
+    known = index >= 0
+    index = index[known]
+    scores = np.fromiter((item["score"] for item in details), dtype=np.float64, count=len(details))[known]
+    valid = np.fromiter((item["status"] == "valid" for item in details), dtype=np.float64,
+                        count=len(details))[known]
+    has_table = features["n_nodes"][index] > 0
+
+    slices = {
+        "format": _group(features["source_format"][index].astype(np.int64), gt_store.format_names,
+                         scores, valid),
+        "spans": _group(np.where(has_table, 1 + (features["n_spans"][index] > 0), 0),
+                        ("none", "no_spans", "spanned"), scores, valid),
+    }
+    for name, feature, bounds, labels in SIZE_SLICES:
+        codes, names = _bucket_labels(features[feature][index], bounds, labels, has_table)
+        slices[name] = _group(codes, names, scores, valid)
+    return slices
@@ -0,0 +1,154 @@
+// 排行榜即時更新：訂閱 /api/leaderboard/events，依伺服器推送的名次差異更新表格，不需重新載入頁面
+(function () {
+    const BADGES = {
+        1: ['badge-gold', '🥇 1'],
+        2: ['badge-silver', '🥈 2'],
+        3: ['badge-bronze', '🥉 3']
+    };
+    // 新增或名次變動的列短暫高亮的毫秒數
+    const FLASH_MS = 3000;
+
+    function LiveLeaderboard(root) {
+        this.root = root;
+        this.table = root.querySelector('table');
+        this.tbody = root.querySelector('tbody');
+        this.empty = root.querySelector('.info-text');
+        this.template = root.querySelector('.leaderboard-row-template');
+        this.version = root.dataset.version;
+        this.source = null;
+    }
+
+    LiveLeaderboard.prototype.names = function () {
+        return Array.from(this.tbody.querySelectorAll('tr[data-name]')).map(function (row) {
+            return row.dataset.name;
+        });
+    };
+
+    LiveLeaderboard.prototype.row = function (name) {
+        return Array.from(this.tbody.children).find(function (row) {
+            return row.dataset.name === name;
+        });
+    };
+
+    LiveLeaderboard.prototype.createRow = function (name, teds) {
+        const row = this.template.content.firstElementChild.cloneNode(true);
+        row.dataset.name = name;
+        row.querySelector('.name-cell').textContent = name;
+        row.querySelector('.detail-btn').href = '/details/' + encodeURIComponent(name);
+        this.setScore(row, teds);
+        return row;
+    };
+
+    LiveLeaderboard.prototype.setScore = function (row, teds) {
+        row.querySelector('.teds-cell').textContent = Number(teds).toFixed(4);
+    };
+
+    LiveLeaderboard.prototype.place = function (row, rank) {
+        const before = this.tbody.children[rank - 1] || null;
+        if (before !== row) {
+            this.tbody.insertBefore(row, before);
+        }
+    };
+
+    LiveLeaderboard.prototype.flash = function (row) {
+        if (row.classList.contains('highlight-row')) {
+            return;
+        }
+        row.classList.add('highlight-row');
+        setTimeout(function () {
+            // 固定高亮的列（例如自己剛完成的提交）不移除
+            if (!row.dataset.pinned) {
+                row.classList.remove('highlight-row');
+            }
+        }, FLASH_MS);
+    };
+
+    LiveLeaderboard.prototype.apply = function (ops) {
+        const self = this;
+        ops.forEach(function (op) {
+            let row = self.row(op.name);
+            if (op.op === 'delete') {
+                if (row) {
+                    row.remove();
+                }
+            } else if (op.op === 'insert' || op.op === 'move') {
+                if (!row) {
+                    row = self.createRow(op.name, op.teds);
+                } else {
+                    self.setScore(row, op.teds);
+                }
+                self.place(row, op.rank);
+                self.flash(row);
+            } else if (op.op === 'update' && row) {
+                self.setScore(row, op.teds);
+                self.flash(row);
+            }
+        });
+        this.renumber();
+    };
+
+    LiveLeaderboard.prototype.reset = function (entries) {
+        const self = this;
+        const rows = entries.map(function (entry) {
+            const row = self.row(entry.name);
+            if (row) {
+                self.setScore(row, entry.teds);
+                return row;
+            }
+            return self.createRow(entry.name, entry.teds);
+        });
+        this.tbody.replaceChildren.apply(this.tbody, rows);
+        this.renumber();
+    };
+
+    LiveLeaderboard.prototype.renumber = function () {
+        Array.from(this.tbody.children).forEach(function (row, index) {
+            const rank = index + 1;
+            const cell = row.querySelector('.rank-cell');
+            if (BADGES[rank]) {
+                const badge = document.createElement('span');
+                badge.className = 'badge ' + BADGES[rank][0];
+                badge.textContent = BADGES[rank][1];
+                cell.replaceChildren(badge);
+            } else {
+                cell.textContent = rank;
+            }
+        });
+        const hasRows = this.tbody.children.length > 0;
+        this.table.style.display = hasRows ? '' : 'none';
+        this.empty.style.display = hasRows ? 'none' : '';
+    };
+
+    LiveLeaderboard.prototype.connect = function () {
+        const self = this;
+        if (!window.EventSource) {
+            return;
+        }
+        // 之後 EventSource 自動重新連線時會以 Last-Event-ID 帶回最後套用的版本
+        this.source = new EventSource('/api/leaderboard/events?version=' + encodeURIComponent(this.version || ''));
+        this.source.onmessage = function (event) {
+            const message = JSON.parse(event.data);
+            if (message.type === 'reset') {
+                self.reset(message.leaderboard);
+                self.version = message.version;
+            } else if (message.type === 'diff') {
+                if (message.base === self.version) {
+                    self.apply(message.ops);
+                    self.version = message.version;
+                } else if (message.version !== self.version) {
+                    // 漏掉了某次變更：重新連線取得完整的排行榜
+                    self.source.close();
+                    self.connect();
+                }
+            }
+        };
+    };
+
+    document.querySelectorAll('.live-leaderboard').forEach(function (root) {
+        if (root.liveLeaderboard) {
+            return;
+        }
+        root.liveLeaderboard = new LiveLeaderboard(root);
+        root.liveLeaderboard.connect();
+    });
+})();
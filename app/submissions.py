@@ -0,0 +1,156 @@
+import time
+import asyncio
+from collections import OrderedDict
+
+
+class SubmissionRun(object):
+    ''' Event log of one submission's evaluation, addressed by its run id.
+
+        Every message published gets a sequence number ("seq") and is kept, so
+        any number of viewers can follow the run and a viewer that reconnects
+        replays from the last seq it saw instead of losing the run. All methods
+        are called from the event loop. With a shared state the messages are
+        also written to it, so viewers connected to other processes can follow;
+        the writes run in a thread, one batch (transaction) at a time, so a busy
+        shared state never blocks the loop.
+    '''
+    def __init__(self, run_id, name, state=None):
+        self.run_id = run_id
+        self.name = name
+        self.state = state
+        self.events = []
+        self.finished_at = None
+        self.started_at = time.time()
+        self.task = None
+        self._changed = asyncio.Event()
+        self._unsaved = []
+        self._writer = None
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def publish(self, message, final=False):
+        message = dict(message, seq=len(self.events))
+        self.events.append(message)
+        if final:
+            self.finished_at = time.time()
+        if self.state is not None:
+            self._unsaved.append(message)
+            if self._writer is None or self._writer.done():
+                self._writer = asyncio.get_running_loop().create_task(self._save_events())
+        # wake the viewers waiting for this message, later ones wait on a new event
+        self._changed.set()
+        self._changed = asyncio.Event()
+        return message
+
+    async def _save_events(self):
+        """Writes the messages published so far to the shared state, in order, until none are left."""
+        while self._unsaved:
+            # the final message is the last one published, so a batch taken after it holds it
+            batch, self._unsaved = self._unsaved, []
+            try:
+                await asyncio.to_thread(self.state.append_run_events, self.run_id, batch, self.finished)
+            except Exception as e:
+                print(f"[ERROR] Saving events of run {self.run_id}: {e}")
+
+    async def stream(self, cursor=0):
+        ''' Yields the messages from seq == cursor on, waiting for new ones until the run has finished.
+            A cursor past the end of the log comes from a run of the same id before a
+            restart (the resumed run starts a new log), so it replays from the start.
+        '''
+        cursor = max(0, cursor)
+        if cursor > len(self.events):
+            cursor = 0
+        while True:
+            changed = self._changed
+            while cursor < len(self.events):
+                yield self.events[cursor]
+                cursor += 1
+            if self.finished:
+                return
+            await changed.wait()
+
+
+class RemoteSubmissionRun(object):
+    ''' A run owned by another server process, followed through the shared state.
+        stream() polls its event log; it also ends when the owner stopped
+        reporting (stale), the viewer reconnects once the run is taken over.
+    '''
+    def __init__(self, run_id, state, poll_interval=0.5):
+        self.run_id = run_id
+        self.state = state
+        self.poll_interval = poll_interval
+
+    async def stream(self, cursor=0):
+        cursor = max(0, cursor)
+        first = True
+        while True:
+            found = await asyncio.to_thread(self.state.run_events, self.run_id, 0 if first else cursor)
+            if found is None:
+                return
+            events, state = found
+            if first:
+                # as in SubmissionRun.stream, a cursor past the end of the log replays from the start
+                if cursor > len(events):
+                    cursor = 0
+                events = events[cursor:]
+                first = False
+            for message in events:
+                yield message
+                cursor = message['seq'] + 1
+            if state != "running":
+                return
+            await asyncio.sleep(self.poll_interval)
+
+
+class SubmissionRegistry(object):
+    ''' Running and recently finished submission runs.
+        Finished runs are kept (oldest dropped beyond max_finished) so a late
+        reconnect can still replay the end of a run.
+
+        With a shared state (several server processes), a run is started only
+        by the process that claims it; the others follow it as a
+        RemoteSubmissionRun. The owner reports its heartbeat and
+        job_status(run_id) every heartbeat_interval seconds.
+    '''
+    def __init__(self, max_finished=100, state=None, job_status=None, heartbeat_interval=5.0):
+        self.max_finished = max_finished
+        self.state = state
+        self.job_status = job_status
+        self.heartbeat_interval = heartbeat_interval
+        self.runs = OrderedDict()
+
+    async def get(self, run_id):
+        run = self.runs.get(run_id)
+        if (run is None and self.state is not None
+                and await asyncio.to_thread(self.state.run_events, run_id, 0) is not None):
+            run = RemoteSubmissionRun(run_id, self.state)
+        return run
+
+    async def start(self, run_id, name, run_coroutine, takeover=False):
+        ''' Creates the run and starts run_coroutine(run) as a task on the running loop.
+            The task is independent of the viewers: it completes even if every
+            connection is gone. Returns a RemoteSubmissionRun instead if another
+            process already owns run_id (takeover: claim it anyway, e.g. to resume it).
+        '''
+        if self.state is not None and not await asyncio.to_thread(self.state.claim_run, run_id, name, takeover):
+            return RemoteSubmissionRun(run_id, self.state)
+        run = SubmissionRun(run_id, name, self.state)
+        self.runs[run_id] = run
+        self._prune()
+        run.task = asyncio.get_running_loop().create_task(run_coroutine(run))
+        if self.state is not None:
+            asyncio.get_running_loop().create_task(self._heartbeat(run))
+        return run
+
+    async def _heartbeat(self, run):
+        while not run.task.done():
+            status = self.job_status(run.run_id) if self.job_status else None
+            await asyncio.to_thread(self.state.touch_run, run.run_id, status)
+            await asyncio.sleep(self.heartbeat_interval)
+
+    def _prune(self):
+        finished = [run_id for run_id, run in self.runs.items() if run.finished]
+        for run_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.runs[run_id]
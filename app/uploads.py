@@ -0,0 +1,292 @@
+import os
+import io
+import json
+import zlib
+import uuid
+import asyncio
+import hashlib
+import zipfile
+
+from starlette.responses import JSONResponse
+
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+class UploadTooLarge(ValueError):
+    def __init__(self, max_bytes):
+        super().__init__(f"檔案過大：上限為 {max_bytes / (1024 * 1024):.1f} MB（解壓縮後）。")
+        self.max_bytes = max_bytes
+
+
+class UploadCorrupted(ValueError):
+    pass
+
+
+class RequestTooLarge(ValueError):
+    def __init__(self, max_bytes):
+        super().__init__(f"請求過大：上限為 {max_bytes / (1024 * 1024):.1f} MB。")
+        self.max_bytes = max_bytes
+
+
+class RequestSizeLimit(object):
+    ''' ASGI middleware bounding the request body before the app parses it.
+
+        limit_for(scope) returns the maximum body size of a request (None: no
+        limit). A request whose Content-Length is over the limit is answered
+        413 without reading its body; a body that grows past the limit while
+        it is received (chunked, or a wrong Content-Length) stops the receive
+        and is answered 413 as well, whatever response the app was about to
+        send. So the limit bounds what the multipart parser spools to disk.
+    '''
+    def __init__(self, app, limit_for):
+        self.app = app
+        self.limit_for = limit_for
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = self.limit_for(scope) if scope["type"] == "http" else None
+        if max_bytes is None:
+            await self.app(scope, receive, send)
+            return
+        declared = dict(scope["headers"]).get(b"content-length", b"")
+        if declared.isdigit() and int(declared) > max_bytes:
+            await self._reject(scope, receive, send, max_bytes)
+            return
+
+        received = 0
+        exceeded = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    exceeded = True
+                    raise RequestTooLarge(max_bytes)
+            return message
+
+        async def guarded_send(message):
+            nonlocal rejected
+            if not exceeded:
+                await send(message)
+            elif not rejected:
+                # the app turned the aborted body into its own error response
+                rejected = True
+                await self._reject(scope, receive, send, max_bytes)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except RequestTooLarge:
+            if not rejected:
+                rejected = True
+                await self._reject(scope, receive, send, max_bytes)
+
+    @staticmethod
+    async def _reject(scope, receive, send, max_bytes):
+        response = JSONResponse(status_code=413, headers={"Connection": "close"},
+                                content={"success": False, "error": str(RequestTooLarge(max_bytes))})
+        await response(scope, receive, send)
+
+
+class StoredUpload(object):
+    ''' An upload written to a temporary file next to its destination.
+        publish() moves it into place, remove() discards it.
+    '''
+    def __init__(self, tmp_path, dest_path, size, sha256, compressed):
+        self.tmp_path = tmp_path
+        self.dest_path = dest_path
+        self.size = size
+        self.sha256 = sha256
+        self.compressed = compressed
+
+    def publish(self):
+        ''' Atomically creates dest_path with the upload's content.
+            Returns False (and keeps the temporary file) if dest_path already exists,
+            so concurrent uploads of the same name cannot overwrite each other.
+        '''
+        try:
+            os.link(self.tmp_path, self.dest_path)
+        except FileExistsError:
+            return False
+        os.remove(self.tmp_path)
+        return True
+
+    def remove(self):
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class _UploadWriter(object):
+    """Decompresses (gzip, detected by its magic bytes), hashes and writes the chunks; runs in a thread."""
+
+    def __init__(self, f, max_bytes):
+        self.f = f
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.decompressor = None
+        self.started = False
+
+    def write(self, chunk):
+        if not self.started:
+            self.started = True
+            if chunk.startswith(_GZIP_MAGIC):
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self.decompressor is None:
+            self._emit(chunk)
+            return
+        try:
+            # bounded output per call: a small compressed upload cannot expand unchecked
+            data = self.decompressor.decompress(chunk, self.max_bytes - self.size + 1)
+            self._emit(data)
+            while self.decompressor.unconsumed_tail:
+                data = self.decompressor.decompress(self.decompressor.unconsumed_tail,
+                                                    self.max_bytes - self.size + 1)
+                self._emit(data)
+        except zlib.error as e:
+            raise UploadCorrupted(f"gzip 解壓縮失敗：{e}")
+
+    def finish(self):
+        if self.decompressor is not None:
+            try:
+                self._emit(self.decompressor.flush())
+            except zlib.error as e:
+                raise UploadCorrupted(f"gzip 解壓縮失敗：{e}")
+            if not self.decompressor.eof:
+                raise UploadCorrupted("gzip 檔案不完整。")
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def _emit(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(self.max_bytes)
+        self.digest.update(data)
+        self.f.write(data)
+
+
+def _stored(tmp_path, dest_path, writer):
+    return StoredUpload(tmp_path, dest_path, writer.size, writer.digest.hexdigest(),
+                        writer.decompressor is not None)
+
+
+def store_stream(stream, dest_path, max_bytes, chunk_size=1 << 20):
+    """Synchronous store_upload for a binary file object (e.g. a zip archive member)."""
+    tmp_path = f"{dest_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            writer = _UploadWriter(f, max_bytes)
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                writer.write(chunk)
+            writer.finish()
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return _stored(tmp_path, dest_path, writer)
+
+
+async def store_upload(upload, dest_path, max_bytes, chunk_size=1 << 20):
+    ''' Streams an UploadFile to a temporary file next to dest_path without
+        blocking the event loop: chunks are read asynchronously, then
+        decompressed (gzip uploads), hashed and written in a worker thread.
+        @output: StoredUpload with the size and SHA-256 of the (decompressed) content
+        Raises UploadTooLarge past max_bytes of content, UploadCorrupted for a broken gzip stream.
+    '''
+    tmp_path = f"{dest_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            writer = _UploadWriter(f, max_bytes)
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                await asyncio.to_thread(writer.write, chunk)
+            await asyncio.to_thread(writer.finish)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return _stored(tmp_path, dest_path, writer)
+
+
+_SUBMISSION_SUFFIXES = ('.gz', '.jsonl', '.json')
+
+
+def check_submission_name(name):
+    """Returns name if it can be used as a submission (file) name, raises UploadCorrupted otherwise."""
+    if not isinstance(name, str) or not name.strip() or name.startswith('.') or '/' in name or '\\' in name:
+        raise UploadCorrupted(f"名稱不合法：{name!r}")
+    return name
+
+
+def submission_name(filename):
+    """Submission name for an uploaded file name: its base name without .json / .jsonl / .gz."""
+    name = os.path.basename((filename or '').replace('\\', '/'))
+    for suffix in _SUBMISSION_SUFFIXES:
+        if name.lower().endswith(suffix):
+            name = name[:-len(suffix)]
+    return check_submission_name(name)
+
+
+def split_batch_upload(stored, filename, dest_dir, max_bytes):
+    ''' Splits a stored batch upload into one StoredUpload per submission,
+        each destined for dest_dir/<name>.json; takes ownership of stored.
+        - zip archive: one submission per *.json / *.jsonl member (optionally .gz), named after the member
+        - JSON Lines (*.jsonl, optionally gzip-compressed): one {"name": ..., "predictions": {...}} per line
+        - anything else: a single submission named after filename
+        @output: [(name, StoredUpload), ...]
+        Raises UploadTooLarge past max_bytes per submission, UploadCorrupted for a broken archive or line.
+    '''
+    members = []
+    lower = (filename or '').lower()
+    try:
+        if lower.endswith('.zip'):
+            try:
+                with zipfile.ZipFile(stored.tmp_path) as archive:
+                    for info in archive.infolist():
+                        base = os.path.basename(info.filename)
+                        if (info.is_dir() or base.startswith('.') or info.filename.startswith('__MACOSX/')
+                                or not base.lower().endswith(('.json', '.json.gz', '.jsonl', '.jsonl.gz'))):
+                            continue
+                        name = submission_name(base)
+                        with archive.open(info) as member:
+                            members.append((name, store_stream(member, os.path.join(dest_dir, f"{name}.json"),
+                                                               max_bytes)))
+            except (zipfile.BadZipFile, zipfile.LargeZipFile, NotImplementedError) as e:
+                raise UploadCorrupted(f"zip 檔案無法讀取：{e}")
+            stored.remove()
+        elif lower.endswith(('.jsonl', '.jsonl.gz')):
+            with open(stored.tmp_path, 'rb') as f:
+                # one submission per line; reading a line is bounded by max_bytes as well
+                for line_number, line in enumerate(iter(lambda: f.readline(max_bytes + 2), b''), 1):
+                    if len(line) > max_bytes + 1:
+                        raise UploadTooLarge(max_bytes)
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                        name, predictions = record['name'], record['predictions']
+                    except (ValueError, TypeError, KeyError):
+                        raise UploadCorrupted(f'第 {line_number} 行格式錯誤：每行必須是 {{"name": ..., "predictions": {{...}}}}。')
+                    name = check_submission_name(name)
+                    data = json.dumps(predictions, ensure_ascii=False).encode('utf-8')
+                    members.append((name, store_stream(io.BytesIO(data), os.path.join(dest_dir, f"{name}.json"),
+                                                       max_bytes)))
+            stored.remove()
+        else:
+            if stored.size > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            name = submission_name(filename)
+            members.append((name, StoredUpload(stored.tmp_path, os.path.join(dest_dir, f"{name}.json"),
+                                               stored.size, stored.sha256, stored.compressed)))
+    except BaseException:
+        stored.remove()
+        for _, member in members:
+            member.remove()
+        raise
+    return members
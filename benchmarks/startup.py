@@ -0,0 +1,82 @@
+"""
+Startup benchmark: import time and RSS of the modules loaded by the server and
+by every scoring worker, each measured in a fresh interpreter.
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/startup.py [--gt data/ground_truth.json] [--repeat 5]
+
+"scoring worker" is a process that imports app.evaluation and attaches the
+ground truth store, i.e. what a pool worker does before its first chunk.
+"+ other metrics" also imports app.other_metrics (KIE / document / OCR /
+chart metrics), "previous eager imports" is everything importing
+app.TEDS_metric used to load before those metrics were split out of it.
+Linux only (peak RSS is read from /proc).
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# peak RSS is read from VmHWM: ru_maxrss keeps the parent's peak across fork + exec
+_MEASURE = '''
+import sys, time, json
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+with open("/proc/self/status") as f:
+    rss_kib = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+print(json.dumps({{"seconds": elapsed, "rss_mib": rss_kib / 1024, "modules": len(sys.modules)}}))
+'''
+
+CASES = [
+    ("app.TEDS_metric", "import app.TEDS_metric"),
+    ("app.TEDS_metric + other metrics", "import app.TEDS_metric, app.other_metrics"),
+    ("previous eager imports",
+     "import app.TEDS_metric, app.other_metrics, ipdb, distance, tqdm, lxml.html, ast, string"),
+    ("app.evaluation", "import app.evaluation"),
+    ("scoring worker", "import app.evaluation\napp.evaluation._init_scoring_worker({store!r})"),
+    ("scoring worker + other metrics",
+     "import app.evaluation, app.other_metrics\napp.evaluation._init_scoring_worker({store!r})"),
+    ("app.main", "import app.main"),
+]
+
+
+def measure(code, repeat):
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", _MEASURE.format(code=code)], cwd=ROOT,
+                                check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "seconds": statistics.median(run["seconds"] for run in runs),
+        "rss_mib": statistics.median(run["rss_mib"] for run in runs),
+        "modules": runs[-1]["modules"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gt", default=os.path.join(ROOT, "data", "ground_truth_example.json"),
+                        help="ground truth used to build the store attached by the workers")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case (median is reported)")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from app.evaluation import load_ground_truth, load_ground_truth_store
+
+    with tempfile.TemporaryDirectory() as tmp:
+        load_ground_truth(args.gt)
+        store = load_ground_truth_store(os.path.join(tmp, "ground_truth.gtstore")).path
+        print(f"{'case':<34} {'import':>10} {'max RSS':>10} {'modules':>8}")
+        for name, code in CASES:
+            result = measure(code.format(store=store), args.repeat)
+            print(f"{name:<34} {result['seconds'] * 1000:8.0f}ms {result['rss_mib']:7.1f}MiB {result['modules']:8d}")
+
+
+if __name__ == "__main__":
+    main()